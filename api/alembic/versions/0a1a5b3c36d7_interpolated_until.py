@@ -0,0 +1,25 @@
+"""Interpolated until
+
+Revision ID: 0a1a5b3c36d7
+Revises: 8e85e2b291a9
+Create Date: 2021-01-14 15:02:41.380537
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a1a5b3c36d7'
+down_revision = '8e85e2b291a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('prediction_model_run_timestamps', sa.Column(
+        'interpolated_until', sa.TIMESTAMP(timezone=True), nullable=True))
+
+
+def downgrade():
+    op.drop_column('prediction_model_run_timestamps', 'interpolated_until')
@@ -0,0 +1,87 @@
+"""Latest station model predictions
+
+Revision ID: 5b2e8f1d9c47
+Revises: c2a6a1b4e5f0
+Create Date: 2021-01-20 14:22:51.730914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8f1d9c47'
+down_revision = 'c2a6a1b4e5f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('latest_station_model_predictions',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('prediction_model_id', sa.Integer(), nullable=False),
+                    sa.Column('station_code', sa.Integer(), nullable=False),
+                    sa.Column('prediction_timestamp', sa.TIMESTAMP(timezone=True), nullable=False),
+                    sa.Column('prediction_model_run_timestamp_id', sa.Integer(), nullable=False),
+                    sa.Column('prediction_run_timestamp', sa.TIMESTAMP(timezone=True), nullable=False),
+                    sa.Column('tmp_tgl_2', sa.Float(), nullable=True),
+                    sa.Column('bias_adjusted_temperature', sa.Float(), nullable=True),
+                    sa.Column('rh_tgl_2', sa.Float(), nullable=True),
+                    sa.Column('bias_adjusted_rh', sa.Float(), nullable=True),
+                    sa.Column('apcp_sfc_0', sa.Float(), nullable=True),
+                    sa.Column('delta_precip', sa.Float(), nullable=True),
+                    sa.Column('prev_delta_precip', sa.Float(), nullable=True),
+                    sa.Column('wdir_tgl_10', sa.Float(), nullable=True),
+                    sa.Column('wind_tgl_10', sa.Float(), nullable=True),
+                    sa.Column('update_date', sa.TIMESTAMP(timezone=True), nullable=False),
+                    sa.ForeignKeyConstraint(['prediction_model_id'], ['prediction_models.id'], ),
+                    sa.ForeignKeyConstraint(['prediction_model_run_timestamp_id'], [
+                        'prediction_model_run_timestamps.id'], ),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('prediction_model_id', 'station_code', 'prediction_timestamp'),
+                    comment='The most recent interpolated weather values for a model, station and weather date'
+                    )
+    op.create_index(op.f('ix_latest_station_model_predictions_id'),
+                    'latest_station_model_predictions', ['id'], unique=False)
+    # Populate the table with the most recent predictions of the model runs interpolated so far.
+    op.execute("""
+INSERT INTO latest_station_model_predictions (
+    prediction_model_id, station_code, prediction_timestamp, prediction_model_run_timestamp_id,
+    prediction_run_timestamp, tmp_tgl_2, bias_adjusted_temperature, rh_tgl_2, bias_adjusted_rh, apcp_sfc_0,
+    delta_precip, prev_delta_precip, wdir_tgl_10, wind_tgl_10, update_date)
+SELECT DISTINCT ON (prediction_model_run_timestamps.prediction_model_id,
+                    weather_station_model_predictions.station_code,
+                    weather_station_model_predictions.prediction_timestamp)
+    prediction_model_run_timestamps.prediction_model_id,
+    weather_station_model_predictions.station_code,
+    weather_station_model_predictions.prediction_timestamp,
+    prediction_model_run_timestamps.id,
+    prediction_model_run_timestamps.prediction_run_timestamp,
+    weather_station_model_predictions.tmp_tgl_2,
+    weather_station_model_predictions.bias_adjusted_temperature,
+    weather_station_model_predictions.rh_tgl_2,
+    weather_station_model_predictions.bias_adjusted_rh,
+    weather_station_model_predictions.apcp_sfc_0,
+    weather_station_model_predictions.delta_precip,
+    lead(weather_station_model_predictions.delta_precip) OVER (
+        PARTITION BY prediction_model_run_timestamps.prediction_model_id,
+                     weather_station_model_predictions.station_code,
+                     weather_station_model_predictions.prediction_timestamp
+        ORDER BY prediction_model_run_timestamps.prediction_run_timestamp DESC),
+    weather_station_model_predictions.wdir_tgl_10,
+    weather_station_model_predictions.wind_tgl_10,
+    now()
+FROM weather_station_model_predictions
+JOIN prediction_model_run_timestamps
+    ON prediction_model_run_timestamps.id = weather_station_model_predictions.prediction_model_run_timestamp_id
+ORDER BY prediction_model_run_timestamps.prediction_model_id,
+         weather_station_model_predictions.station_code,
+         weather_station_model_predictions.prediction_timestamp,
+         prediction_model_run_timestamps.prediction_run_timestamp DESC
+""")
+
+
+def downgrade():
+    op.drop_index(op.f('ix_latest_station_model_predictions_id'),
+                  table_name='latest_station_model_predictions')
+    op.drop_table('latest_station_model_predictions')
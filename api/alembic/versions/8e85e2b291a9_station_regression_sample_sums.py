@@ -0,0 +1,46 @@
+"""Station regression sample sums
+
+Revision ID: 8e85e2b291a9
+Revises: ad4f37763020
+Create Date: 2021-01-12 09:14:23.512811
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e85e2b291a9'
+down_revision = 'ad4f37763020'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('station_regression_sample_sums',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('prediction_model_id', sa.Integer(), nullable=False),
+                    sa.Column('station_code', sa.Integer(), nullable=False),
+                    sa.Column('sample_date', sa.Date(), nullable=False),
+                    sa.Column('hour', sa.Integer(), nullable=False),
+                    sa.Column('sample_key', sa.String(), nullable=False),
+                    sa.Column('count', sa.Integer(), nullable=False),
+                    sa.Column('sum_x', sa.Float(), nullable=False),
+                    sa.Column('sum_y', sa.Float(), nullable=False),
+                    sa.Column('sum_xx', sa.Float(), nullable=False),
+                    sa.Column('sum_xy', sa.Float(), nullable=False),
+                    sa.Column('update_date', sa.TIMESTAMP(timezone=True), nullable=False),
+                    sa.ForeignKeyConstraint(['prediction_model_id'], ['prediction_models.id'], ),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('prediction_model_id', 'station_code',
+                                        'sample_date', 'hour', 'sample_key'),
+                    comment='Sums of the samples used to bias adjust model predictions for a weather station'
+                    )
+    op.create_index(op.f('ix_station_regression_sample_sums_id'),
+                    'station_regression_sample_sums', ['id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_station_regression_sample_sums_id'),
+                  table_name='station_regression_sample_sums')
+    op.drop_table('station_regression_sample_sums')
@@ -0,0 +1,30 @@
+"""Data versions
+
+Revision ID: 9d1c4e7a2b36
+Revises: 5b2e8f1d9c47
+Create Date: 2021-01-25 10:41:07.118230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d1c4e7a2b36'
+down_revision = '5b2e8f1d9c47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('data_versions',
+                    sa.Column('data_source', sa.String(), nullable=False),
+                    sa.Column('version', sa.Integer(), nullable=False),
+                    sa.Column('update_date', sa.TIMESTAMP(timezone=True), nullable=False),
+                    sa.PrimaryKeyConstraint('data_source'),
+                    comment='The version of a kind of data, incremented every time new data is committed.'
+                    )
+
+
+def downgrade():
+    op.drop_table('data_versions')
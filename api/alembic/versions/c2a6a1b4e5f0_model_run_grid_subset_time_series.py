@@ -0,0 +1,63 @@
+"""Model run grid subset time series
+
+Revision ID: c2a6a1b4e5f0
+Revises: 0a1a5b3c36d7
+Create Date: 2021-01-18 10:41:07.218346
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2a6a1b4e5f0'
+down_revision = '0a1a5b3c36d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('model_run_grid_subset_time_series',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('prediction_model_run_timestamp_id', sa.Integer(), nullable=False),
+                    sa.Column('prediction_model_grid_subset_id', sa.Integer(), nullable=False),
+                    sa.Column('tmp_tgl_2', postgresql.ARRAY(sa.REAL()), nullable=True),
+                    sa.Column('rh_tgl_2', postgresql.ARRAY(sa.REAL()), nullable=True),
+                    sa.Column('apcp_sfc_0', postgresql.ARRAY(sa.REAL()), nullable=True),
+                    sa.Column('wdir_tgl_10', postgresql.ARRAY(sa.REAL()), nullable=True),
+                    sa.Column('wind_tgl_10', postgresql.ARRAY(sa.REAL()), nullable=True),
+                    sa.Column('update_date', sa.TIMESTAMP(timezone=True), nullable=False),
+                    sa.ForeignKeyConstraint(['prediction_model_grid_subset_id'], [
+                        'prediction_model_grid_subsets.id'], ),
+                    sa.ForeignKeyConstraint(['prediction_model_run_timestamp_id'], [
+                        'prediction_model_run_timestamps.id'], ),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('prediction_model_run_timestamp_id',
+                                        'prediction_model_grid_subset_id'),
+                    comment='The predictions for a grid subset of a particular model run, as a time series.'
+                    )
+    op.create_index(op.f('ix_model_run_grid_subset_time_series_id'),
+                    'model_run_grid_subset_time_series', ['id'], unique=False)
+    # Time series are written one prediction hour at a time, as the files of a model run are processed (in
+    # no particular order), by assigning the values of a prediction hour to their slice of the time series.
+    # Time series are 1 based, so a time series that doesn't exist yet is padded with NULLs up to the slice.
+    op.execute("""
+CREATE FUNCTION set_time_series_values(time_series REAL[], position INTEGER, new_values REAL[])
+RETURNS REAL[] AS $$
+BEGIN
+    IF cardinality(time_series) IS NULL OR cardinality(time_series) = 0 THEN
+        RETURN array_fill(NULL::REAL, ARRAY[position - 1]) || new_values;
+    END IF;
+    time_series[position:position + cardinality(new_values) - 1] := new_values;
+    RETURN time_series;
+END
+$$ LANGUAGE plpgsql IMMUTABLE
+""")
+
+
+def downgrade():
+    op.execute('DROP FUNCTION set_time_series_values(REAL[], INTEGER, REAL[])')
+    op.drop_index(op.f('ix_model_run_grid_subset_time_series_id'),
+                  table_name='model_run_grid_subset_time_series')
+    op.drop_table('model_run_grid_subset_time_series')
@@ -0,0 +1,28 @@
+""" CRUD operations relating to the versions of data loaded by cronjobs.
+"""
+import datetime
+from typing import Dict
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from app.db.models.data_versions import DataVersion, DataSourceEnum
+
+# Channel on which a notification is sent when a data version is bumped.
+DATA_VERSIONS_CHANNEL = 'data_versions'
+
+
+def bump_data_version(session: Session, data_source: DataSourceEnum, now: datetime.datetime):
+    """ Increment the version of a data source, and notify listeners (see app.response_cache). The caller is
+    responsible for committing, so that the new version is committed together with the new data - Postgres
+    only delivers the notification on commit. """
+    stmt = insert(DataVersion).values(data_source=data_source.value, version=1, update_date=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DataVersion.data_source],
+        set_={'version': DataVersion.version + 1, 'update_date': now})
+    session.execute(stmt)
+    session.execute(select([func.pg_notify(DATA_VERSIONS_CHANNEL, data_source.value)]))
+
+
+def get_data_versions(session: Session) -> Dict[str, int]:
+    """ Get the current version of each data source. """
+    return dict(session.query(DataVersion.data_source, DataVersion.version))
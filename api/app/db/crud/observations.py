@@ -2,10 +2,12 @@
 """
 import datetime
 from typing import List
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
-from app.db.models import ModelRunGridSubsetPrediction, PredictionModelRunTimestamp
+from sqlalchemy import Integer, and_, cast, func, null, or_
+from sqlalchemy.orm import Session, join
+from app.db.models import (ModelRunGridSubsetPrediction, ModelRunGridSubsetTimeSeries,
+                           PredictionModelRunTimestamp)
 from app.db.models.observations import HourlyActual
+from app.weather_models import MODEL_VALUE_KEYS, MAX_PREDICTION_HOURS, VERTEX_COUNT
 
 
 def get_hourly_actuals(
@@ -33,12 +35,15 @@ def get_hourly_actuals(
 def get_actuals_left_outer_join_with_predictions(  # pylint: disable=too-many-arguments
         session: Session, model_id: int, grid_id: int, station_code: int,
         start_date: datetime, end_date: datetime):
-    """
-    NOTE: Can improve this query by only returning the most recent prediction, maybe using nested
-    queries. It works for now - but things could be faster.
+    """ Query for hourly actuals for a station, each with the most recent prediction for the weather date in
+    the grid (or None, if there isn't a prediction), from start_date up to and including end_date.
+
+    Using DISTINCT ON, only the first row for each weather date is returned - which, given the ordering, is
+    the prediction from the most recent model run.
     """
     # pylint: disable=singleton-comparison
     return session.query(HourlyActual, ModelRunGridSubsetPrediction)\
+        .distinct(HourlyActual.station_code, HourlyActual.weather_date)\
         .outerjoin(ModelRunGridSubsetPrediction,
                    and_(ModelRunGridSubsetPrediction.prediction_timestamp == HourlyActual.weather_date,
                         ModelRunGridSubsetPrediction.prediction_model_grid_subset_id == grid_id))\
@@ -53,10 +58,50 @@ def get_actuals_left_outer_join_with_predictions(  # pylint: disable=too-many-ar
         .filter(HourlyActual.weather_date <= end_date)\
         .order_by(HourlyActual.station_code)\
         .order_by(HourlyActual.weather_date)\
-        .order_by(PredictionModelRunTimestamp.prediction_run_timestamp.desc())
+        .order_by(PredictionModelRunTimestamp.prediction_run_timestamp.desc().nullslast())
 
 
 def save_hourly_actual(session: Session, hourly_actual: HourlyActual):
     """ Abstraction for writing HourlyActual to database. """
     session.add(hourly_actual)
     session.commit()
+
+
+def get_actuals_with_time_series_predictions(
+        session: Session, grid_id: int, station_code: int, start_date: datetime, end_date: datetime):
+    """ Query for hourly actuals for a station, each with the timestamp of the most recent model run that
+    predicted the weather date in the grid, and the predicted values of each variable (in the order of
+    MODEL_VALUE_KEYS) at the vertices of the grid, from start_date up to and including end_date. If there
+    isn't a prediction, the model run timestamp and values are None.
+
+    Only the slice of the time series (see ModelRunGridSubsetTimeSeries) for the weather date is read, and
+    using DISTINCT ON, only the first row for each weather date is returned - which, given the ordering, is
+    the most recent model run with values for the weather date.
+    """
+    # pylint: disable=singleton-comparison
+    hours = cast(func.extract('epoch', HourlyActual.weather_date -
+                              PredictionModelRunTimestamp.prediction_run_timestamp) / 3600, Integer)
+    start = hours * VERTEX_COUNT + 1
+    slices = [getattr(ModelRunGridSubsetTimeSeries, key)[start:start + VERTEX_COUNT - 1]
+              for key in MODEL_VALUE_KEYS]
+    # A model run predicted the weather date if any of the values of the weather date are set.
+    has_value = or_(*[func.cardinality(func.array_remove(values, null())) > 0 for values in slices])
+    model_runs = join(PredictionModelRunTimestamp, ModelRunGridSubsetTimeSeries,
+                      PredictionModelRunTimestamp.id ==
+                      ModelRunGridSubsetTimeSeries.prediction_model_run_timestamp_id)
+    return session.query(HourlyActual, PredictionModelRunTimestamp.prediction_run_timestamp, *slices)\
+        .distinct(HourlyActual.station_code, HourlyActual.weather_date)\
+        .outerjoin(model_runs,
+                   and_(ModelRunGridSubsetTimeSeries.prediction_model_grid_subset_id == grid_id,
+                        PredictionModelRunTimestamp.prediction_run_timestamp <= HourlyActual.weather_date,
+                        PredictionModelRunTimestamp.prediction_run_timestamp >=
+                        HourlyActual.weather_date - datetime.timedelta(hours=MAX_PREDICTION_HOURS),
+                        has_value))\
+        .filter(HourlyActual.station_code == station_code)\
+        .filter(HourlyActual.weather_date >= start_date)\
+        .filter(HourlyActual.temp_valid == True)\
+        .filter(HourlyActual.rh_valid == True)\
+        .filter(HourlyActual.weather_date <= end_date)\
+        .order_by(HourlyActual.station_code)\
+        .order_by(HourlyActual.weather_date)\
+        .order_by(PredictionModelRunTimestamp.prediction_run_timestamp.desc().nullslast())
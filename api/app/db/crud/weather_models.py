@@ -2,13 +2,15 @@
 """
 import logging
 import datetime
-from typing import List, Union
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
-from app.weather_models import ModelEnum, ProjectionEnum
+from typing import Dict, List, Set, Tuple, Union
+from sqlalchemy import REAL, or_, cast, func, literal, null, select, union_all, update
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from app.weather_models import ModelEnum, ProjectionEnum, VERTEX_COUNT
 from app.db.models import (
     ProcessedModelRunUrl, PredictionModel, PredictionModelRunTimestamp, PredictionModelGridSubset,
-    ModelRunGridSubsetPrediction, WeatherStationModelPrediction)
+    ModelRunGridSubsetPrediction, ModelRunGridSubsetTimeSeries, WeatherStationModelPrediction,
+    LatestStationModelPrediction, StationRegressionSampleSums)
 import app.time_utils as time_utils
 
 logger = logging.getLogger(__name__)
@@ -32,26 +34,121 @@ def _construct_grid_filter(coordinates):
 # ----------- end of UTILITY FUNCTIONS ------------------------
 
 
-def get_or_create_grid_subset(session: Session,
-                              prediction_model: PredictionModel,
-                              geographic_points) -> PredictionModelGridSubset:
-    """ Get the subset of grid points of interest. """
-    geom = 'POLYGON(({} {}, {} {}, {} {}, {} {}, {} {}))'.format(
+def get_grid_subset_geom(geographic_points) -> str:
+    """ Get the WKT polygon of a grid subset, given the (clockwise) coordinates of its vertices. """
+    return 'POLYGON(({} {}, {} {}, {} {}, {} {}, {} {}))'.format(
         geographic_points[0][0], geographic_points[0][1],
         geographic_points[1][0], geographic_points[1][1],
         geographic_points[2][0], geographic_points[2][1],
         geographic_points[3][0], geographic_points[3][1],
         geographic_points[0][0], geographic_points[0][1])
-    grid_subset = session.query(PredictionModelGridSubset).\
-        filter(PredictionModelGridSubset.prediction_model_id == prediction_model.id).\
-        filter(PredictionModelGridSubset.geom == geom).first()
-    if not grid_subset:
-        logger.info('creating grid subset %s', geographic_points)
-        grid_subset = PredictionModelGridSubset(
-            prediction_model_id=prediction_model.id, geom=geom)
-        session.add(grid_subset)
-        session.commit()
-    return grid_subset
+
+
+def get_grid_subsets(session: Session, prediction_model_id: int) -> List[PredictionModelGridSubset]:
+    """ Get all the grid subsets of a prediction model. """
+    return session.query(PredictionModelGridSubset).\
+        filter(PredictionModelGridSubset.prediction_model_id == prediction_model_id).all()
+
+
+def create_grid_subsets(session: Session, prediction_model_id: int, geoms: List[str]):
+    """ Create many grid subsets in a single statement. Grid subsets that already exist (e.g. created by
+    another process in the meantime) are left as they are, and returned along with the new ones - so that
+    all processes agree on the id of each grid subset.
+    NOTE: The changes are not committed, that is left to the caller.
+
+    :return: The id and geom of each grid subset, whether it was created or already existed.
+    """
+    logger.info('creating %s grid subsets', len(geoms))
+    id_sequence = PredictionModelGridSubset.id.default
+    statement = insert(PredictionModelGridSubset).values([
+        {
+            'id': id_sequence.next_value(),
+            'prediction_model_id': prediction_model_id,
+            'geom': geom
+        } for geom in geoms])
+    # Conflicts are detected by the unique (prediction_model_id, geom) constraint. A no-op update (rather
+    # than do nothing) is used, so that RETURNING includes the grid subsets that already exist.
+    statement = statement.on_conflict_do_update(
+        index_elements=[PredictionModelGridSubset.prediction_model_id, PredictionModelGridSubset.geom],
+        set_={'prediction_model_id': statement.excluded.prediction_model_id}).returning(
+            PredictionModelGridSubset.id, PredictionModelGridSubset.geom)
+    return session.execute(statement).fetchall()
+
+
+def upsert_model_run_grid_subset_predictions(session: Session,
+                                              prediction_model_run_timestamp_id: int,
+                                              prediction_timestamp: datetime.datetime,
+                                              variable_name: str,
+                                              values: Dict[int, List[float]]):
+    """ Insert (or update, if they already exist) the values of one variable for many grid subsets, using
+    a single INSERT ... ON CONFLICT DO UPDATE statement.
+    NOTE: The changes are not committed, that is left to the caller.
+
+    :param variable_name: Name of the variable, e.g. tmp_tgl_2
+    :param values: Values at the vertices of each grid subset, keyed on grid subset id.
+    """
+    if not values:
+        return
+    column = variable_name.lower()
+    # The id sequence is referenced explicitly, so that it's evaluated for every row of a multi-row insert.
+    id_sequence = ModelRunGridSubsetPrediction.id.default
+    statement = insert(ModelRunGridSubsetPrediction).values([
+        {
+            'id': id_sequence.next_value(),
+            'prediction_model_run_timestamp_id': prediction_model_run_timestamp_id,
+            'prediction_model_grid_subset_id': grid_subset_id,
+            'prediction_timestamp': prediction_timestamp,
+            column: grid_subset_values
+        } for grid_subset_id, grid_subset_values in values.items()])
+    statement = statement.on_conflict_do_update(
+        index_elements=[ModelRunGridSubsetPrediction.prediction_model_run_timestamp_id,
+                        ModelRunGridSubsetPrediction.prediction_model_grid_subset_id,
+                        ModelRunGridSubsetPrediction.prediction_timestamp],
+        set_={column: getattr(statement.excluded, column)})
+    session.execute(statement)
+
+
+def upsert_model_run_grid_subset_time_series(session: Session,  # pylint: disable=too-many-arguments
+                                             prediction_model_run_timestamp_id: int,
+                                             prediction_hour: int,
+                                             variable_name: str,
+                                             values: Dict[int, List[float]],
+                                             now: datetime.datetime):
+    """ Set the values of one variable, for a prediction hour, in the time series of many grid subsets,
+    using a single INSERT ... ON CONFLICT DO UPDATE statement. (See ModelRunGridSubsetTimeSeries.)
+    NOTE: The changes are not committed, that is left to the caller.
+
+    :param prediction_hour: Hours since the model run.
+    :param variable_name: Name of the variable, e.g. tmp_tgl_2
+    :param values: The values at the vertices of each grid subset, keyed on grid subset id.
+    """
+    if not values:
+        return
+    column = variable_name.lower()
+    id_sequence = ModelRunGridSubsetTimeSeries.id.default
+    # Only the values of this prediction hour, and their (1 based) position in the time series, are sent.
+    # set_time_series_values (created by the migration) pads a new time series with NULLs up to the position,
+    # and leaves the values of the other prediction hours of an existing time series as they are.
+    start = prediction_hour * VERTEX_COUNT + 1
+    empty_time_series = cast(null(), ARRAY(REAL))
+    # Rows are written in order of grid subset id, so that concurrent writers lock them in the same order.
+    statement = insert(ModelRunGridSubsetTimeSeries).values([
+        {
+            'id': id_sequence.next_value(),
+            'prediction_model_run_timestamp_id': prediction_model_run_timestamp_id,
+            'prediction_model_grid_subset_id': grid_subset_id,
+            column: func.set_time_series_values(
+                empty_time_series, start, literal(list(values[grid_subset_id]), ARRAY(REAL))),
+            'update_date': now
+        } for grid_subset_id in sorted(values)])
+    new_values = getattr(statement.excluded, column)[start:start + VERTEX_COUNT - 1]
+    statement = statement.on_conflict_do_update(
+        index_elements=[ModelRunGridSubsetTimeSeries.prediction_model_run_timestamp_id,
+                        ModelRunGridSubsetTimeSeries.prediction_model_grid_subset_id],
+        set_={column: func.set_time_series_values(getattr(ModelRunGridSubsetTimeSeries, column), start,
+                                                  new_values),
+              'update_date': statement.excluded.update_date})
+    session.execute(statement)
 
 
 def get_prediction_run(session: Session, prediction_model_id: int,
@@ -64,6 +161,12 @@ def get_prediction_run(session: Session, prediction_model_id: int,
                prediction_run_timestamp).first()
 
 
+def get_prediction_run_by_id(session: Session, prediction_run_id: int) -> PredictionModelRunTimestamp:
+    """ load the model run from the database, given its id. """
+    return session.query(PredictionModelRunTimestamp).\
+        filter(PredictionModelRunTimestamp.id == prediction_run_id).first()
+
+
 def create_prediction_run(
         session: Session,
         prediction_model_id: int,
@@ -102,28 +205,54 @@ def get_or_create_prediction_run(session, prediction_model: PredictionModel,
     return prediction_run
 
 
-def get_grid_for_coordinate(session: Session,
-                            prediction_model: PredictionModel,
-                            coordinate) -> PredictionModelGridSubset:
-    """ Given a specified coordinate and model, return the appropriate grid. """
-    logger.info("Model %s, coords %s,%s", prediction_model.id,
-                coordinate[1], coordinate[0])
-    query = session.query(PredictionModelGridSubset).\
-        filter(PredictionModelGridSubset.geom.ST_Contains(
-            'POINT({longitude} {latitude})'.format(longitude=coordinate[0], latitude=coordinate[1]))).\
+def get_grids_for_coordinates(session: Session,
+                              prediction_model: PredictionModel,
+                              coordinates: Dict[int, Tuple[float, float]]
+                              ) -> Dict[int, PredictionModelGridSubset]:
+    """ Given coordinates (longitude, latitude) keyed on station code, and a model, return the grid
+    containing each coordinate, keyed on station code, using a single query. """
+    logger.info("Model %s, %s coordinates", prediction_model.id, len(coordinates))
+    if not coordinates:
+        return {}
+    points = union_all(*[
+        select([literal(station_code).label('station_code'),
+                func.ST_Point(longitude, latitude).label('point')])
+        for station_code, (longitude, latitude) in coordinates.items()]).alias('points')
+    query = session.query(points.c.station_code, PredictionModelGridSubset).\
+        join(PredictionModelGridSubset, PredictionModelGridSubset.geom.ST_Contains(points.c.point)).\
         filter(PredictionModelGridSubset.prediction_model_id == prediction_model.id)
-    return query.first()
+    return dict(query)
 
 
 def get_model_run_predictions_for_grid(session: Session,
                                        prediction_run: PredictionModelRunTimestamp,
-                                       grid: PredictionModelGridSubset) -> List:
-    """ Get all the predictions for a provided model run and grid. """
+                                       grid: PredictionModelGridSubset,
+                                       until: datetime.datetime = None,
+                                       since: datetime.datetime = None) -> List:
+    """ Get all the predictions for a provided model run and grid, ordered by prediction timestamp.
+    If until (or since) is specified, only predictions up to (or from) and including that prediction
+    timestamp are returned. """
     logger.info("Getting model predictions for grid %s", grid)
-    return session.query(ModelRunGridSubsetPrediction).\
+    query = session.query(ModelRunGridSubsetPrediction).\
         filter(ModelRunGridSubsetPrediction.prediction_model_grid_subset_id == grid.id).\
         filter(ModelRunGridSubsetPrediction.prediction_model_run_timestamp_id ==
                prediction_run.id)
+    if until is not None:
+        query = query.filter(ModelRunGridSubsetPrediction.prediction_timestamp <= until)
+    if since is not None:
+        query = query.filter(ModelRunGridSubsetPrediction.prediction_timestamp >= since)
+    return query.order_by(ModelRunGridSubsetPrediction.prediction_timestamp)
+
+
+def get_model_run_time_series_for_grid(session: Session,
+                                       prediction_run: PredictionModelRunTimestamp,
+                                       grid: PredictionModelGridSubset) -> ModelRunGridSubsetTimeSeries:
+    """ Get the time series of a provided model run and grid (None if there isn't one). """
+    logger.info("Getting model time series for grid %s", grid)
+    return session.query(ModelRunGridSubsetTimeSeries).\
+        filter(ModelRunGridSubsetTimeSeries.prediction_model_grid_subset_id == grid.id).\
+        filter(ModelRunGridSubsetTimeSeries.prediction_model_run_timestamp_id == prediction_run.id).\
+        first()
 
 
 def get_model_run_predictions(
@@ -176,20 +305,30 @@ def get_predictions_from_coordinates(session: Session, coordinates: List, model:
     return query
 
 
-def get_station_model_predictions_order_by_prediction_timestamp(
+def get_station_model_prediction_summaries(
         session: Session,
         station_codes: List,
         model: ModelEnum,
         start_date: datetime.datetime,
         end_date: datetime.datetime) -> List[
-            Union[WeatherStationModelPrediction, PredictionModel]]:
-    """ Fetch model predictions for given stations within given time range ordered by station code
+            Tuple[PredictionModel, int, datetime.datetime, float, float, float, float, float, float]]:
+    """ Fetch the 5th percentile, median and 90th percentile of the temperature and relative humidity
+    predictions of all model runs, for given stations within given time range, ordered by station code
     and prediction timestamp.
 
-    This is useful if you're interested in seeing all the different predictions regardles of
-    model run.
+    Each row is: prediction model, station code, prediction timestamp, tmp_tgl_2 5th, median and 90th,
+    followed by rh_tgl_2 5th, median and 90th.
     """
-    query = session.query(WeatherStationModelPrediction, PredictionModel).\
+    columns = []
+    for key in ('tmp_tgl_2', 'rh_tgl_2'):
+        for fraction, suffix in ((0.05, '5th'), (0.5, 'median'), (0.9, '90th')):
+            # percentile_cont interpolates linearly between values, same as numpy.percentile.
+            columns.append(func.percentile_cont(fraction).within_group(
+                getattr(WeatherStationModelPrediction, key)).label('{}_{}'.format(key, suffix)))
+    query = session.query(PredictionModel,
+                          WeatherStationModelPrediction.station_code,
+                          WeatherStationModelPrediction.prediction_timestamp,
+                          *columns).\
         join(PredictionModelRunTimestamp, PredictionModelRunTimestamp.id ==
              WeatherStationModelPrediction.prediction_model_run_timestamp_id).\
         join(PredictionModel, PredictionModel.id ==
@@ -198,77 +337,135 @@ def get_station_model_predictions_order_by_prediction_timestamp(
         filter(WeatherStationModelPrediction.prediction_timestamp >= start_date).\
         filter(WeatherStationModelPrediction.prediction_timestamp <= end_date).\
         filter(PredictionModel.abbreviation == model).\
+        group_by(PredictionModel.id,
+                 WeatherStationModelPrediction.station_code,
+                 WeatherStationModelPrediction.prediction_timestamp).\
         order_by(WeatherStationModelPrediction.station_code).\
         order_by(WeatherStationModelPrediction.prediction_timestamp)
     return query
 
 
-def get_station_model_predictions(
+def get_latest_station_model_predictions(
         session: Session,
         station_codes: List,
         model: str,
         start_date: datetime.datetime,
-        end_date: datetime.datetime) -> List[
-            Union[WeatherStationModelPrediction, PredictionModelRunTimestamp, PredictionModel]]:
-    """ Fetches the model predictions that were most recently issued before the prediction_timestamp.
-    Used to compare the most recent model predictions against forecasts and actuals for the same
-    weather date and weather station.
-    Only fetches WeatherStationModelPredictions for prediction_timestamps in the date range of
-    start_date - end_date (inclusive).
+        end_date: datetime.datetime) -> List[Union[LatestStationModelPrediction, PredictionModel]]:
+    """ Fetches the model predictions of the most recent model run, for each station and prediction_timestamp
+    in the date range of start_date - end_date (inclusive), ordered by station and prediction_timestamp.
     """
-    query = session.query(WeatherStationModelPrediction, PredictionModelRunTimestamp, PredictionModel).\
-        filter(WeatherStationModelPrediction.station_code.in_(station_codes)).\
-        filter(WeatherStationModelPrediction.prediction_timestamp >= start_date).\
-        filter(WeatherStationModelPrediction.prediction_timestamp <= end_date).\
-        filter(PredictionModelRunTimestamp.id ==
-               WeatherStationModelPrediction.prediction_model_run_timestamp_id).\
-        filter(PredictionModelRunTimestamp.prediction_model_id == PredictionModel.id,
-               PredictionModel.abbreviation == model).\
-        order_by(WeatherStationModelPrediction.station_code).\
-        order_by(WeatherStationModelPrediction.prediction_timestamp).\
-        order_by(PredictionModelRunTimestamp.prediction_run_timestamp.asc())
+    query = session.query(LatestStationModelPrediction, PredictionModel).\
+        join(PredictionModel, PredictionModel.id == LatestStationModelPrediction.prediction_model_id).\
+        filter(PredictionModel.abbreviation == model).\
+        filter(LatestStationModelPrediction.station_code.in_(station_codes)).\
+        filter(LatestStationModelPrediction.prediction_timestamp >= start_date).\
+        filter(LatestStationModelPrediction.prediction_timestamp <= end_date).\
+        order_by(LatestStationModelPrediction.station_code).\
+        order_by(LatestStationModelPrediction.prediction_timestamp)
     return query
 
 
-def get_station_model_prediction_from_previous_model_run(
-        session: Session,
-        station_code: int,
-        model: ModelEnum,
-        prediction_timestamp: datetime.datetime,
-        prediction_model_run_timestamp: datetime.datetime) -> List[WeatherStationModelPrediction]:
-    """ Fetches the one model prediction for the specified station_code, model, and prediction_timestamp
-    from the prediction model run immediately previous to the given prediction_model_run_timestamp.
+def _get_previous_delta_precip(prediction_model_id, station_code, prediction_timestamp,
+                               prediction_run_timestamp):
+    """ Select the delta precipitation of the station at the prediction timestamp, in the model run (of the
+    same model) that precedes the one at prediction_run_timestamp. The arguments are columns of the enclosing
+    statement. """
+    previous_run = aliased(PredictionModelRunTimestamp)
+    previous_prediction = aliased(WeatherStationModelPrediction)
+    return select([previous_prediction.delta_precip]).\
+        where(previous_prediction.prediction_model_run_timestamp_id == previous_run.id).\
+        where(previous_run.prediction_model_id == prediction_model_id).\
+        where(previous_run.prediction_run_timestamp < prediction_run_timestamp).\
+        where(previous_prediction.station_code == station_code).\
+        where(previous_prediction.prediction_timestamp == prediction_timestamp).\
+        order_by(previous_run.prediction_run_timestamp.desc()).\
+        limit(1).as_scalar()
+
+
+def upsert_latest_station_model_predictions(session: Session,
+                                            prediction_run: PredictionModelRunTimestamp,
+                                            now: datetime.datetime):
+    """ Copy the weather station model predictions of the model run to the latest station model predictions,
+    using a single INSERT ... SELECT ... ON CONFLICT DO UPDATE statement. Latest predictions that come from a
+    more recent model run are left as is.
+    The delta precipitation of the previous model run is looked up, rather than taken from the latest
+    prediction being replaced, so that it's right even if model runs are copied out of order. Latest
+    predictions of more recent model runs have theirs looked up again, as this model run may now precede them.
+    NOTE: The changes are not committed, that is left to the caller.
     """
-    # create a lower_bound for time range so that we're not querying timestamps all the way back to the
-    # beginning of time
-    lower_bound = prediction_model_run_timestamp - datetime.timedelta(days=1)
-    response = session.query(WeatherStationModelPrediction).\
-        join(PredictionModelRunTimestamp,
-             PredictionModelRunTimestamp.id ==
-             WeatherStationModelPrediction.prediction_model_run_timestamp_id).\
-        join(PredictionModel, PredictionModel.id ==
-             PredictionModelRunTimestamp.prediction_model_id).\
-        filter(WeatherStationModelPrediction.station_code == station_code).\
-        filter(WeatherStationModelPrediction.prediction_timestamp == prediction_timestamp).\
-        filter(PredictionModel.abbreviation == model).\
-        filter(PredictionModelRunTimestamp.prediction_run_timestamp < prediction_model_run_timestamp).\
-        filter(PredictionModelRunTimestamp.prediction_run_timestamp > lower_bound).\
-        order_by(PredictionModelRunTimestamp.prediction_run_timestamp.desc()).\
-        limit(1).first()
-
-    return response
-
-
-def get_processed_file_count(session: Session, urls: List[str]) -> int:
-    """ Return the number of matching urls """
-    return session.query(ProcessedModelRunUrl).filter(ProcessedModelRunUrl.url.in_(urls)).count()
-
-
-def get_processed_file_record(session: Session, url: str) -> ProcessedModelRunUrl:
-    """ Get record corresponding to a processed file. """
-    processed_file = session.query(ProcessedModelRunUrl).\
-        filter(ProcessedModelRunUrl.url == url).first()
-    return processed_file
+    value_columns = ('tmp_tgl_2', 'bias_adjusted_temperature', 'rh_tgl_2', 'bias_adjusted_rh', 'apcp_sfc_0',
+                     'delta_precip', 'wdir_tgl_10', 'wind_tgl_10')
+    predictions = select([
+        LatestStationModelPrediction.id.default.next_value(),
+        PredictionModelRunTimestamp.prediction_model_id,
+        WeatherStationModelPrediction.station_code,
+        WeatherStationModelPrediction.prediction_timestamp,
+        PredictionModelRunTimestamp.id,
+        PredictionModelRunTimestamp.prediction_run_timestamp,
+        *[getattr(WeatherStationModelPrediction, column) for column in value_columns],
+        _get_previous_delta_precip(PredictionModelRunTimestamp.prediction_model_id,
+                                   WeatherStationModelPrediction.station_code,
+                                   WeatherStationModelPrediction.prediction_timestamp,
+                                   PredictionModelRunTimestamp.prediction_run_timestamp),
+        literal(now, LatestStationModelPrediction.update_date.type)]).\
+        where(PredictionModelRunTimestamp.id ==
+              WeatherStationModelPrediction.prediction_model_run_timestamp_id).\
+        where(PredictionModelRunTimestamp.id == prediction_run.id)
+    statement = insert(LatestStationModelPrediction).from_select(
+        ['id', 'prediction_model_id', 'station_code', 'prediction_timestamp',
+         'prediction_model_run_timestamp_id', 'prediction_run_timestamp', *value_columns, 'prev_delta_precip',
+         'update_date'],
+        predictions)
+    excluded = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=['prediction_model_id', 'station_code', 'prediction_timestamp'],
+        set_={
+            'prediction_model_run_timestamp_id': excluded.prediction_model_run_timestamp_id,
+            'prediction_run_timestamp': excluded.prediction_run_timestamp,
+            **{column: getattr(excluded, column) for column in value_columns + ('prev_delta_precip',)},
+            'update_date': excluded.update_date},
+        where=LatestStationModelPrediction.prediction_run_timestamp <= excluded.prediction_run_timestamp)
+    session.execute(statement)
+    # Only latest predictions at timestamps this model run has predictions for (which are never before the
+    # model run) can have this model run as their previous one.
+    session.execute(update(LatestStationModelPrediction).
+                    where(LatestStationModelPrediction.prediction_model_id ==
+                          prediction_run.prediction_model_id).
+                    where(LatestStationModelPrediction.prediction_run_timestamp >
+                          prediction_run.prediction_run_timestamp).
+                    where(LatestStationModelPrediction.prediction_timestamp >=
+                          prediction_run.prediction_run_timestamp).
+                    values(prev_delta_precip=_get_previous_delta_precip(
+                        LatestStationModelPrediction.prediction_model_id,
+                        LatestStationModelPrediction.station_code,
+                        LatestStationModelPrediction.prediction_timestamp,
+                        LatestStationModelPrediction.prediction_run_timestamp)))
+
+
+def get_processed_file_urls(session: Session, urls: List[str]) -> Set[str]:
+    """ Return the urls, out of the given urls, that have already been processed. """
+    return {processed_file.url for processed_file in session.query(ProcessedModelRunUrl.url).
+            filter(ProcessedModelRunUrl.url.in_(urls))}
+
+
+def upsert_processed_file_urls(session: Session, urls: List[str], now: datetime.datetime):
+    """ Record many urls as processed in a single statement. Urls that were processed before get their
+    update date refreshed.
+    NOTE: The changes are not committed, that is left to the caller.
+    """
+    if not urls:
+        return
+    statement = insert(ProcessedModelRunUrl).values([
+        {
+            'id': ProcessedModelRunUrl.id.default.next_value(),
+            'url': url,
+            'create_date': now,
+            'update_date': now
+        } for url in urls])
+    statement = statement.on_conflict_do_update(
+        index_elements=[ProcessedModelRunUrl.url],
+        set_={'update_date': statement.excluded.update_date})
+    session.execute(statement)
 
 
 def get_prediction_model(session: Session, abbreviation: str, projection: str) -> PredictionModel:
@@ -295,14 +492,58 @@ def get_prediction_model_run_timestamp_records(
     return query
 
 
-def get_weather_station_model_prediction(session: Session,
-                                         station_code: int,
-                                         prediction_model_run_timestamp_id: int,
-                                         prediction_timestamp: datetime) -> WeatherStationModelPrediction:
-    """ Get the model prediction for a weather station given a model run and a timestamp. """
-    return session.query(WeatherStationModelPrediction).\
-        filter(WeatherStationModelPrediction.station_code == station_code).\
-        filter(WeatherStationModelPrediction.prediction_model_run_timestamp_id ==
-               prediction_model_run_timestamp_id).\
-        filter(WeatherStationModelPrediction.prediction_timestamp ==
-               prediction_timestamp).first()
+def upsert_weather_station_model_predictions(session: Session, station_predictions: List[dict]):
+    """ Insert (or update, if they already exist) many weather station model predictions, using a single
+    INSERT ... ON CONFLICT DO UPDATE statement. The create date of existing predictions is left as is.
+    NOTE: The changes are not committed, that is left to the caller.
+
+    :param station_predictions: Values of each prediction, keyed on column name. Each prediction must have
+    the same keys.
+    """
+    if not station_predictions:
+        return
+    id_sequence = WeatherStationModelPrediction.id.default
+    statement = insert(WeatherStationModelPrediction).values([
+        {'id': id_sequence.next_value(), **station_prediction} for station_prediction in station_predictions])
+    index_elements = ['station_code', 'prediction_model_run_timestamp_id', 'prediction_timestamp']
+    statement = statement.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={key: getattr(statement.excluded, key) for key in station_predictions[0]
+              if key not in index_elements and key != 'create_date'})
+    session.execute(statement)
+
+
+def get_station_regression_sample_sums(session: Session,
+                                       prediction_model_id: int,
+                                       station_code: int,
+                                       start_date: datetime.date,
+                                       end_date: datetime.date) -> List[StationRegressionSampleSums]:
+    """ Get the regression sample sums of a station for a model, from the start date up to (but not
+    including) the end date. """
+    return session.query(StationRegressionSampleSums).\
+        filter(StationRegressionSampleSums.prediction_model_id == prediction_model_id).\
+        filter(StationRegressionSampleSums.station_code == station_code).\
+        filter(StationRegressionSampleSums.sample_date >= start_date).\
+        filter(StationRegressionSampleSums.sample_date < end_date).all()
+
+
+def upsert_station_regression_sample_sums(session: Session, sample_sums: List[dict]):
+    """ Insert (or update, if they already exist) many regression sample sums in a single statement.
+    NOTE: The changes are not committed, that is left to the caller.
+
+    :param sample_sums: Values of each record, keyed on column name.
+    """
+    if not sample_sums:
+        return
+    id_sequence = StationRegressionSampleSums.id.default
+    statement = insert(StationRegressionSampleSums).values([
+        {'id': id_sequence.next_value(), **record} for record in sample_sums])
+    statement = statement.on_conflict_do_update(
+        index_elements=[StationRegressionSampleSums.prediction_model_id,
+                        StationRegressionSampleSums.station_code,
+                        StationRegressionSampleSums.sample_date,
+                        StationRegressionSampleSums.hour,
+                        StationRegressionSampleSums.sample_key],
+        set_={key: getattr(statement.excluded, key)
+              for key in ('count', 'sum_x', 'sum_y', 'sum_xx', 'sum_xy', 'update_date')})
+    session.execute(statement)
@@ -4,6 +4,8 @@
 from app.db.database import Base
 from app.db.models.forecasts import NoonForecast
 from app.db.models.observations import HourlyActual
+from app.db.models.data_versions import DataVersion
 from app.db.models.weather_models import (ProcessedModelRunUrl, PredictionModel, PredictionModelRunTimestamp,
                                           PredictionModelGridSubset, ModelRunGridSubsetPrediction,
-                                          WeatherStationModelPrediction)
+                                          ModelRunGridSubsetTimeSeries, WeatherStationModelPrediction,
+                                          LatestStationModelPrediction, StationRegressionSampleSums)
@@ -0,0 +1,30 @@
+""" Class models that reflect resources and map to database tables relating to the versioning of data
+(used to tell when cached responses are stale)
+"""
+from enum import Enum
+from sqlalchemy import Column, Integer, String
+from app.db.database import Base
+from app.db.models.common import TZTimeStamp
+import app.time_utils as time_utils
+
+
+class DataSourceEnum(str, Enum):
+    """ Enumerator for the different kinds of data that are loaded by cronjobs """
+    WEATHER_MODELS = 'weather_models'
+    HOURLY_ACTUALS = 'hourly_actuals'
+    NOON_FORECASTS = 'noon_forecasts'
+
+
+class DataVersion(Base):
+    """ The version of a kind of data, incremented every time new data is committed. """
+    __tablename__ = 'data_versions'
+    __table_args__ = (
+        {'comment': 'The version of a kind of data, incremented every time new data is committed.'}
+    )
+    data_source = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    update_date = Column(TZTimeStamp, nullable=False, default=time_utils.get_utc_now())
+
+    def __str__(self):
+        return ('data_source:{self.data_source}, '
+                'version:{self.version}').format(self=self)
@@ -1,10 +1,10 @@
 """ Class models that reflect resources and map to database tables relating to weather models.
 """
 import logging
-from sqlalchemy import (Column, String, Integer, Float, Boolean,
+from sqlalchemy import (Column, String, Integer, Float, Boolean, Date,
                         Sequence, ForeignKey, UniqueConstraint)
 from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import ARRAY, REAL
 from geoalchemy2 import Geometry
 from app.db.database import Base
 import app.time_utils as time_utils
@@ -81,6 +81,9 @@ class PredictionModelRunTimestamp(Base):
     complete = Column(Boolean, nullable=False)
     # Indicate if this model run has been interpolated for weather stations.
     interpolated = Column(Boolean, nullable=False)
+    # Predictions up to (and including) this prediction timestamp have been interpolated for weather
+    # stations, while the model run is still being downloaded.
+    interpolated_until = Column(TZTimeStamp, nullable=True)
 
     def __str__(self):
         return ('id:{self.id}, '
@@ -159,6 +162,48 @@ class ModelRunGridSubsetPrediction(Base):
                 'wind_tgl_10={self.wind_tgl_10}').format(self=self)
 
 
+class ModelRunGridSubsetTimeSeries(Base):
+    """ All the predictions of a model run for a particular model grid subset, as a time series.
+    An alternative to storing a ModelRunGridSubsetPrediction for each prediction timestamp.
+    Each value is a packed array, with the values of the 4 vertices of the grid subset for every hour
+    predicted by the model run, i.e. the value of vertex v (0 to 3) for prediction hour h is at position
+    h * 4 + v (0 based). Hours that aren't predicted (or haven't been processed yet) are NULL. """
+    __tablename__ = 'model_run_grid_subset_time_series'
+    __table_args__ = (
+        UniqueConstraint('prediction_model_run_timestamp_id', 'prediction_model_grid_subset_id'),
+        {'comment': 'The predictions for a grid subset of a particular model run, as a time series.'}
+    )
+
+    id = Column(Integer, Sequence('model_run_grid_subset_time_series_id_seq'),
+                primary_key=True, nullable=False, index=True)
+    # Which model run do these predictions apply to? E.g. The GDPS 15x.15 run from 2020 07 07 12h00.
+    prediction_model_run_timestamp_id = Column(Integer, ForeignKey(
+        'prediction_model_run_timestamps.id'), nullable=False)
+    prediction_model_run_timestamp = relationship(
+        "PredictionModelRunTimestamp", foreign_keys=[prediction_model_run_timestamp_id])
+    # Which grid do these predictions apply to?
+    prediction_model_grid_subset_id = Column(Integer, ForeignKey(
+        'prediction_model_grid_subsets.id'), nullable=False)
+    prediction_model_grid_subset = relationship("PredictionModelGridSubset")
+    # Temperature 2m above model layer.
+    tmp_tgl_2 = Column(ARRAY(REAL), nullable=True)
+    # Relative humidity 2m above model layer.
+    rh_tgl_2 = Column(ARRAY(REAL), nullable=True)
+    # Accumulated precipitation (units kg.m^-2)
+    apcp_sfc_0 = Column(ARRAY(REAL), nullable=True)
+    # Wind direction 10m above ground.
+    wdir_tgl_10 = Column(ARRAY(REAL), nullable=True)
+    # Wind speed 10m above ground.
+    wind_tgl_10 = Column(ARRAY(REAL), nullable=True)
+    # Date this record was updated.
+    update_date = Column(TZTimeStamp, nullable=False)
+
+    def __str__(self):
+        return ('id:{self.id}, '
+                'prediction_model_run_timestamp_id:{self.prediction_model_run_timestamp_id}, '
+                'prediction_model_grid_subset_id:{self.prediction_model_grid_subset_id}').format(self=self)
+
+
 class WeatherStationModelPrediction(Base):
     """ The model prediction for a particular weather station.
     Based on values from ModelRunGridSubsetPrediction, but captures linear interpolations based on weather
@@ -212,3 +257,101 @@ class WeatherStationModelPrediction(Base):
     def __str__(self):
         return ('{self.station_code} {self.prediction_timestamp} {self.tmp_tgl_2} {self.apcp_sfc_0} '
                 '{self.delta_precip}').format(self=self)
+
+
+class LatestStationModelPrediction(Base):
+    """ The prediction of the most recent model run, for a particular model, weather station and
+    prediction timestamp. A copy of the most recent WeatherStationModelPrediction, kept current as model runs
+    are interpolated, so that the most recent predictions can be read without going through the predictions
+    of all the model runs. """
+    __tablename__ = 'latest_station_model_predictions'
+    __table_args__ = (
+        UniqueConstraint('prediction_model_id', 'station_code', 'prediction_timestamp'),
+        {'comment': 'The most recent interpolated weather values for a model, station and weather date'}
+    )
+
+    id = Column(Integer, Sequence('latest_station_model_predictions_id_seq'),
+                primary_key=True, nullable=False, index=True)
+    # Which model is the prediction from?
+    prediction_model_id = Column(Integer, ForeignKey('prediction_models.id'), nullable=False)
+    # The 3-digit code for the weather station to which the prediction applies
+    station_code = Column(Integer, nullable=False)
+    # The date and time to which the prediction applies.
+    prediction_timestamp = Column(TZTimeStamp, nullable=False)
+    # Which PredictionModelRunTimestamp is the prediction from?
+    prediction_model_run_timestamp_id = Column(Integer, ForeignKey(
+        'prediction_model_run_timestamps.id'), nullable=False)
+    # The timestamp of the model run (copied from PredictionModelRunTimestamp).
+    prediction_run_timestamp = Column(TZTimeStamp, nullable=False)
+    # Temperature 2m above model layer.
+    tmp_tgl_2 = Column(Float, nullable=True)
+    # Temperature prediction using available data.
+    bias_adjusted_temperature = Column(Float, nullable=True)
+    # Relative Humidity 2m above model layer.
+    rh_tgl_2 = Column(Float, nullable=True)
+    # RH adjusted by bias
+    bias_adjusted_rh = Column(Float, nullable=True)
+    # Accumulated precipitation over calendar day measured in UTC (units kg.m^-2)
+    apcp_sfc_0 = Column(Float, nullable=True)
+    # Change in accumulated precipitation between current and previous prediction_timestamp
+    delta_precip = Column(Float, nullable=True)
+    # Change in accumulated precipitation of the previous model run, for the same prediction_timestamp. (The
+    # first hour of a model run doesn't have a delta precip of its own.)
+    prev_delta_precip = Column(Float, nullable=True)
+    # Wind direction 10m above ground.
+    wdir_tgl_10 = Column(Float, nullable=True)
+    # Wind speed 10m above ground.
+    wind_tgl_10 = Column(Float, nullable=True)
+    # Date this record was updated.
+    update_date = Column(TZTimeStamp, nullable=False)
+
+    def __str__(self):
+        return ('{self.station_code} {self.prediction_timestamp} {self.prediction_run_timestamp} '
+                '{self.tmp_tgl_2} {self.delta_precip}').format(self=self)
+
+
+class StationRegressionSampleSums(Base):
+    """ Sums of the samples used to bias adjust a model's predictions for a weather station, for one day,
+    hour of the day, and variable (e.g. temperature). A sample is a model value interpolated to the
+    station, along with the value observed at the station.
+    A linear regression over a number of days can be calculated by adding up the sums of those days,
+    without having to collect the samples again. """
+    __tablename__ = 'station_regression_sample_sums'
+    __table_args__ = (
+        UniqueConstraint('prediction_model_id', 'station_code', 'sample_date', 'hour', 'sample_key'),
+        {'comment': 'Sums of the samples used to bias adjust model predictions for a weather station'}
+    )
+
+    id = Column(Integer, Sequence('station_regression_sample_sums_id_seq'),
+                primary_key=True, nullable=False, index=True)
+    # Which model do the samples come from?
+    prediction_model_id = Column(Integer, ForeignKey(
+        'prediction_models.id'), nullable=False)
+    # The 3-digit code for the weather station.
+    station_code = Column(Integer, nullable=False)
+    # The (UTC) date of the samples.
+    sample_date = Column(Date, nullable=False)
+    # The (UTC) hour of the samples.
+    hour = Column(Integer, nullable=False)
+    # The variable the samples are for, e.g. temperature or relative_humidity.
+    sample_key = Column(String, nullable=False)
+    # The number of samples.
+    count = Column(Integer, nullable=False)
+    # Sum of the model values.
+    sum_x = Column(Float, nullable=False)
+    # Sum of the observed values.
+    sum_y = Column(Float, nullable=False)
+    # Sum of the squared model values.
+    sum_xx = Column(Float, nullable=False)
+    # Sum of the model values multiplied by the observed values.
+    sum_xy = Column(Float, nullable=False)
+    # Date this record was updated.
+    update_date = Column(TZTimeStamp, nullable=False)
+
+    def __str__(self):
+        return ('prediction_model_id:{self.prediction_model_id}, '
+                'station_code:{self.station_code}, '
+                'sample_date:{self.sample_date}, '
+                'hour:{self.hour}, '
+                'sample_key:{self.sample_key}, '
+                'count:{self.count}').format(self=self)
@@ -9,6 +9,8 @@ import pandas as pd
 from app import configure_logging, config
 import app.db.database
 from app.db.crud.observations import save_hourly_actual
+from app.db.crud.data_versions import bump_data_version
+from app.db.models.data_versions import DataSourceEnum
 from app.db.models.observations import HourlyActual
 import app.time_utils
 from app.fireweather_bot.common import (BaseBot, get_station_names_to_codes)
@@ -95,6 +97,9 @@ class HourlyActualsBot(BaseBot):
                 logger.info('Skipping duplicate record for %s @ %s',
                             data['station_code'], data['weather_date'])
                 session.rollback()
+        # Cached responses built from the previous hourly actuals are now stale.
+        bump_data_version(session, DataSourceEnum.HOURLY_ACTUALS, app.time_utils.get_utc_now())
+        session.commit()
 
     def construct_request_body(self):
         return {
@@ -11,6 +11,8 @@ import pandas as pd
 from app import config, configure_logging
 import app.db.database
 from app.db.crud.forecasts import save_noon_forecast
+from app.db.crud.data_versions import bump_data_version
+from app.db.models.data_versions import DataSourceEnum
 from app.db.models.forecasts import NoonForecast
 from app.fireweather_bot.common import BaseBot, get_station_names_to_codes
 import app.time_utils
@@ -100,6 +102,9 @@ def _parse_csv(temp_path: str):
         except IntegrityError:
             logger.info('Skipping duplicate record')
             session.rollback()
+    # Cached responses built from the previous noon forecasts are now stale.
+    bump_data_version(session, DataSourceEnum.NOON_FORECASTS, app.time_utils.get_utc_now())
+    session.commit()
 
 
 def _get_start_date():
@@ -4,12 +4,15 @@ the noon_forecasts table in our database.
 import logging
 from collections import defaultdict
 from datetime import datetime, timezone
+from typing import Dict, List
 import math
 from app.schemas.forecasts import NoonForecast, NoonForecastResponse, NoonForecastValue
 from app.schemas.stations import StationCodeList
 import app.db.database
 from app.db.crud.forecasts import query_noon_forecast_records
 import app.db.models
+from app.db.models.data_versions import DataSourceEnum
+from app.response_cache import fetch_station_fragments
 
 
 logger = logging.getLogger(__name__)
@@ -19,10 +22,11 @@ class StationNotFoundException(Exception):
     """ Custom exception for when a station cannot be found """
 
 
-def parse_table_records_to_noon_forecast_response(data: [app.db.models.forecasts.NoonForecast]):
+def parse_table_records_to_noon_forecasts(
+        data: [app.db.models.forecasts.NoonForecast]) -> Dict[int, NoonForecast]:
     """ Given a list of table records from the database, parse each record
     (which is a NoonForecast object) and structure it as a NoonForecast
-    object, then return the list of NoonForecast objects as a NoonForecastResponse
+    object, then return the NoonForecast objects by station code
     """
     noon_forecasts = defaultdict(list)
     for record in data:
@@ -59,14 +63,7 @@ def parse_table_records_to_noon_forecast_response(data: [app.db.models.forecasts
         )
         noon_forecasts[station_code].append(noon_forecast_value)
 
-    values = []
-    for key, value in noon_forecasts.items():
-        noon_forecast = NoonForecast(
-            station_code=key,
-            values=value
-        )
-        values.append(noon_forecast)
-    return NoonForecastResponse(noon_forecasts=values)
+    return {key: NoonForecast(station_code=key, values=value) for key, value in noon_forecasts.items()}
 
 
 def fetch_noon_forecasts(stations: StationCodeList,
@@ -75,10 +72,25 @@ def fetch_noon_forecasts(stations: StationCodeList,
     """ Query all noon forecasts between start_date and end_date for the specified weather station. Note that
     there may be multiple records for the same weather station and same weather_date, as noon forecasts
     are updated twice daily. """
-    logger.debug('Querying noon forecasts for stations %s from %s to %s',
-                 stations, start_date, end_date)
-    session = app.db.database.get_read_session()
-    forecasts = query_noon_forecast_records(
-        session, stations, start_date, end_date)
+    def fetch(station_codes: StationCodeList) -> Dict[int, NoonForecast]:
+        logger.debug('Querying noon forecasts for stations %s from %s to %s',
+                     station_codes, start_date, end_date)
+        session = app.db.database.get_read_session()
+        forecasts = query_noon_forecast_records(
+            session, station_codes, start_date, end_date)
+        return parse_table_records_to_noon_forecasts(forecasts)
+
+    # The noon forecasts of each station are cached separately, so that only the stations that haven't
+    # been requested before need to be queried.
+    noon_forecasts = fetch_station_fragments(
+        'noon_forecasts', (DataSourceEnum.NOON_FORECASTS,), (start_date, end_date), stations, fetch)
+    return NoonForecastResponse(noon_forecasts=_order_as_queried(list(noon_forecasts.values())))
+
 
-    return parse_table_records_to_noon_forecast_response(forecasts)
+def _order_as_queried(noon_forecasts: List[NoonForecast]) -> List[NoonForecast]:
+    """ Order the noon forecasts of the stations the same way as when they were all read by a single query,
+    i.e. by the first record of each station, ordered by weather_date, then most recently created. """
+    # NOTE: The sort is stable, so sorting by created_at first breaks weather_date ties.
+    noon_forecasts.sort(key=lambda noon_forecast: noon_forecast.values[0].created_at, reverse=True)
+    noon_forecasts.sort(key=lambda noon_forecast: noon_forecast.values[0].datetime)
+    return noon_forecasts
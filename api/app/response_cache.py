@@ -0,0 +1,328 @@
+""" Cache for API responses.
+
+Many users request the same responses (e.g. the dashboard for the same stations), while the underlying data
+only changes when a cronjob commits new data. Responses are cached by endpoint and request, together with the
+version of each data source the response is built from. When a cronjob bumps a data version (see
+app.db.crud.data_versions), the cached responses built from the previous version are no longer used.
+
+Responses are kept in an in-process LRU cache and, if RESPONSE_CACHE_REDIS_URL is set, in redis - so that
+they're shared between API processes. The data versions are re-read as soon as a cronjob bumps them (the API
+listens for the notification sent by bump_data_version), or at the latest after
+RESPONSE_CACHE_VERSION_TTL_SECONDS.
+
+Results can also be cached per station (see fetch_station_fragments), so that requests for overlapping sets of
+stations share work.
+"""
+import asyncio
+import functools
+import hashlib
+import logging
+import pickle
+import select
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Hashable, List, Tuple
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from app import config
+import app.db.database
+from app.db.crud.data_versions import get_data_versions, DATA_VERSIONS_CHANNEL
+from app.db.models.data_versions import DataSourceEnum
+from app.schemas.shared import WeatherDataRequest
+
+logger = logging.getLogger(__name__)
+
+# How long (in seconds) to wait for notifications before checking the listener connection is still alive,
+# and how long to wait before reconnecting when the connection fails.
+LISTEN_TIMEOUT_SECONDS = 60
+
+
+class _NoData():
+    """ Cached in place of the fragment of a station without any data, so that it isn't queried again.
+    (A class rather than a sentinel object, so that it survives being pickled to redis.) """
+
+
+class RedisResponseStore():
+    """ Responses shared between API processes, stored in redis. Redis errors are logged and treated as
+    cache misses, so that the API keeps working (without the shared cache) if redis is unavailable. """
+
+    def __init__(self, client, expiry_seconds: int):
+        """ Prepare class.
+        :param client: Redis client.
+        :param expiry_seconds: How long redis keeps a response. Responses for old data versions are never
+        requested again, so they're left to expire.
+        """
+        self.client = client
+        self.expiry_seconds = expiry_seconds
+
+    @staticmethod
+    def _redis_key(key: Hashable) -> str:
+        return 'response_cache:{}'.format(hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def get(self, key: Hashable):
+        """ Get a response, or None if there isn't one. """
+        try:
+            value = self.client.get(self._redis_key(key))
+        # pylint: disable=broad-except
+        except Exception as exception:
+            logger.warning('failed to get response from redis', exc_info=exception)
+            return None
+        return None if value is None else pickle.loads(value)
+
+    def put(self, key: Hashable, response):
+        """ Store a response. """
+        try:
+            self.client.set(self._redis_key(key), pickle.dumps(response), ex=self.expiry_seconds)
+        # pylint: disable=broad-except
+        except Exception as exception:
+            logger.warning('failed to put response in redis', exc_info=exception)
+
+
+class ResponseCache():  # pylint: disable=too-many-instance-attributes
+    """ Least recently used cache of responses, keyed by request and the version of the data. """
+
+    def __init__(self, max_size: int, version_ttl: float, store: RedisResponseStore = None,
+                 listen: bool = False):
+        """ Prepare class.
+        :param max_size: Maximum number of responses to keep in process.
+        :param version_ttl: How long (in seconds) to re-use data versions before reading them again.
+        :param store: Optional store for sharing responses between processes.
+        :param listen: Listen for data version bumps, to re-read the data versions right away.
+        """
+        self.max_size = max_size
+        self.version_ttl = version_ttl
+        self.store = store
+        self.listen = listen
+        self._listener: DataVersionListener = None
+        self._responses = OrderedDict()
+        self._data_versions: Dict[str, int] = None
+        self._data_versions_expiry = 0
+        self._lock = threading.Lock()
+
+    def get_data_versions(self) -> Dict[str, int]:
+        """ Get the version of each data source. Versions are only read from the database once per
+        version_ttl, so that repeat requests don't touch the database at all. """
+        if self.listen and self._listener is None:
+            # Started on first use, rather than on import, so that only API processes listen.
+            self._listener = DataVersionListener(self)
+            self._listener.start()
+        now = time.monotonic()
+        if self._data_versions is None or now >= self._data_versions_expiry:
+            session = app.db.database.get_read_session()
+            try:
+                self._data_versions = get_data_versions(session)
+            finally:
+                session.close()
+            self._data_versions_expiry = now + self.version_ttl
+        return self._data_versions
+
+    def make_key(self, endpoint: str, data_sources: Tuple[DataSourceEnum], kwargs: dict) -> Hashable:
+        """ Make a key for a request, which includes the version of the data sources. """
+        parameters = tuple(sorted((name, _make_parameter_key(value)) for name, value in kwargs.items()))
+        return (endpoint, self._get_versions(data_sources), parameters)
+
+    def make_station_key_prefix(self, name: str, data_sources: Tuple[DataSourceEnum],
+                                parameters: tuple) -> Hashable:
+        """ Make the part of the key for station fragments that is common to all the stations. """
+        return (name, self._get_versions(data_sources),
+                tuple(_make_parameter_key(value) for value in parameters))
+
+    def _get_versions(self, data_sources: Tuple[DataSourceEnum]) -> Tuple[int]:
+        """ Get the versions of the data sources, in order. """
+        data_versions = self.get_data_versions()
+        return tuple(data_versions.get(data_source.value, 0) for data_source in data_sources)
+
+    def invalidate_data_versions(self):
+        """ Re-read the data versions on next use, e.g. because a cronjob has bumped a version. """
+        with self._lock:
+            self._data_versions = None
+
+    def get(self, key: Hashable):
+        """ Get a cached response, or None if there isn't one. """
+        with self._lock:
+            response = self._responses.get(key)
+            if response is not None:
+                self._responses.move_to_end(key)
+                return response
+        if self.store is not None:
+            response = self.store.get(key)
+            if response is not None:
+                self._put_in_process(key, response)
+        return response
+
+    def put(self, key: Hashable, response):
+        """ Cache a response. """
+        self._put_in_process(key, response)
+        if self.store is not None:
+            self.store.put(key, response)
+
+    def _put_in_process(self, key: Hashable, response):
+        """ Cache a response in process, evicting the least recently used response if the cache is full. """
+        with self._lock:
+            self._responses[key] = response
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+
+    def clear(self):
+        """ Remove all cached responses and data versions. """
+        with self._lock:
+            self._responses.clear()
+            self._data_versions = None
+
+
+class DataVersionListener(threading.Thread):
+    """ Listens for the notifications sent by bump_data_version, so that the data versions are re-read as soon
+    as new data is committed, rather than when they expire.
+    NOTE: Notifications are only sent to the primary database, so this connects to the write host.
+    """
+
+    def __init__(self, cache: ResponseCache):
+        super().__init__(name='data_version_listener', daemon=True)
+        self.cache = cache
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            # pylint: disable=broad-except
+            except Exception as exception:
+                # In the meantime, the data versions are still re-read when they expire.
+                logger.warning('listening for data versions failed, retrying in %s seconds',
+                               LISTEN_TIMEOUT_SECONDS, exc_info=exception)
+                time.sleep(LISTEN_TIMEOUT_SECONDS)
+
+    def _listen(self):
+        connection = psycopg2.connect(app.db.database.DB_WRITE_STRING)
+        try:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute('LISTEN {}'.format(DATA_VERSIONS_CHANNEL))
+            # Versions may have been bumped while we weren't listening.
+            self.cache.invalidate_data_versions()
+            while True:
+                if select.select([connection], [], [], LISTEN_TIMEOUT_SECONDS) != ([], [], []):
+                    self.handle_notifies(connection)
+        finally:
+            connection.close()
+
+    def handle_notifies(self, connection):
+        """ Invalidate the data versions if any were bumped. """
+        connection.poll()
+        if connection.notifies:
+            data_sources = {notify.payload for notify in connection.notifies}
+            connection.notifies.clear()
+            logger.info('data versions bumped: %s', data_sources)
+            self.cache.invalidate_data_versions()
+
+
+def _make_parameter_key(value) -> Hashable:
+    """ Make the part of the key for a request parameter. The order of stations doesn't matter.
+    NOTE: The time of interest is keyed on exactly, because the queries use it exactly (e.g. to pick the
+    most recent model runs) - requests within the same hour don't necessarily get the same response. """
+    if isinstance(value, WeatherDataRequest):
+        return (tuple(sorted(value.stations)), _make_parameter_key(value.time_of_interest))
+    if isinstance(value, datetime):
+        # The same instant, regardless of timezone.
+        return value.timestamp()
+    return value
+
+
+def _create_redis_store() -> RedisResponseStore:
+    """ Create the redis store, if RESPONSE_CACHE_REDIS_URL is configured. """
+    redis_url = config.get('RESPONSE_CACHE_REDIS_URL', '')
+    if not redis_url:
+        return None
+    # redis is only needed (and so only imported) when a redis url is configured.
+    import redis  # pylint: disable=import-outside-toplevel, import-error
+    return RedisResponseStore(redis.Redis.from_url(redis_url),
+                              int(config.get('RESPONSE_CACHE_REDIS_EXPIRY_SECONDS', 86400)))
+
+
+# A max size of 0 disables the cache.
+_response_cache = ResponseCache(
+    max_size=int(config.get('RESPONSE_CACHE_MAX_SIZE', 2048)),
+    version_ttl=float(config.get('RESPONSE_CACHE_VERSION_TTL_SECONDS', 60)),
+    store=_create_redis_store(),
+    listen=config.get('RESPONSE_CACHE_LISTEN_FOR_DATA_VERSIONS', 'True') == 'True')
+
+
+def get_response_cache() -> ResponseCache:
+    """ Wrap getting the response cache to assist in making unit tests a bit easier """
+    return _response_cache
+
+
+def cached_response(endpoint: str, data_sources: Tuple[DataSourceEnum]) -> Callable:
+    """ Decorator for caching the responses of an endpoint, invalidated when any of the data sources
+    the response is built from changes. Works for both async and regular endpoints. """
+    def decorator(function: Callable):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(**kwargs):
+                cache = get_response_cache()
+                if cache.max_size <= 0:
+                    return await function(**kwargs)
+                key = cache.make_key(endpoint, data_sources, kwargs)
+                response = cache.get(key)
+                if response is None:
+                    response = await function(**kwargs)
+                    cache.put(key, response)
+                else:
+                    logger.info('serving cached response for %s', endpoint)
+                return response
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(**kwargs):
+            cache = get_response_cache()
+            if cache.max_size <= 0:
+                return function(**kwargs)
+            key = cache.make_key(endpoint, data_sources, kwargs)
+            response = cache.get(key)
+            if response is None:
+                response = function(**kwargs)
+                cache.put(key, response)
+            else:
+                logger.info('serving cached response for %s', endpoint)
+            return response
+        return wrapper
+    return decorator
+
+
+def fetch_station_fragments(name: str,
+                            data_sources: Tuple[DataSourceEnum],
+                            parameters: tuple,
+                            station_codes: List[int],
+                            fetch: Callable[[List[int]], Dict[int, object]]) -> Dict[int, object]:
+    """ Get the results for a list of stations, one fragment per station. Fragments are taken from the cache
+    where possible, and only the stations that aren't cached are fetched.
+
+    :param name: Name of the kind of fragment, e.g. the name of the function fetching them.
+    :param data_sources: The data sources the fragments are built from.
+    :param parameters: Parameters (other than the stations) that the fragments depend on, exactly as they're
+    passed to the query, so that all the fragments of a result are fetched for the same window.
+    :param fetch: Function fetching the fragments for a list of station codes, returning a dictionary of
+    fragments by station code. Stations without any data may be left out.
+    :return: Dictionary of fragments by station code, leaving out stations without any data.
+    """
+    cache = get_response_cache()
+    if cache.max_size <= 0:
+        return fetch(station_codes)
+    key_prefix = cache.make_station_key_prefix(name, data_sources, parameters)
+    fragments = {}
+    missing_station_codes = []
+    for station_code in station_codes:
+        fragment = cache.get((key_prefix, station_code))
+        if fragment is None:
+            missing_station_codes.append(station_code)
+        elif not isinstance(fragment, _NoData):
+            fragments[station_code] = fragment
+    if missing_station_codes:
+        logger.info('fetching %s for %d of %d stations', name, len(missing_station_codes), len(station_codes))
+        fetched = fetch(missing_station_codes)
+        for station_code in missing_station_codes:
+            cache.put((key_prefix, station_code), fetched.get(station_code, _NoData()))
+        fragments.update(fetched)
+    return fragments
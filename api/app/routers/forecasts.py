@@ -6,6 +6,8 @@ from fastapi import APIRouter, Depends
 from app.auth import authenticate
 from app.schemas.forecasts import NoonForecastResponse, NoonForecastSummariesResponse
 from app.schemas.shared import WeatherDataRequest
+from app.db.models.data_versions import DataSourceEnum
+from app.response_cache import cached_response
 from app.forecasts.noon_forecasts import fetch_noon_forecasts
 from app.forecasts.noon_forecasts_summaries import fetch_noon_forecasts_summaries
 
@@ -19,6 +21,7 @@ router = APIRouter(
 
 
 @router.post('/noon/', response_model=NoonForecastResponse)
+@cached_response('/forecasts/noon/', (DataSourceEnum.NOON_FORECASTS,))
 def get_noon_forecasts(request: WeatherDataRequest):
     """ Returns noon forecasts pulled from BC FireWeather Phase 1 website for the specified
     set of weather stations. """
@@ -35,6 +38,7 @@ def get_noon_forecasts(request: WeatherDataRequest):
 
 
 @router.post('/noon/summaries/', response_model=NoonForecastSummariesResponse)
+@cached_response('/forecasts/noon/summaries/', (DataSourceEnum.NOON_FORECASTS,))
 async def get_noon_forecasts_summaries(request: WeatherDataRequest):
     """ Returns summaries of noon forecasts for given weather stations """
     try:
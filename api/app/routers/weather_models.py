@@ -8,6 +8,8 @@ from app.schemas.weather_models import (
     WeatherModelPredictionSummaryResponse,
     WeatherStationsModelRunsPredictionsResponse)
 from app.schemas.shared import WeatherDataRequest
+from app.db.models.data_versions import DataSourceEnum
+from app.response_cache import cached_response
 from app.weather_models.fetch.summaries import fetch_model_prediction_summaries
 from app.weather_models.fetch.predictions import (
     fetch_model_run_predictions_by_station_code)
@@ -22,6 +24,7 @@ router = APIRouter(
 
 @router.post('/{model}/predictions/summaries/',
              response_model=WeatherModelPredictionSummaryResponse)
+@cached_response('/weather_models/predictions/summaries/', (DataSourceEnum.WEATHER_MODELS,))
 async def get_model_prediction_summaries(
         model: ModelEnum, request: WeatherDataRequest):
     """ Returns a summary of predictions for a given model. """
@@ -38,6 +41,7 @@ async def get_model_prediction_summaries(
 
 @router.post('/{model}/predictions/most_recent/',
              response_model=WeatherStationsModelRunsPredictionsResponse)
+@cached_response('/weather_models/predictions/most_recent/', (DataSourceEnum.WEATHER_MODELS,))
 async def get_most_recent_model_values(
         model: ModelEnum, request: WeatherDataRequest):
     """ Returns the weather values for the last model prediction that was issued
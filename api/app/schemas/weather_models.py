@@ -13,14 +13,15 @@ class WeatherPredictionModel(BaseModel):
 
 
 class WeatherModelPredictionSummaryValues(BaseModel):
-    """ Summary of model prediction values. """
+    """ Summary of model prediction values. The percentiles of a variable are None if there are no
+    predictions of it. """
     datetime: datetime
-    tmp_tgl_2_5th: float
-    tmp_tgl_2_90th: float
-    tmp_tgl_2_median: float
-    rh_tgl_2_5th: float
-    rh_tgl_2_90th: float
-    rh_tgl_2_median: float
+    tmp_tgl_2_5th: float = None
+    tmp_tgl_2_90th: float = None
+    tmp_tgl_2_median: float = None
+    rh_tgl_2_5th: float = None
+    rh_tgl_2_90th: float = None
+    rh_tgl_2_median: float = None
 
 
 class WeatherModelPredictionSummary(BaseModel):
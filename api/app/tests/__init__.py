@@ -32,10 +32,10 @@ def json_converter(item: object):
 def dump_sqlalchemy_response_to_json(response, target: IO[Any]):
     """ Useful for dumping sqlalchemy responses to json in for unit tests.
 
-    e.g. if we want to store the response for GDPS predictions for two stations, we could write the
+    e.g. if we want to store the response for GDPS prediction summaries for two stations, we could write the
     following code:
     ```python
-    query = get_station_model_predictions_order_by_prediction_timestamp(
+    query = get_station_model_prediction_summaries(
         session, [322, 838], ModelEnum.GDPS, back_5_days, now)
     with open('tmp.json', 'w') as tmp:
         dump_sqlalchemy_response_to_json(query, tmp)
@@ -45,6 +45,10 @@ def dump_sqlalchemy_response_to_json(response, target: IO[Any]):
     for rows in response:
         result_row = []
         for record in rows:
+            if not hasattr(record, '_sa_instance_state'):
+                # Plain values (e.g. labelled columns) are stored as is.
+                result_row.append(record)
+                continue
             # Copy the dict so we can safely change it.
             data = dict(record.__dict__)
             # Pop internal value
@@ -92,8 +96,11 @@ def load_sqlalchemy_response_from_object(data: object):
         for row in data:
             result_row = []
             for record in row:
-                object_ = de_serialize_record(record)
-                result_row.append(object_)
+                if isinstance(record, dict) and 'module' in record:
+                    result_row.append(de_serialize_record(record))
+                else:
+                    # Plain values (e.g. labelled columns) are loaded as is.
+                    result_row.append(record)
             result.append(result_row)
         return result
     # Sometimes though, we're only expecting a single record, not a list.
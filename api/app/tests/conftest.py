@@ -12,6 +12,8 @@ from app.tests.common import (
     default_mock_requests_session_get, default_mock_requests_session_post)
 from app.db.models import PredictionModel, PredictionModelRunTimestamp
 import app.db.database
+import app.response_cache
+from app.response_cache import ResponseCache
 import app.time_utils as time_utils
 from app.schemas.shared import WeatherDataRequest
 
@@ -104,6 +106,13 @@ def mock_session(monkeypatch):
     monkeypatch.setattr(app.db.database, 'get_write_session', mock_get_session)
 
 
+@pytest.fixture(autouse=True)
+def mock_response_cache(monkeypatch):
+    """ Disable the response cache by default, so that responses aren't shared between unit tests """
+    cache = ResponseCache(max_size=0, version_ttl=0)
+    monkeypatch.setattr(app.response_cache, 'get_response_cache', lambda: cache)
+
+
 @pytest.fixture()
 def mock_env_with_use_wfwx(monkeypatch):
     """ Set environment variable USE_WFWX to 'True' """
@@ -6,7 +6,7 @@ import json
 import os
 import logging
 from typing import List
-from datetime import datetime
+from datetime import datetime, timezone
 import pytest
 from pytest_bdd import scenario, given, then
 from starlette.testclient import TestClient
@@ -16,7 +16,9 @@ import app.main
 from app.tests.common import default_mock_client_get
 import app.wildfire_one
 import app.db.database
+import app.response_cache
 from app.db.models.forecasts import NoonForecast
+from app.forecasts import noon_forecasts
 
 logger = logging.getLogger(__name__)
 
@@ -72,3 +74,33 @@ def assert_status_code(response, status):
 def assert_number_of_forecasts_groups(response, num_groups):
     """ Assert that we receive the expected number of forecast groups """
     assert len(response.json()['noon_forecasts']) == num_groups
+
+
+def test_noon_forecasts_order(monkeypatch):
+    """ Stations are ordered as they were read by a single query (by their first weather date, then most
+    recently created), also when some of them come from the cache """
+    def make_record(station_code, day, created_day):
+        return NoonForecast(
+            station_code=station_code,
+            weather_date=datetime(2020, 7, day, 20, tzinfo=timezone.utc),
+            created_at=datetime(2020, 7, created_day, 20, tzinfo=timezone.utc),
+            temp_valid=True, temperature=10, rh_valid=True, relative_humidity=10, wdir_valid=True,
+            wind_direction=10, wspeed_valid=True, wind_speed=10, precip_valid=True, precipitation=1,
+            gc=1, ffmc=1, dmc=1, dc=1, isi=1, bui=1, fwi=1, danger_rating=1)
+    # As ordered by query_noon_forecast_records, i.e. by weather_date, then most recently created.
+    records = [make_record(322, 20, 19), make_record(838, 20, 18), make_record(209, 21, 20),
+               make_record(322, 21, 20)]
+    monkeypatch.setattr(app.db.database, 'get_read_session', UnifiedAlchemyMagicMock)
+    monkeypatch.setattr(noon_forecasts, 'query_noon_forecast_records',
+                        lambda session, codes, *args: [record for record in records
+                                                       if record.station_code in codes])
+    cache = app.response_cache.ResponseCache(max_size=10, version_ttl=3600)
+    monkeypatch.setattr(app.response_cache, 'get_response_cache', lambda: cache)
+    monkeypatch.setattr(app.response_cache, 'get_data_versions', lambda session: {})
+    start_date = datetime(2020, 7, 19, tzinfo=timezone.utc)
+    end_date = datetime(2020, 7, 22, tzinfo=timezone.utc)
+
+    # 209 is cached by the first request.
+    noon_forecasts.fetch_noon_forecasts([209], start_date, end_date)
+    response = noon_forecasts.fetch_noon_forecasts([209, 838, 322], start_date, end_date)
+    assert [forecast.station_code for forecast in response.noon_forecasts] == [322, 838, 209]
@@ -0,0 +1,177 @@
+""" Unit tests for the response cache """
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import pytest
+from alchemy_mock.mocking import UnifiedAlchemyMagicMock
+import app.db.database
+import app.response_cache
+from app.response_cache import (ResponseCache, RedisResponseStore, DataVersionListener, cached_response,
+                                fetch_station_fragments)
+from app.db.models.data_versions import DataSourceEnum
+from app.schemas.shared import WeatherDataRequest
+
+
+class MockRedis():
+    """ Stand-in for a redis client """
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        """ Get a value """
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):  # pylint: disable=unused-argument
+        """ Set a value """
+        self.values[key] = value
+
+
+@pytest.fixture()
+def mock_data_versions(monkeypatch):
+    """ Mocked out data versions, and an empty cache """
+    versions = {}
+    cache = ResponseCache(max_size=2, version_ttl=0)
+    monkeypatch.setattr(app.response_cache, 'get_response_cache', lambda: cache)
+    monkeypatch.setattr(app.response_cache, 'get_data_versions', lambda session: versions)
+    monkeypatch.setattr(app.db.database, 'get_read_session', UnifiedAlchemyMagicMock)
+    return versions
+
+
+def test_cached_response(mock_data_versions):
+    """ Repeat requests are served from the cache, until the data changes """
+    # pylint: disable=redefined-outer-name
+    calls = []
+
+    @cached_response('/test/', (DataSourceEnum.NOON_FORECASTS,))
+    def endpoint(request: WeatherDataRequest):
+        calls.append(request)
+        return len(calls)
+
+    request = WeatherDataRequest(
+        stations=[322, 838], time_of_interest=datetime(2020, 12, 1, 10, 5, tzinfo=timezone.utc))
+    # Same stations in a different order, at the same time.
+    same_request = WeatherDataRequest(
+        stations=[838, 322], time_of_interest=datetime(2020, 12, 1, 10, 5, tzinfo=timezone.utc))
+    assert endpoint(request=request) == 1
+    assert endpoint(request=same_request) == 1
+    # Data that the endpoint doesn't depend on changing doesn't matter.
+    mock_data_versions[DataSourceEnum.WEATHER_MODELS.value] = 1
+    assert endpoint(request=request) == 1
+    # New noon forecasts, so the cached response is stale.
+    mock_data_versions[DataSourceEnum.NOON_FORECASTS.value] = 1
+    assert endpoint(request=request) == 2
+    assert endpoint(request=same_request) == 2
+    # A different time of interest (even in the same hour) is queried with a different window, so it
+    # doesn't share the response.
+    later_request = WeatherDataRequest(
+        stations=[322, 838], time_of_interest=datetime(2020, 12, 1, 10, 40, tzinfo=timezone.utc))
+    assert endpoint(request=later_request) == 3
+    assert endpoint(request=request) == 2
+
+
+def test_cached_response_async(mock_data_versions):
+    """ Async endpoints are cached too, and the least recently used response is evicted """
+    # pylint: disable=redefined-outer-name, unused-argument
+    calls = []
+
+    @cached_response('/test/', (DataSourceEnum.WEATHER_MODELS,))
+    async def endpoint(model: str, request: WeatherDataRequest):
+        calls.append((model, request))
+        return len(calls)
+
+    request = WeatherDataRequest(
+        stations=[322], time_of_interest=datetime(2020, 12, 1, 10, tzinfo=timezone.utc))
+    assert asyncio.run(endpoint(model='GDPS', request=request)) == 1
+    assert asyncio.run(endpoint(model='RDPS', request=request)) == 2
+    assert asyncio.run(endpoint(model='GDPS', request=request)) == 1
+    # The cache holds 2 responses, so the RDPS response (least recently used) is evicted.
+    assert asyncio.run(endpoint(model='HRDPS', request=request)) == 3
+    assert asyncio.run(endpoint(model='GDPS', request=request)) == 1
+    assert asyncio.run(endpoint(model='RDPS', request=request)) == 4
+
+
+def test_fetch_station_fragments(mock_data_versions):
+    """ Only the stations that aren't cached yet are fetched, including stations without any data """
+    # pylint: disable=redefined-outer-name
+    fetched = []
+
+    def fetch(station_codes):
+        fetched.append(station_codes)
+        # Station 3 doesn't have any data.
+        return {station_code: station_code * 10 for station_code in station_codes if station_code != 3}
+
+    time_of_interest = datetime(2020, 12, 1, 10, tzinfo=timezone.utc)
+    app.response_cache.get_response_cache().max_size = 10
+    parameters = ('GDPS', time_of_interest)
+    assert fetch_station_fragments(
+        'test', (DataSourceEnum.WEATHER_MODELS,), parameters, [1, 2, 3], fetch) == {1: 10, 2: 20}
+    assert fetch_station_fragments(
+        'test', (DataSourceEnum.WEATHER_MODELS,), parameters, [2, 3, 4], fetch) == {2: 20, 4: 40}
+    assert fetched == [[1, 2, 3], [4]]
+    # Different parameters, or new data, don't share fragments.
+    fetch_station_fragments('test', (DataSourceEnum.WEATHER_MODELS,), ('RDPS', time_of_interest), [1], fetch)
+    mock_data_versions[DataSourceEnum.WEATHER_MODELS.value] = 1
+    fetch_station_fragments('test', (DataSourceEnum.WEATHER_MODELS,), parameters, [1], fetch)
+    assert fetched == [[1, 2, 3], [4], [1], [1]]
+    # Nor does another time of interest in the same hour, which would query another window.
+    fetch_station_fragments('test', (DataSourceEnum.WEATHER_MODELS,),
+                            ('GDPS', time_of_interest.replace(minute=30)), [1, 2], fetch)
+    assert fetched == [[1, 2, 3], [4], [1], [1], [1, 2]]
+
+
+def test_redis_store(mock_data_versions, monkeypatch):
+    """ Responses are shared through redis, between processes with their own in-process cache """
+    # pylint: disable=redefined-outer-name, unused-argument
+    redis = MockRedis()
+    fetched = []
+
+    def fetch(station_codes):
+        fetched.append(station_codes)
+        return {station_code: station_code * 10 for station_code in station_codes if station_code != 3}
+
+    def fetch_in_new_process():
+        """ Fetch the fragments like a different API process would, with an empty in-process cache """
+        cache = ResponseCache(max_size=10, version_ttl=0, store=RedisResponseStore(redis, 60))
+        monkeypatch.setattr(app.response_cache, 'get_response_cache', lambda: cache)
+        parameters = ('GDPS', datetime(2020, 12, 1, 10, tzinfo=timezone.utc))
+        return fetch_station_fragments('test', (DataSourceEnum.WEATHER_MODELS,), parameters, [1, 2, 3], fetch)
+
+    assert fetch_in_new_process() == {1: 10, 2: 20}
+    assert fetch_in_new_process() == {1: 10, 2: 20}
+    # The 2nd process got all the fragments (including station 3 not having data) from redis.
+    assert fetched == [[1, 2, 3]]
+
+
+def test_redis_errors_are_cache_misses():
+    """ The API keeps working if redis is unavailable """
+    def fail(*args, **kwargs):
+        raise ConnectionError()
+    store = RedisResponseStore(SimpleNamespace(get=fail, set=fail), 60)
+    store.put('key', 'response')
+    assert store.get('key') is None
+
+
+def test_data_version_listener(monkeypatch):
+    """ The data versions are re-read as soon as a version bump is notified, before they expire """
+    versions = {'weather_models': 1}
+    reads = []
+
+    def mock_get_data_versions(session):  # pylint: disable=unused-argument
+        reads.append(dict(versions))
+        return dict(versions)
+    monkeypatch.setattr(app.response_cache, 'get_data_versions', mock_get_data_versions)
+    monkeypatch.setattr(app.db.database, 'get_read_session', UnifiedAlchemyMagicMock)
+    cache = ResponseCache(max_size=10, version_ttl=3600)
+    listener = DataVersionListener(cache)
+
+    assert cache.get_data_versions() == {'weather_models': 1}
+    versions['weather_models'] = 2
+    # Nothing notified yet, so the versions are re-used.
+    listener.handle_notifies(SimpleNamespace(poll=lambda: None, notifies=[]))
+    assert cache.get_data_versions() == {'weather_models': 1}
+    notifies = [SimpleNamespace(payload='weather_models')]
+    listener.handle_notifies(SimpleNamespace(poll=lambda: None, notifies=notifies))
+    assert cache.get_data_versions() == {'weather_models': 2}
+    assert not notifies
+    assert len(reads) == 2
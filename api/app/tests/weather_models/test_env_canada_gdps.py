@@ -3,10 +3,13 @@
 import os
 import sys
 import logging
+import threading
 import datetime
 from datetime import datetime
+from concurrent.futures import Future
 import pytest
 import requests
+import gdal
 import shapely.wkt
 from geoalchemy2.shape import from_shape
 from alchemy_mock.mocking import UnifiedAlchemyMagicMock
@@ -14,7 +17,7 @@ from alchemy_mock.compat import mock
 import app.time_utils as time_utils
 import app.db.database
 from app.schemas.stations import WeatherStation, Season
-from app.weather_models import env_canada, machine_learning
+from app.weather_models import env_canada, machine_learning, process_grib, ModelEnum
 from app.db.models import (PredictionModel, ProcessedModelRunUrl, PredictionModelRunTimestamp,
                            PredictionModelGridSubset, ModelRunGridSubsetPrediction)
 from app.tests.weather_models.crud import get_actuals_left_outer_join_with_predictions
@@ -31,6 +34,37 @@ class MockResponse:
         self.status_code = status_code
         self.content = content
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size):
+        """ Yield the content in chunks """
+        for index in range(0, len(self.content), chunk_size):
+            yield self.content[index:index + chunk_size]
+
+
+class MockProcessPoolExecutor:
+    """ Mocked out process pool executor, that runs the worker in this process """
+
+    def __init__(self, max_workers, mp_context, initializer, initargs=()):
+        self.max_workers = max_workers
+        initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, function, *args):
+        """ Run the function right away """
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
 
 @pytest.fixture()
 def mock_get_stations(monkeypatch):
@@ -44,11 +78,16 @@ def mock_get_stations(monkeypatch):
 
 
 @pytest.fixture()
-def mock_get_processed_file_count(monkeypatch):
-    """ Mocked out get processed file count """
-    def mock_get_count(*args):
-        return 162
-    monkeypatch.setattr(env_canada, 'get_processed_file_count', mock_get_count)
+def mock_get_processed_file_urls(monkeypatch):
+    """ Mock out the check for processed files, treating all files except the very first one as processed """
+    calls = []
+
+    def mock_get_urls(session, urls):
+        calls.append(urls)
+        if len(calls) == 1:
+            return set(urls[1:])
+        return set(urls)
+    monkeypatch.setattr(env_canada, 'get_processed_file_urls', mock_get_urls)
 
 
 @pytest.fixture()
@@ -90,6 +129,12 @@ def mock_get_actuals_left_outer_join_with_predictions(monkeypatch):
                         get_actuals_left_outer_join_with_predictions)
 
 
+def mock_create_grid_subsets(session, prediction_model_id, geoms):
+    """ Mock out the creation of grid subsets, returning the id and geom of each new grid subset """
+    return [(grid_subset_id, from_shape(shapely.wkt.loads(geom)))
+            for grid_subset_id, geom in enumerate(geoms, start=2)]
+
+
 @pytest.fixture()
 def mock_session(monkeypatch):
     """ Mocked out sqlalchemy session object """
@@ -138,6 +183,12 @@ def mock_session(monkeypatch):
 
     monkeypatch.setattr(app.db.database, 'get_write_session',
                         mock_get_session_gdps)
+    monkeypatch.setattr(process_grib, 'create_grid_subsets', mock_create_grid_subsets)
+    monkeypatch.setattr(env_canada, 'get_grids_for_coordinates',
+                        lambda session, prediction_model, coordinates: {
+                            station_code: PredictionModelGridSubset(
+                                id=1, prediction_model_id=prediction_model.id, geom=from_shape(shape))
+                            for station_code in coordinates})
     monkeypatch.setattr(env_canada, 'get_prediction_model_run_timestamp_records',
                         mock_get_gdps_prediction_model_run_timestamp_records)
 
@@ -153,7 +204,7 @@ def mock_download(monkeypatch):
         with open(filename, 'rb') as file:
             content = file.read()
         return MockResponse(status_code=200, content=content)
-    monkeypatch.setattr(requests, 'get', mock_requests_get_gdps)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get_gdps)
 
 
 @pytest.fixture()
@@ -162,7 +213,7 @@ def mock_download_fail(monkeypatch):
     def mock_requests_get(*args, **kwargs):
         """ mock env_canada download method """
         return MockResponse(status_code=400)
-    monkeypatch.setattr(requests, 'get', mock_requests_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get)
 
 
 def test_get_gdps_download_urls():
@@ -175,7 +226,7 @@ def test_get_gdps_download_urls():
 
 def test_process_gdps(mock_download,
                       mock_session,
-                      mock_get_processed_file_count,
+                      mock_get_processed_file_urls,
                       mock_get_model_run_predictions_for_grid,
                       mock_get_actuals_left_outer_join_with_predictions,
                       mock_get_stations):
@@ -186,6 +237,310 @@ def test_process_gdps(mock_download,
     assert env_canada.process_models() == 1
 
 
+def test_download_urls_backpressure(monkeypatch, mock_session, mock_get_stations):
+    """ Files are downloaded concurrently, in order, but downloads never get more than the maximum number
+    of downloaded files ahead of processing """
+    monkeypatch.setenv('ENV_CANADA_DOWNLOAD_WORKERS', '3')
+    monkeypatch.setenv('ENV_CANADA_MAX_DOWNLOADED_FILES', '4')
+    downloaded = []
+    lock = threading.Lock()
+
+    def mock_download(url, path, http_session):
+        with lock:
+            downloaded.append(url)
+        return os.path.join(path, url)
+    monkeypatch.setattr(env_canada, 'download', mock_download)
+
+    processor = env_canada.EnvCanada(ModelEnum.GDPS)
+    urls = ['file_{}.grib2'.format(index) for index in range(20)]
+    processed = []
+    for url, download_future in processor.download_urls(urls, 'tmp'):
+        assert download_future.result() == os.path.join('tmp', url)
+        processed.append(url)
+        assert len(downloaded) < len(processed) + 4
+    assert processed == urls
+
+
+def test_flag_files_as_processed_in_batches(monkeypatch, mock_session, mock_get_stations):
+    """ Processed files are flagged in the database in batches, with the remainder flagged on flush """
+    batches = []
+    monkeypatch.setattr(env_canada, 'upsert_processed_file_urls',
+                        lambda session, urls, now: batches.append(urls))
+    processor = env_canada.EnvCanada(ModelEnum.GDPS)
+    urls = ['file_{}.grib2'.format(index) for index in range(env_canada.PROCESSED_URL_BATCH_SIZE + 1)]
+    for url in urls:
+        processor.flag_file_as_processed(url)
+    assert batches == [urls[:-1]]
+    processor.flush_processed_files()
+    assert batches == [urls[:-1], urls[-1:]]
+
+
+@pytest.mark.parametrize('path', [env_canada.VSIMEM_PATH, None])
+def test_download_streams_to_file(monkeypatch, tmp_path, path):
+    """ Downloads are written in chunks, either to disk, or to GDAL's in memory file system """
+    content = bytes(range(256)) * 10
+    monkeypatch.setattr(env_canada, 'DOWNLOAD_CHUNK_SIZE', 1000)
+    monkeypatch.setattr(requests, 'get', lambda *args, **kwargs: MockResponse(200, content))
+    target = env_canada.download('https://example.com/file.grib2', path or str(tmp_path))
+    if path:
+        assert target == env_canada.VSIMEM_PATH + '/file.grib2'
+        file_object = gdal.VSIFOpenL(target, 'rb')
+        assert gdal.VSIFReadL(1, len(content) + 1, file_object) == content
+        gdal.VSIFCloseL(file_object)
+    else:
+        with open(target, 'rb') as file_object:
+            assert file_object.read() == content
+    env_canada.remove_downloaded_file(target)
+
+
+class FailingMockResponse(MockResponse):
+    """ Mocked out request.Response object, with a connection that breaks after the first chunk """
+
+    def iter_content(self, chunk_size):
+        yield self.content[:chunk_size]
+        raise requests.exceptions.ChunkedEncodingError('Connection broken')
+
+
+@pytest.mark.parametrize('path', [env_canada.VSIMEM_PATH, None])
+def test_failed_download_is_removed(monkeypatch, tmp_path, path):
+    """ If a download fails part way, the partially written file is removed, from disk or from GDAL's in
+    memory file system """
+    monkeypatch.setattr(env_canada, 'DOWNLOAD_CHUNK_SIZE', 1000)
+    monkeypatch.setattr(requests, 'get', lambda *args, **kwargs: FailingMockResponse(200, bytes(2000)))
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        env_canada.download('https://example.com/file.grib2', path or str(tmp_path))
+    if path:
+        assert gdal.VSIFOpenL(env_canada.VSIMEM_PATH + '/file.grib2', 'rb') is None
+    else:
+        assert os.listdir(str(tmp_path)) == []
+
+
+def test_delta_precip_from_previous_prediction(monkeypatch,
+                                               mock_session,
+                                               mock_get_model_run_predictions_for_grid,
+                                               mock_get_actuals_left_outer_join_with_predictions,
+                                               mock_get_stations):
+    """ The delta precipitation of each station prediction is calculated from the previous station
+    prediction in the model run, and all the predictions are upserted in one go """
+    batches = []
+    monkeypatch.setattr(env_canada, 'upsert_weather_station_model_predictions',
+                        lambda session, station_predictions: batches.append(station_predictions))
+    processor = env_canada.ModelValueProcessor()
+    model_run = PredictionModelRunTimestamp(
+        id=1, prediction_run_timestamp=time_utils.get_utc_now(),
+        prediction_model=PredictionModel(id=1, abbreviation='GDPS', projection='latlon.15x.15'))
+    processor._process_model_run(model_run)  # pylint: disable=protected-access
+    assert processor.session.flush.call_count == 0
+    assert processor.session.add.call_count == 0
+    assert len(batches) == 1
+    station_predictions = batches[0]
+    # 18h, an interpolated noon prediction, and two 21h predictions.
+    hours = [station_prediction['prediction_timestamp'].hour for station_prediction in station_predictions]
+    assert hours == [18, 20, 21, 21]
+    assert station_predictions[0]['delta_precip'] == station_predictions[0]['apcp_sfc_0']
+    for prev_station_prediction, station_prediction in zip(station_predictions, station_predictions[1:]):
+        assert station_prediction['delta_precip'] == pytest.approx(
+            station_prediction['apcp_sfc_0'] - prev_station_prediction['apcp_sfc_0'])
+
+
+def test_interpolate_with_workers(monkeypatch,
+                                  mock_session,
+                                  mock_get_model_run_predictions_for_grid,
+                                  mock_get_actuals_left_outer_join_with_predictions):
+    """ The stations are sharded across the workers, with the parent upserting the predictions of all the
+    stations """
+    stations = [WeatherStation(
+        code=code, name='Test', lat=50.7, long=-120.425, ecodivision_name='Test',
+        core_season=Season(start_month=5, start_day=1, end_month=9, end_day=21)) for code in range(5)]
+    monkeypatch.setattr(env_canada, 'get_stations_synchronously', lambda: stations)
+    monkeypatch.setattr(env_canada, 'ProcessPoolExecutor', MockProcessPoolExecutor)
+    monkeypatch.setattr(env_canada, 'configure_logging', lambda: None)
+    station_predictions = []
+    monkeypatch.setattr(env_canada, 'upsert_weather_station_model_predictions',
+                        lambda session, predictions: station_predictions.extend(predictions))
+    shards = []
+    process_model_run_for_stations_in_worker = env_canada.process_model_run_for_stations_in_worker
+
+    def mock_process_model_run_for_stations_in_worker(model_run_id, stations, until):
+        shards.append([station.code for station in stations])
+        return process_model_run_for_stations_in_worker(model_run_id, stations, until)
+    monkeypatch.setattr(env_canada, 'process_model_run_for_stations_in_worker',
+                        mock_process_model_run_for_stations_in_worker)
+
+    processor = env_canada.ModelValueProcessor(workers=2)
+    processor.process(ModelEnum.GDPS)
+    assert shards == [[0, 2, 4], [1, 3]]
+    # Each station has 4 predictions.
+    station_codes = [station_prediction['station_code'] for station_prediction in station_predictions]
+    assert sorted(station_codes) == sorted(list(range(5)) * 4)
+
+
+def test_grids_looked_up_once_per_model(monkeypatch,
+                                        mock_session,
+                                        mock_get_model_run_predictions_for_grid,
+                                        mock_get_actuals_left_outer_join_with_predictions,
+                                        mock_get_stations):
+    """ The grids containing the stations are looked up in one go, and re-used for subsequent model runs """
+    monkeypatch.setattr(env_canada, 'upsert_weather_station_model_predictions', lambda *args: None)
+    get_grids_for_coordinates = env_canada.get_grids_for_coordinates
+    lookups = []
+
+    def mock_get_grids_for_coordinates(session, prediction_model, coordinates):
+        lookups.append(coordinates)
+        return get_grids_for_coordinates(session, prediction_model, coordinates)
+    monkeypatch.setattr(env_canada, 'get_grids_for_coordinates', mock_get_grids_for_coordinates)
+    processor = env_canada.ModelValueProcessor()
+    prediction_model = PredictionModel(id=1, abbreviation='GDPS', projection='latlon.15x.15')
+    for model_run_id in range(2):
+        model_run = PredictionModelRunTimestamp(
+            id=model_run_id, prediction_run_timestamp=time_utils.get_utc_now(),
+            prediction_model=prediction_model)
+        processor._process_model_run(model_run)  # pylint: disable=protected-access
+    assert lookups == [{123: (-120.425, 50.7)}]
+
+
+def test_get_ingested_until(monkeypatch):
+    """ A model run is ingested up to the last prediction timestamp, before the first prediction timestamp
+    that is missing any of its layers """
+    model_run = PredictionModelRunTimestamp(
+        id=1, prediction_run_timestamp=datetime.fromisoformat('2021-02-03T00:00:00+00:00'))
+    urls = env_canada.get_model_run_urls(model_run.prediction_run_timestamp, ModelEnum.GDPS, 0)
+    # 000 has no APCP_SFC_0, so 000 and 003 are 9 urls, and the 006 hour is missing its last layer. A
+    # later hour has been ingested out of order.
+    processed_urls = set(urls[:13] + urls[-5:])
+    monkeypatch.setattr(env_canada, 'get_processed_file_urls',
+                        lambda session, urls: processed_urls.intersection(urls))
+    assert env_canada.get_ingested_until(None, model_run, ModelEnum.GDPS) == datetime.fromisoformat(
+        '2021-02-03T03:00:00+00:00')
+    processed_urls = set(urls[1:])
+    assert env_canada.get_ingested_until(None, model_run, ModelEnum.GDPS) is None
+
+
+def test_incremental_interpolation(monkeypatch,
+                                   mock_session,
+                                   mock_get_model_run_predictions_for_grid,
+                                   mock_get_actuals_left_outer_join_with_predictions,
+                                   mock_get_stations):
+    """ Model runs that are still being downloaded are interpolated up to the last fully ingested prediction
+    timestamp, with only the predictions after the previous pass being written """
+    prediction_model = PredictionModel(id=1, abbreviation='GDPS', projection='latlon.15x.15')
+    model_run = PredictionModelRunTimestamp(
+        id=1, prediction_run_timestamp=datetime(2020, 10, 10, 12), prediction_model=prediction_model,
+        complete=False, interpolated=False, interpolated_until=datetime(2020, 10, 10, 18))
+    up_to_date_model_run = PredictionModelRunTimestamp(
+        id=2, prediction_run_timestamp=datetime(2020, 10, 10, 6), prediction_model=prediction_model,
+        complete=False, interpolated=False, interpolated_until=datetime(2020, 10, 10, 21))
+    monkeypatch.setattr(env_canada, 'get_prediction_model_run_timestamp_records',
+                        lambda session, complete, interpolated, model_type: [
+                            (model_run, prediction_model), (up_to_date_model_run, prediction_model)])
+    monkeypatch.setattr(env_canada, 'get_ingested_until',
+                        lambda session, model_run, model_type: datetime(2020, 10, 10, 21))
+    station_predictions = []
+    monkeypatch.setattr(env_canada, 'upsert_weather_station_model_predictions',
+                        lambda session, predictions: station_predictions.extend(predictions))
+    latest_model_runs = []
+    monkeypatch.setattr(env_canada, 'upsert_latest_station_model_predictions',
+                        lambda session, prediction_run, now: latest_model_runs.append(prediction_run))
+
+    processor = env_canada.ModelValueProcessor(incremental=True)
+    processor.process_incomplete_model_runs(ModelEnum.GDPS)
+    # The 18h prediction was written in a previous pass, and the 2nd model run had nothing new.
+    hours = [station_prediction['prediction_timestamp'].hour for station_prediction in station_predictions]
+    assert hours == [20, 21, 21]
+    assert {station_prediction['prediction_model_run_timestamp_id']
+            for station_prediction in station_predictions} == {1}
+    assert model_run.interpolated_until == datetime(2020, 10, 10, 21)
+    assert not model_run.interpolated
+    # The latest predictions are refreshed as soon as the model run has been (partially) interpolated.
+    assert latest_model_runs == [model_run]
+
+
+def test_incremental_interpolation_resumes(monkeypatch,
+                                           mock_session,
+                                           mock_get_actuals_left_outer_join_with_predictions,
+                                           mock_get_stations):
+    """ A second incremental pass only reads and interpolates the hours after the previous pass (and the last
+    hour of the previous pass, to calculate delta precipitation and noon predictions from), writing the same
+    predictions as interpolating the whole model run in one go """
+    # pylint: disable=too-many-locals
+    prediction_model = PredictionModel(id=1, abbreviation='GDPS', projection='latlon.15x.15')
+    predictions = [
+        ModelRunGridSubsetPrediction(
+            tmp_tgl_2=[hour, 2, 3, 4], rh_tgl_2=[10, 20, 30, hour], apcp_sfc_0=[hour, hour, 3, 4],
+            wdir_tgl_10=[10, 20, 30, 40], wind_tgl_10=[1, 2, 3, 4],
+            prediction_timestamp=datetime(2020, 10, 10, hour))
+        for hour in (12, 15, 18, 21)]
+
+    def mock_get_predictions(session, model_run, grid, until=None, since=None):
+        return [prediction for prediction in predictions
+                if (until is None or prediction.prediction_timestamp <= until)
+                and (since is None or prediction.prediction_timestamp >= since)]
+    monkeypatch.setattr(env_canada, 'get_model_run_predictions_for_grid', mock_get_predictions)
+    interpolated_hours = []
+    interpolate_predictions = env_canada.interpolate_predictions
+
+    def mock_interpolate_predictions(predictions, weights):
+        interpolated_hours.append([prediction.prediction_timestamp.hour for prediction in predictions])
+        return interpolate_predictions(predictions, weights)
+    monkeypatch.setattr(env_canada, 'interpolate_predictions', mock_interpolate_predictions)
+    station_predictions = []
+    monkeypatch.setattr(env_canada, 'upsert_weather_station_model_predictions',
+                        lambda session, predictions: station_predictions.extend(predictions))
+    monkeypatch.setattr(env_canada, 'upsert_latest_station_model_predictions', lambda *args: None)
+    model_run = PredictionModelRunTimestamp(
+        id=1, prediction_run_timestamp=datetime(2020, 10, 10, 12), prediction_model=prediction_model,
+        complete=False, interpolated=False)
+    monkeypatch.setattr(env_canada, 'get_prediction_model_run_timestamp_records',
+                        lambda session, complete, interpolated, model_type: [(model_run, prediction_model)])
+    ingested_until = [datetime(2020, 10, 10, 15)]
+    monkeypatch.setattr(env_canada, 'get_ingested_until',
+                        lambda session, model_run, model_type: ingested_until[0])
+
+    processor = env_canada.ModelValueProcessor(incremental=True)
+    processor.process_incomplete_model_runs(ModelEnum.GDPS)
+    ingested_until[0] = datetime(2020, 10, 10, 21)
+    processor.process_incomplete_model_runs(ModelEnum.GDPS)
+    assert interpolated_hours == [[12, 15], [15, 18, 20, 21]]
+    incremental = station_predictions[:]
+
+    # Interpolate the whole model run in one go, to compare with.
+    station_predictions.clear()
+    model_run.interpolated_until = None
+    processor._process_model_run(model_run)  # pylint: disable=protected-access
+    assert [station_prediction['prediction_timestamp'].hour
+            for station_prediction in incremental] == [12, 15, 18, 20, 21]
+    ignored = ('create_date', 'update_date')
+    assert [{key: value for key, value in station_prediction.items() if key not in ignored}
+            for station_prediction in incremental] == [
+                {key: value for key, value in station_prediction.items() if key not in ignored}
+                for station_prediction in station_predictions]
+
+
+def test_interpolate_as_files_arrive(monkeypatch, mock_session, mock_get_stations):
+    """ When interpolating as we go, model runs are interpolated after every batch of prediction timestamps
+    that's processed, with all the layers of a prediction timestamp in the same batch """
+    events = []
+    processor = env_canada.EnvCanada(ModelEnum.GDPS,
+                                     interpolate_ingested=lambda: events.append('interpolate'))
+    urls = env_canada.get_model_run_urls(processor.now, ModelEnum.GDPS, 0)
+
+    def mock_process_model_run_urls(urls, processed_urls):
+        events.append(urls)
+        processor.files_processed += len(set(urls) - processed_urls)
+        processed_urls.update(urls)
+    monkeypatch.setattr(env_canada, 'get_model_run_urls', lambda now, model_type, hour: urls)
+    monkeypatch.setattr(env_canada, 'get_processed_file_urls', lambda session, urls: set())
+    monkeypatch.setattr(processor, 'process_model_run_urls', mock_process_model_run_urls)
+    monkeypatch.setattr(env_canada, 'mark_prediction_model_run_processed', lambda *args: None)
+    processor.process_model_run(0)
+
+    batches = events[::2]
+    assert events[1::2] == ['interpolate'] * len(batches)
+    assert [url for batch in batches for url in batch] == urls
+    assert [len({env_canada.parse_env_canada_filename(url).prediction_timestamp for url in batch})
+            for batch in batches] == [env_canada.INCREMENTAL_INTERPOLATION_BATCH_SIZE] * 10 + [1]
+
+
 def test_for_zero_day_bug(monkeypatch):
     """ There's a very specific case, where on the 1st day of the new month, before 12 UTC,
     a url with a month day zero is construced.
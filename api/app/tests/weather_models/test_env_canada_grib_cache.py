@@ -0,0 +1,177 @@
+""" Test downloading grib files to a local cache, against a local http server. """
+import os
+import datetime
+import threading
+from types import SimpleNamespace
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+from app.weather_models import env_canada
+
+FILENAME = 'CMC_glb_RH_TGL_2_latlon.15x.15_2020071300_P000.grib2'
+LAST_MODIFIED = formatdate(datetime.datetime(2020, 7, 13, 4, tzinfo=datetime.timezone.utc).timestamp(),
+                           usegmt=True)
+ETAG = '"5f0bd1c0-1d4c"'
+
+
+def read_grib_file():
+    """ Read the grib file served by the local server """
+    dirname = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(dirname, FILENAME), 'rb') as file_object:
+        return file_object.read()
+
+
+class GribRequestHandler(BaseHTTPRequestHandler):
+    """ Serve a grib file, supporting If-Modified-Since and (If-Range) Range requests, like the datamart
+    does """
+    content = read_grib_file()
+    requests = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ Handle GET request """
+        # NOTE: The status is recorded before responding, so that it's there by the time the client is done.
+        body = b''
+        headers = {}
+        if not self.path.endswith(FILENAME):
+            status = 404
+        elif self.headers.get('If-Modified-Since') and parsedate_to_datetime(
+                self.headers.get('If-Modified-Since')) >= parsedate_to_datetime(LAST_MODIFIED):
+            status = 304
+        elif self.headers.get('Range') and self.headers.get('If-Range') in (None, ETAG, LAST_MODIFIED):
+            start = int(self.headers.get('Range')[len('bytes='):-1])
+            if start >= len(self.content):
+                status = 416
+                headers['Content-Range'] = 'bytes */{}'.format(len(self.content))
+            else:
+                status = 206
+                body = self.content[start:]
+                headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                    start, len(self.content) - 1, len(self.content))
+        else:
+            status = 200
+            body = self.content
+        self.requests.append(status)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if body:
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Last-Modified', LAST_MODIFIED)
+            self.send_header('ETag', ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture()
+def grib_server():
+    """ Run a local http server, serving a grib file.
+    NOTE: requests.get is mocked out for all tests, so the tests use a requests session instead. """
+    GribRequestHandler.requests = []
+    server = HTTPServer(('127.0.0.1', 0), GribRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def write_partial_download(cache_path: str, content: bytes, validator: str = ETAG):
+    """ Write a partial download, as left behind by an interrupted download """
+    partial = os.path.join(cache_path, FILENAME + '.part')
+    with open(partial, 'wb') as file_object:
+        file_object.write(content)
+    if validator is not None:
+        with open(partial + '.validator', 'w') as file_object:
+            file_object.write(validator)
+
+
+def assert_downloaded(target: str):
+    """ Assert the whole file was downloaded, and the partial download cleaned up """
+    with open(target, 'rb') as file_object:
+        assert file_object.read() == GribRequestHandler.content
+    assert os.listdir(os.path.dirname(target)) == [FILENAME]
+
+
+def test_download_to_cache(grib_server, tmp_path):  # pylint: disable=redefined-outer-name
+    """ A file is downloaded once, and then served from the cache """
+    cache_path = str(tmp_path)
+    http_session = env_canada.get_http_session(1)
+    target = env_canada.download_to_cache(grib_server + FILENAME, cache_path, http_session)
+    assert target == os.path.join(cache_path, FILENAME)
+    assert_downloaded(target)
+    assert env_canada.download_to_cache(grib_server + FILENAME, cache_path, http_session) == target
+    assert env_canada.download_to_cache(grib_server + 'missing.grib2', cache_path, http_session) is None
+    assert GribRequestHandler.requests == [200, 304, 404]
+
+
+def test_download_to_cache_resumes(grib_server, tmp_path):  # pylint: disable=redefined-outer-name
+    """ An interrupted download is resumed with a range request, if the file on the server still matches
+    the validator of the first response """
+    cache_path = str(tmp_path)
+    http_session = env_canada.get_http_session(1)
+    write_partial_download(cache_path, GribRequestHandler.content[:1000])
+    assert_downloaded(env_canada.download_to_cache(grib_server + FILENAME, cache_path, http_session))
+    assert GribRequestHandler.requests == [206]
+
+
+def test_download_to_cache_stores_validator(tmp_path):
+    """ The validator of the file on the server is stored as soon as the download starts """
+    cache_path = str(tmp_path)
+    partial = os.path.join(cache_path, FILENAME + '.part')
+    response = SimpleNamespace(status_code=200, headers={'ETag': ETAG, 'Last-Modified': LAST_MODIFIED},
+                               raise_for_status=lambda: None, iter_content=lambda chunk_size: iter([b'12']))
+    assert env_canada._write_partial_download(  # pylint: disable=protected-access
+        response, partial, None) == (False, LAST_MODIFIED)
+    with open(partial + '.validator') as file_object:
+        assert file_object.read() == ETAG
+
+
+def test_download_to_cache_modified_on_server(grib_server, tmp_path):  # pylint: disable=redefined-outer-name
+    """ If the file on the server changed since the download was interrupted, the whole file is sent """
+    cache_path = str(tmp_path)
+    http_session = env_canada.get_http_session(1)
+    write_partial_download(cache_path, b'x' * 1000, validator='"an-older-version"')
+    assert_downloaded(env_canada.download_to_cache(grib_server + FILENAME, cache_path, http_session))
+    assert GribRequestHandler.requests == [200]
+
+
+def test_download_to_cache_without_validator(grib_server, tmp_path):  # pylint: disable=redefined-outer-name
+    """ A partial download without a validator can't be resumed safely, so it's downloaded again """
+    cache_path = str(tmp_path)
+    http_session = env_canada.get_http_session(1)
+    write_partial_download(cache_path, GribRequestHandler.content[:1000], validator=None)
+    assert_downloaded(env_canada.download_to_cache(grib_server + FILENAME, cache_path, http_session))
+    assert GribRequestHandler.requests == [200]
+
+
+def test_download_to_cache_completed_part(grib_server, tmp_path):  # pylint: disable=redefined-outer-name
+    """ A partial download that is complete already is used as is """
+    cache_path = str(tmp_path)
+    http_session = env_canada.get_http_session(1)
+    write_partial_download(cache_path, GribRequestHandler.content)
+    assert_downloaded(env_canada.download_to_cache(grib_server + FILENAME, cache_path, http_session))
+    assert GribRequestHandler.requests == [416]
+
+
+def test_download_to_cache_restarts(grib_server, tmp_path):  # pylint: disable=redefined-outer-name
+    """ A partial download that doesn't match the file on the server is discarded, and downloaded again """
+    cache_path = str(tmp_path)
+    http_session = env_canada.get_http_session(1)
+    write_partial_download(cache_path, GribRequestHandler.content + b'garbage')
+    assert_downloaded(env_canada.download_to_cache(grib_server + FILENAME, cache_path, http_session))
+    assert GribRequestHandler.requests == [416, 200]
+
+
+def test_prune_cache(tmp_path):
+    """ Old files are removed from the cache """
+    old_file = tmp_path / 'old.grib2'
+    old_file.write_bytes(b'old')
+    new_file = tmp_path / 'new.grib2'
+    new_file.write_bytes(b'new')
+    two_days_ago = (datetime.datetime.now() - datetime.timedelta(days=2)).timestamp()
+    os.utime(old_file, (two_days_ago, two_days_ago))
+    env_canada.prune_cache(str(tmp_path), datetime.timedelta(hours=24))
+    assert os.listdir(str(tmp_path)) == ['new.grib2']
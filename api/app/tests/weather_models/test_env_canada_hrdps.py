@@ -12,10 +12,13 @@ from alchemy_mock.compat import mock
 from pytest_mock import MockerFixture
 import app.time_utils as time_utils
 import app.db.database
-from app.weather_models import env_canada
+from app.weather_models import env_canada, process_grib
 from app.db.models import (PredictionModel, ProcessedModelRunUrl, PredictionModelRunTimestamp,
                            PredictionModelGridSubset)
-from app.tests.weather_models.test_env_canada_gdps import MockResponse
+# pylint: disable=unused-import
+from app.tests.weather_models.test_env_canada_gdps import (MockResponse, MockProcessPoolExecutor,
+                                                           mock_create_grid_subsets,
+                                                           mock_get_processed_file_urls)
 # pylint: disable=unused-argument, redefined-outer-name
 
 
@@ -68,6 +71,12 @@ def mock_session(monkeypatch):
 
     monkeypatch.setattr(app.db.database, 'get_write_session',
                         mock_get_session_hrdps)
+    monkeypatch.setattr(process_grib, 'create_grid_subsets', mock_create_grid_subsets)
+    monkeypatch.setattr(env_canada, 'get_grids_for_coordinates',
+                        lambda session, prediction_model, coordinates: {
+                            station_code: PredictionModelGridSubset(
+                                id=1, prediction_model_id=prediction_model.id, geom=from_shape(shape))
+                            for station_code in coordinates})
     monkeypatch.setattr(app.weather_models.env_canada, 'get_prediction_model_run_timestamp_records',
                         mock_get_hrdps_prediction_model_run_timestamp_records)
 
@@ -83,7 +92,7 @@ def mock_download(monkeypatch):
         with open(filename, 'rb') as file:
             content = file.read()
         return MockResponse(status_code=200, content=content)
-    monkeypatch.setattr(requests, 'get', mock_requests_get_hrdps)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get_hrdps)
 
 
 def test_get_hrdps_download_urls():
@@ -94,7 +103,7 @@ def test_get_hrdps_download_urls():
         time_utils.get_utc_now(), 0))) == total_num_of_urls
 
 
-def test_process_hrdps(mock_download, mock_session):
+def test_process_hrdps(mock_download, mock_session, mock_get_processed_file_urls):
     """ run process method to see if it runs successfully. """
     # All files, except one, are marked as already having been downloaded, so we expect one file to
     # be processed.
@@ -102,6 +111,28 @@ def test_process_hrdps(mock_download, mock_session):
     assert env_canada.process_models() == 1
 
 
+def test_process_hrdps_with_workers(monkeypatch, mock_session):
+    """ The urls of each model run are sharded across the workers, with each url going to exactly one worker,
+    and the counts of the workers are added up. """
+    sys.argv = ["argv", "HRDPS", "--workers", "2"]
+    monkeypatch.setattr(env_canada, 'ProcessPoolExecutor', MockProcessPoolExecutor)
+    monkeypatch.setattr(env_canada, 'configure_logging', lambda: None)
+    monkeypatch.setattr(env_canada, 'get_processed_file_urls', lambda session, urls: set())
+    shards = []
+
+    def mock_process_model_run_urls_in_worker(urls):
+        shards.append(urls)
+        return len(urls), len(urls), 0, urls
+    monkeypatch.setattr(env_canada, 'process_model_run_urls_in_worker', mock_process_model_run_urls_in_worker)
+
+    urls_per_model_run = 49 * len(env_canada.GRIB_LAYERS) - 1
+    assert env_canada.process_models() == 4 * urls_per_model_run
+    # 4 model runs a day, with each model run split in two.
+    assert len(shards) == 8
+    urls = [url for shard in shards for url in shard]
+    assert len(urls) == len(set(urls)) == 4 * urls_per_model_run
+
+
 def test_main_fail(mocker: MockerFixture, monkeypatch):
     """ Run the main method, check that message is sent to rocket chat, and exit code is EX_SOFTWARE """
     sys.argv = ["argv", "HRDPS"]
@@ -11,11 +11,13 @@ from alchemy_mock.mocking import UnifiedAlchemyMagicMock
 from alchemy_mock.compat import mock
 import app.time_utils as time_utils
 import app.db.database
-from app.weather_models import env_canada
+from app.weather_models import env_canada, process_grib
 from app.db.models import (PredictionModel, ProcessedModelRunUrl, PredictionModelRunTimestamp,
                            PredictionModelGridSubset)
 # pylint: disable=unused-import
 from app.tests.weather_models.test_env_canada_gdps import (MockResponse, mock_get_stations,
+                                                           mock_create_grid_subsets,
+                                                           mock_get_processed_file_urls,
                                                            mock_get_model_run_predictions_for_grid,
                                                            mock_get_actuals_left_outer_join_with_predictions)
 # pylint: disable=unused-argument, redefined-outer-name
@@ -72,6 +74,12 @@ def mock_session(monkeypatch):
 
     monkeypatch.setattr(app.db.database, 'get_write_session',
                         mock_get_session_rdps)
+    monkeypatch.setattr(process_grib, 'create_grid_subsets', mock_create_grid_subsets)
+    monkeypatch.setattr(env_canada, 'get_grids_for_coordinates',
+                        lambda session, prediction_model, coordinates: {
+                            station_code: PredictionModelGridSubset(
+                                id=1, prediction_model_id=prediction_model.id, geom=from_shape(shape))
+                            for station_code in coordinates})
     monkeypatch.setattr(env_canada, 'get_prediction_model_run_timestamp_records',
                         mock_get_rdps_prediction_model_run_timestamp_records)
 
@@ -87,7 +95,7 @@ def mock_download(monkeypatch):
         with open(filename, 'rb') as file:
             content = file.read()
         return MockResponse(status_code=200, content=content)
-    monkeypatch.setattr(requests, 'get', mock_requests_get_rdps)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get_rdps)
 
 
 @pytest.fixture()
@@ -96,7 +104,7 @@ def mock_download_fail(monkeypatch):
     def mock_requests_get(*args, **kwargs):
         """ mock env_canada download method """
         return MockResponse(status_code=400)
-    monkeypatch.setattr(requests, 'get', mock_requests_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get)
 
 
 def test_get_rdps_download_urls():
@@ -109,6 +117,7 @@ def test_get_rdps_download_urls():
 
 def test_process_rdps(mock_download,
                       mock_session,
+                      mock_get_processed_file_urls,
                       mock_get_model_run_predictions_for_grid,
                       mock_get_actuals_left_outer_join_with_predictions,
                       mock_get_stations):
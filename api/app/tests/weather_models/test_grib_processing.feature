@@ -21,6 +21,18 @@ Feature: Grib file processing
             | CMC_glb_RH_TGL_2_latlon.15x.15_2020071300_P000.grib2            | [10, 10]          | [[10, 10], [11, 10], [11, 11], [10, 11]]             | [91.99049377441406, 91.99049377441406, 92.24049377441406, 92.24049377441406]     |
             | CMC_hrdps_continental_RH_TGL_2_ps2.5km_2020100700_P007-00.grib2 | [694, 1262]       | [[694, 1262], [695, 1262], [695, 1263], [694, 1263]] | [44.272186279296875, 42.796443939208984, 44.272186279296875, 44.272186279296875] |
 
+    Scenario: Extract the surrounding grids for many raster coordinates at once
+        Given a grib file: <filename>
+        When I get the surrounding grids for <raster_coordinates>
+        Then I expect the same grids as when getting them one at a time
+
+        Examples:
+            | filename                                                        | raster_coordinates                                |
+            | CMC_glb_RH_TGL_2_latlon.15x.15_2020071300_P000.grib2            | [[10, 10], [397, 262], [422, 270], [378, 253]]    |
+            | CMC_glb_RH_TGL_2_latlon.15x.15_2020071300_P000.grib2            | [[397, 262], [397, 262], [398, 262]]              |
+            | CMC_hrdps_continental_RH_TGL_2_ps2.5km_2020100700_P007-00.grib2 | [[694, 1262], [472, 819], [572, 897], [409, 736]] |
+            | CMC_hrdps_continental_RH_TGL_2_ps2.5km_2020100700_P007-00.grib2 | []                                                |
+
 
     Scenario: Calculate raster coordinates
         Given a GDAL <geotransform> and <wkt_projection_string>
@@ -50,3 +62,14 @@ Feature: Grib file processing
             | [-180.075, 0.15000000000000002, 0.0, 90.075, 0.0, -0.15]            | CMC_glb_latlon.15x.15_projection_wkt.txt         | [370, 330]        | [-124.57499999999999, 40.575]             |
             | [-180.075, 0.15000000000000002, 0.0, 90.075, 0.0, -0.15]            | CMC_glb_latlon.15x.15_projection_wkt.txt         | [315, 455]        | [-132.825, 21.825000000000003]            |
             | [-180.075, 0.15000000000000002, 0.0, 90.075, 0.0, -0.15]            | CMC_glb_latlon.15x.15_projection_wkt.txt         | [427, 245]        | [-116.02499999999998, 53.325]             |
+
+
+    Scenario: Calculate the station raster index
+        Given a GDAL <geotransform> and <wkt_projection_string>
+        When I calculate the station raster index for <geographic_coordinates>
+        Then I expect the index to match calculating each coordinate one at a time
+
+        Examples:
+            | geotransform                                                        | wkt_projection_string                            | geographic_coordinates                                                                  |
+            | [-2099127.494496938, 2500.0, 0.0, -2099388.521499629, 0.0, -2500.0] | CMC_hrdps_continental_ps2.5km_projection_wkt.txt | [[-120.4816667, 50.6733333], [-116.7464000, 49.4358000], [-123.2732667, 52.0837700]] |
+            | [-180.075, 0.15000000000000002, 0.0, 90.075, 0.0, -0.15]            | CMC_glb_latlon.15x.15_projection_wkt.txt         | [[-120.4816667, 50.6733333], [-116.7464000, 49.4358000], [-123.2732667, 52.0837700]] |
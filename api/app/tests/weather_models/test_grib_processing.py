@@ -1,10 +1,18 @@
 """ BDD tests for grib file processing """
 import os
+import tempfile
 import logging
 import json
+from datetime import datetime, timezone
 from operator import itemgetter
+from types import SimpleNamespace
+from unittest.mock import MagicMock
 from pytest_bdd import scenario, given, then, when
 from pyproj import CRS
+import shapely.wkt
+from geoalchemy2.shape import from_shape
+from app.schemas.stations import WeatherStation, Season
+import app.db.database
 import app.weather_models.process_grib as process_grib
 
 logger = logging.getLogger(__name__)
@@ -91,6 +99,31 @@ def assert_values(grib_file, values):
     assert actual_values == expected_values
 
 
+@scenario(
+    'test_grib_processing.feature',
+    'Extract the surrounding grids for many raster coordinates at once',
+    example_converters=dict(filename=str, raster_coordinates=json.loads))
+def test_surrounding_grids():
+    """ BDD Scenario. """
+
+
+@when('I get the surrounding grids for <raster_coordinates>')
+def get_surrounding_grids(grib_file, raster_coordinates):
+    """ get grids surrounding all the given coordinates """
+    raster_band = grib_file['dataset'].GetRasterBand(1)
+    grib_file['raster_coordinates'] = raster_coordinates
+    grib_file['grids'] = process_grib.get_surrounding_grids(raster_band, raster_coordinates)
+
+
+@then('I expect the same grids as when getting them one at a time')
+def assert_same_grids(grib_file):
+    """ assert that reading the whole window gives the same result as reading scanlines """
+    raster_band = grib_file['dataset'].GetRasterBand(1)
+    expected_grids = [process_grib.get_surrounding_grid(raster_band, x, y)
+                      for x, y in grib_file['raster_coordinates']]
+    assert [(points, list(values)) for points, values in expected_grids] == grib_file['grids']
+
+
 @scenario(
     'test_grib_processing.feature',
     'Calculate raster coordinates',
@@ -150,3 +183,168 @@ def calculate_geographic_coordinate(data, raster_coordinate):
 def assert_geographic_coordinate(data, geographic_coordinate):
     """ assert that geographic_coordinate matches the expected value """
     assert list(data['geographic_coordinate']) == geographic_coordinate
+
+
+def _get_stations(geographic_coordinates):
+    """ Construct weather stations for the given coordinates """
+    return [WeatherStation(
+        code=code, name='Test', lat=latitude, long=longitude, ecodivision_name='Test',
+        core_season=Season(start_month=5, start_day=1, end_month=9, end_day=21))
+        for code, (longitude, latitude) in enumerate(geographic_coordinates)]
+
+
+@scenario(
+    'test_grib_processing.feature',
+    'Calculate the station raster index',
+    example_converters=dict(
+        geotransform=json.loads,
+        wkt_projection_string=read_file_contents,
+        geographic_coordinates=json.loads))
+def test_calculate_station_raster_index():
+    """ BDD Scenario for calculating the station raster index """
+
+
+@when('I calculate the station raster index for <geographic_coordinates>')
+def calculate_station_raster_index(data, geographic_coordinates):
+    """ calculate the index for all coordinates at once """
+    data['geographic_coordinates'] = geographic_coordinates
+    data['index'] = process_grib.build_station_raster_index(
+        'key', _get_stations(geographic_coordinates), data['wkt_projection_string'], data['geotransform'])
+
+
+@then('I expect the index to match calculating each coordinate one at a time')
+def assert_station_raster_index(data):
+    """ assert that the vectorized index matches the per coordinate calculations """
+    proj_crs = CRS.from_string(data['wkt_projection_string'])
+    geo_to_raster = process_grib.get_transformer(process_grib.GEO_CRS, proj_crs)
+    raster_to_geo = process_grib.get_transformer(proj_crs, process_grib.GEO_CRS)
+    for (longitude, latitude), raster_coordinate, geographic_points in zip(
+            data['geographic_coordinates'],
+            data['index'].raster_coordinates,
+            data['index'].geographic_points):
+        x, y = process_grib.calculate_raster_coordinate(  # pylint: disable=invalid-name
+            longitude, latitude, data['geotransform'], geo_to_raster)
+        assert raster_coordinate == [x, y]
+        points = [[x, y], [x+1, y], [x+1, y+1], [x, y+1]]
+        assert geographic_points == [
+            list(process_grib.calculate_geographic_coordinate(point, data['geotransform'], raster_to_geo))
+            for point in points]
+
+
+def test_station_raster_index_invalidation(monkeypatch, tmp_path):
+    """ A persisted index is re-used, unless the stations or the geotransform change """
+    monkeypatch.setenv('STATION_RASTER_INDEX_PATH', str(tmp_path))
+    grib_info = process_grib.ModelRunInfo()
+    grib_info.model_abbreviation = 'GDPS'
+    grib_info.projection = 'latlon.15x.15'
+    wkt = read_file_contents('CMC_glb_latlon.15x.15_projection_wkt.txt')
+    geotransform = [-180.075, 0.15000000000000002, 0.0, 90.075, 0.0, -0.15]
+    stations = _get_stations([[-120.4816667, 50.6733333]])
+
+    key = process_grib.get_station_raster_index_key(grib_info, wkt, geotransform, stations)
+    assert process_grib.load_station_raster_index(grib_info, key) is None
+    index = process_grib.build_station_raster_index(key, stations, wkt, geotransform)
+    process_grib.save_station_raster_index(grib_info, index)
+    assert process_grib.load_station_raster_index(grib_info, key).to_dict() == index.to_dict()
+    assert os.listdir(str(tmp_path)) == ['station_raster_index_GDPS_latlon.15x.15.json']
+
+    # Adding a station, or changing the geotransform, invalidates the index.
+    more_stations = _get_stations([[-120.4816667, 50.6733333], [-116.7464000, 49.4358000]])
+    new_key = process_grib.get_station_raster_index_key(grib_info, wkt, geotransform, more_stations)
+    assert process_grib.load_station_raster_index(grib_info, new_key) is None
+    new_key = process_grib.get_station_raster_index_key(
+        grib_info, wkt, [-180.0, 0.15, 0.0, 90.0, 0.0, -0.15], stations)
+    assert process_grib.load_station_raster_index(grib_info, new_key) is None
+
+
+def test_station_raster_index_default_path(monkeypatch, tmp_path):
+    """ The index is kept in the temporary directory, unless the path is set to something other than an
+    empty value """
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    grib_info = process_grib.ModelRunInfo()
+    grib_info.model_abbreviation = 'GDPS'
+    grib_info.projection = 'latlon.15x.15'
+    expected = os.path.join(str(tmp_path), 'station_raster_index_GDPS_latlon.15x.15.json')
+    monkeypatch.delenv('STATION_RASTER_INDEX_PATH', raising=False)
+    assert process_grib._get_station_raster_index_filename(grib_info) == expected  # pylint: disable=protected-access
+    monkeypatch.setenv('STATION_RASTER_INDEX_PATH', '')
+    assert process_grib._get_station_raster_index_filename(grib_info) == expected  # pylint: disable=protected-access
+
+
+def test_corrupt_station_raster_index(monkeypatch, tmp_path):
+    """ A truncated index (e.g. left behind by a crash) is treated as missing """
+    monkeypatch.setenv('STATION_RASTER_INDEX_PATH', str(tmp_path))
+    grib_info = process_grib.ModelRunInfo()
+    grib_info.model_abbreviation = 'GDPS'
+    grib_info.projection = 'latlon.15x.15'
+    (tmp_path / 'station_raster_index_GDPS_latlon.15x.15.json').write_text('{"key": "abc", "raster_coo')
+    assert process_grib.load_station_raster_index(grib_info, 'abc') is None
+
+
+def test_store_bounding_values_with_grid_subset_registry(monkeypatch):
+    """ Grid subsets are loaded once, missing grid subsets are created in one batch, stations sharing a
+    grid subset result in a single row, and all rows of a file are written in one go """
+    monkeypatch.setattr(process_grib, 'get_stations_synchronously', lambda: [])
+    monkeypatch.setattr(process_grib, '_grid_subset_registries', {})
+    session = MagicMock()
+    monkeypatch.setattr(app.db.database, 'get_write_session', lambda: session)
+    calls = []
+
+    def mock_get_grid_subsets(_, prediction_model_id):
+        calls.append('get')
+        geom = from_shape(shapely.wkt.loads('POLYGON((1 1, 2 1, 2 2, 1 2, 1 1))'))
+        return [SimpleNamespace(id=10, prediction_model_id=prediction_model_id, geom=geom)]
+
+    def mock_create_grid_subsets(_, __, geoms):
+        calls.append(geoms)
+        return [(11, from_shape(shapely.wkt.loads(geom))) for geom in geoms]
+    monkeypatch.setattr(process_grib, 'get_grid_subsets', mock_get_grid_subsets)
+    monkeypatch.setattr(process_grib, 'create_grid_subsets', mock_create_grid_subsets)
+    upserts = []
+    monkeypatch.setattr(process_grib, 'upsert_model_run_grid_subset_predictions',
+                        lambda *args: upserts.append(args))
+
+    grib_info = process_grib.ModelRunInfo()
+    grib_info.prediction_timestamp = datetime(2020, 7, 13, 0, tzinfo=timezone.utc)
+    grib_info.variable_name = 'TMP_TGL_2'
+    processor = process_grib.GribFileProcessor()
+    processor.prediction_model = SimpleNamespace(id=1)
+    processor.station_raster_index = process_grib.StationRasterIndex(
+        'key', [[1, 1], [1, 1], [3, 1]],
+        [[[1, 1], [2, 1], [2, 2], [1, 2]],
+         [[1, 1], [2, 1], [2, 2], [1, 2]],
+         [[3, 1], [4, 1], [4, 2], [3, 2]]])
+    data_for_stations = [
+        (None, [1.0, 2.0, 3.0, 4.0], None),
+        (None, [1.0, 2.0, 3.0, 4.0], None),
+        (None, [5.0, 6.0, 7.0, 8.0], None)]
+    processor.store_bounding_values(data_for_stations, SimpleNamespace(id=42), grib_info)
+    processor.store_bounding_values(data_for_stations, SimpleNamespace(id=42), grib_info)
+
+    # Only the first file results in grid subsets being loaded, and created.
+    assert calls == ['get', ['POLYGON((3 1, 4 1, 4 2, 3 2, 3 1))']]
+    expected = (session, 42, grib_info.prediction_timestamp, 'TMP_TGL_2',
+                {10: [1.0, 2.0, 3.0, 4.0], 11: [5.0, 6.0, 7.0, 8.0]})
+    assert upserts == [expected, expected]
+
+
+def test_grid_subsets_created_by_another_process(monkeypatch):
+    """ Grid subsets that another process created in the meantime are used with their existing id, without
+    reloading all the grid subsets """
+    calls = []
+    monkeypatch.setattr(process_grib, 'get_grid_subsets', lambda *args: calls.append('get') or [])
+
+    def mock_create_grid_subsets(_, __, geoms):
+        calls.append(geoms)
+        # The first grid subset already existed, the second one is new.
+        return [(grid_subset_id, from_shape(shapely.wkt.loads(geom)))
+                for grid_subset_id, geom in zip((7, 12), geoms)]
+    monkeypatch.setattr(process_grib, 'create_grid_subsets', mock_create_grid_subsets)
+
+    registry = process_grib.GridSubsetRegistry(1)
+    station_raster_index = process_grib.StationRasterIndex(
+        'key', [[1, 1], [3, 1]],
+        [[[1, 1], [2, 1], [2, 2], [1, 2]],
+         [[3, 1], [4, 1], [4, 2], [3, 2]]])
+    assert registry.get_grid_subset_ids(MagicMock(), station_raster_index) == [7, 12]
+    assert calls == ['get', ['POLYGON((1 1, 2 1, 2 2, 1 2, 1 1))', 'POLYGON((3 1, 4 1, 4 2, 3 2, 3 1))']]
@@ -0,0 +1,54 @@
+""" Unit tests for interpolating noon predictions """
+from datetime import datetime, timezone
+import pytest
+from scipy.interpolate import interp1d
+from app.db.models import ModelRunGridSubsetPrediction
+from app.weather_models import construct_interpolated_noon_predictions, interpolate_bearing
+
+
+def _prediction(hour: int, day: int, offset: float, **kwargs) -> ModelRunGridSubsetPrediction:
+    """ Construct a prediction with some values """
+    values = dict(tmp_tgl_2=[1 + offset, 2, 3, 4 - offset],
+                  rh_tgl_2=[50, 60 + offset, 70, 80],
+                  apcp_sfc_0=[0, 1, 2 + offset, 3],
+                  wind_tgl_10=[5, 6, 7, 8 + offset],
+                  wdir_tgl_10=[10 + offset, 350, 180, 90])
+    values.update(kwargs)
+    return ModelRunGridSubsetPrediction(
+        prediction_timestamp=datetime(2020, 10, day, hour, tzinfo=timezone.utc), **values)
+
+
+def test_construct_interpolated_noon_predictions():
+    """ The noon predictions of many pairs of predictions, interpolated in one go, are the same as those
+    interpolated one value at a time """
+    pairs = [(_prediction(18, 10, 0), _prediction(21, 10, 3.5)),
+             (_prediction(18, 11, -2, rh_tgl_2=None),
+              _prediction(21, 11, 7, wdir_tgl_10=[200, 10, 90, 91]))]
+    noon_predictions = construct_interpolated_noon_predictions(pairs)
+
+    assert len(noon_predictions) == 2
+    for (prediction_a, prediction_b), noon_prediction in zip(pairs, noon_predictions):
+        timestamps = (prediction_a.prediction_timestamp.timestamp(),
+                      prediction_b.prediction_timestamp.timestamp())
+        assert noon_prediction.prediction_timestamp == prediction_a.prediction_timestamp.replace(hour=20)
+        noon_timestamp = noon_prediction.prediction_timestamp.timestamp()
+        for key in ('tmp_tgl_2', 'rh_tgl_2', 'apcp_sfc_0', 'wind_tgl_10'):
+            if getattr(prediction_a, key) is None:
+                assert getattr(noon_prediction, key) is None
+                continue
+            function = interp1d(timestamps, [getattr(prediction_a, key), getattr(prediction_b, key)],
+                                axis=0, kind='linear')
+            assert list(getattr(noon_prediction, key)) == pytest.approx(list(function(noon_timestamp)))
+        expected_wdir = [interpolate_bearing(prediction_a.prediction_timestamp,
+                                             prediction_b.prediction_timestamp,
+                                             noon_prediction.prediction_timestamp, direction_a, direction_b)
+                         for direction_a, direction_b in zip(prediction_a.wdir_tgl_10,
+                                                             prediction_b.wdir_tgl_10)]
+        assert list(noon_prediction.wdir_tgl_10) == pytest.approx(expected_wdir)
+        assert list(noon_prediction.delta_precip) == pytest.approx(
+            [noon - value for noon, value in zip(noon_prediction.apcp_sfc_0, prediction_a.apcp_sfc_0)])
+
+
+def test_construct_interpolated_noon_predictions_without_pairs():
+    """ There's nothing to interpolate """
+    assert not construct_interpolated_noon_predictions([])
@@ -0,0 +1,53 @@
+""" Unit tests for copying weather station model predictions to the latest station model predictions """
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy.dialects import postgresql
+from app.db.models import PredictionModelRunTimestamp
+from app.db.crud.weather_models import upsert_latest_station_model_predictions
+
+# The delta precipitation of the previous model run, of the same model, station and prediction timestamp.
+PREVIOUS_DELTA_PRECIP = """(SELECT weather_station_model_predictions_1.delta_precip \
+FROM weather_station_model_predictions AS weather_station_model_predictions_1, \
+prediction_model_run_timestamps AS prediction_model_run_timestamps_1 \
+WHERE weather_station_model_predictions_1.prediction_model_run_timestamp_id = \
+prediction_model_run_timestamps_1.id \
+AND prediction_model_run_timestamps_1.prediction_model_id = {table}.prediction_model_id \
+AND prediction_model_run_timestamps_1.prediction_run_timestamp < {table}.prediction_run_timestamp \
+AND weather_station_model_predictions_1.station_code = {predictions}.station_code \
+AND weather_station_model_predictions_1.prediction_timestamp = {predictions}.prediction_timestamp \
+ORDER BY prediction_model_run_timestamps_1.prediction_run_timestamp DESC LIMIT %(param_1)s)"""
+
+
+def compile_statements(prediction_run: PredictionModelRunTimestamp):
+    """ Compile the statements that copy the predictions of the model run, returning the sql (on a single
+    line) and parameters of each """
+    statements = []
+    upsert_latest_station_model_predictions(
+        SimpleNamespace(execute=statements.append), prediction_run, datetime(2020, 10, 10, 20))
+    compiled = [statement.compile(dialect=postgresql.dialect()) for statement in statements]
+    return [(' '.join(str(statement).split()), statement.params) for statement in compiled]
+
+
+def test_previous_delta_precip_of_out_of_order_model_run():
+    """ The previous delta precipitation is looked up in the previous model run, rather than taken from the
+    latest prediction being replaced. As a model run that arrives out of order may precede more recent model
+    runs, their latest predictions have it looked up again. """
+    prediction_run = PredictionModelRunTimestamp(
+        id=3, prediction_model_id=1, prediction_run_timestamp=datetime(2020, 10, 10, 6))
+    (upsert, _), (update, update_params) = compile_statements(prediction_run)
+
+    assert PREVIOUS_DELTA_PRECIP.format(table='prediction_model_run_timestamps',
+                                        predictions='weather_station_model_predictions') in upsert
+    assert 'prev_delta_precip = excluded.prev_delta_precip' in upsert
+    assert 'latest_station_model_predictions.delta_precip' not in upsert
+
+    assert update.startswith('UPDATE latest_station_model_predictions SET prev_delta_precip={}'.format(
+        PREVIOUS_DELTA_PRECIP.format(table='latest_station_model_predictions',
+                                     predictions='latest_station_model_predictions')))
+    assert update.endswith(
+        'WHERE latest_station_model_predictions.prediction_model_id = %(prediction_model_id_1)s '
+        'AND latest_station_model_predictions.prediction_run_timestamp > %(prediction_run_timestamp_1)s '
+        'AND latest_station_model_predictions.prediction_timestamp >= %(prediction_timestamp_1)s')
+    assert update_params == {'param_1': 1, 'prediction_model_id_1': 1,
+                             'prediction_run_timestamp_1': datetime(2020, 10, 10, 6),
+                             'prediction_timestamp_1': datetime(2020, 10, 10, 6)}
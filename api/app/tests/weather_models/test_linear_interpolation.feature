@@ -0,0 +1,16 @@
+Feature: Linear interpolation
+
+    Scenario: Interpolate using precalculated weights
+        Given grid <points> with <values>
+        When I interpolate to <coordinate> using the interpolation weights
+        Then I get the same result as griddata
+        Examples:
+            | points                                                                                                                 | values                                                                     | coordinate                     |
+            # GDPS grid, around Kamloops:
+            | [[-120.525, 50.775], [-120.375, 50.775], [-120.375, 50.625], [-120.525, 50.625]]                                       | [[12.5, 13.1, 14.2, 11.9], [80.1, 75.2, 70.3, 85.4], [0.0, 1.2, 3.4, 0.5]] | [-120.4816667, 50.6733333]     |
+            # Polar stereographic (RDPS/HRDPS) grids aren't rectangular in lat/long:
+            | [[-116.7531, 49.4484], [-116.6306, 49.4288], [-116.6605, 49.3498], [-116.7829, 49.3694]]                               | [[-1.5, 2.25, 0.0, 3.5], [50.0, 60.0, 55.5, 45.0], [1.0, 1.0, 1.0, 1.0]]  | [-116.7464, 49.4358]           |
+            # Coordinate on a vertex:
+            | [[0.0, 1.0], [1.0, 1.0], [1.0, 0.0], [0.0, 0.0]]                                                                       | [[1.0, 2.0, 3.0, 4.0], [5.0, 6.0, 7.0, 8.0], [9.0, 10.0, 11.0, 12.0]]     | [1.0, 1.0]                     |
+            # Coordinate outside of the grid:
+            | [[0.0, 1.0], [1.0, 1.0], [1.0, 0.0], [0.0, 0.0]]                                                                       | [[1.0, 2.0, 3.0, 4.0], [5.0, 6.0, 7.0, 8.0], [9.0, 10.0, 11.0, 12.0]]     | [2.0, 2.0]                     |
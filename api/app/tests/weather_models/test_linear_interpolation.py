@@ -0,0 +1,37 @@
+""" BDD tests for linear interpolation using precalculated weights """
+import json
+import numpy
+from scipy.interpolate import griddata
+from pytest_bdd import scenario, given, when, then
+from app.db.models import ModelRunGridSubsetPrediction
+from app.weather_models import get_linear_interpolation_weights, interpolate_predictions
+
+
+@scenario('test_linear_interpolation.feature', 'Interpolate using precalculated weights',
+          example_converters=dict(points=json.loads, values=json.loads, coordinate=json.loads))
+def test_linear_interpolation():
+    """ BDD Scenario. """
+
+
+@given('grid <points> with <values>', target_fixture='data')
+def given_grid(points, values):
+    """ Construct predictions with values for tmp_tgl_2, rh_tgl_2 and apcp_sfc_0 """
+    prediction = ModelRunGridSubsetPrediction(tmp_tgl_2=values[0], rh_tgl_2=values[1], apcp_sfc_0=values[2])
+    return dict(points=points, values=values, predictions=[prediction, prediction])
+
+
+@when('I interpolate to <coordinate> using the interpolation weights')
+def when_interpolate(data, coordinate):
+    """ Interpolate """
+    data['coordinate'] = coordinate
+    weights = get_linear_interpolation_weights(data['points'], coordinate)
+    data['result'] = interpolate_predictions(data['predictions'], weights)
+
+
+@then('I get the same result as griddata')
+def then_same_as_griddata(data):
+    """ Compare with griddata """
+    expected = [griddata(data['points'], values, data['coordinate'], method='linear')[0]
+                for values in data['values']]
+    for result in data['result']:
+        numpy.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-12)
@@ -1,14 +1,17 @@
 """ Test machine learning code - collecting data, learning from data, and predicting a bias adjusted
 result.
 """
-from datetime import datetime
+from datetime import date, datetime, time, timezone
 from typing import List
 import json
+import numpy as np
 import pytest
+from sklearn.linear_model import LinearRegression
 from pytest_bdd import scenario, given, then, when
-from app.db.models import PredictionModel, PredictionModelGridSubset
-from app.weather_models import machine_learning
+from app.db.models import PredictionModel, PredictionModelGridSubset, StationRegressionSampleSums
+from app.weather_models import machine_learning, MODEL_VALUE_KEYS, VERTEX_COUNT
 from app.tests.weather_models.crud import get_actuals_left_outer_join_with_predictions
+from app.tests.weather_models.test_time_series import time_series_from_predictions
 
 
 @pytest.fixture()
@@ -18,7 +21,18 @@ def mock_get_actuals_left_outer_join_with_predictions(monkeypatch):
                         get_actuals_left_outer_join_with_predictions)
 
 
-@pytest.mark.usefixtures('mock_get_actuals_left_outer_join_with_predictions')
+@pytest.fixture()
+def mock_station_regression_sample_sums(monkeypatch):
+    """ Mock out storing and loading of regression sample sums, returning the stored sums """
+    stored = []
+    monkeypatch.setattr(machine_learning, 'get_station_regression_sample_sums', lambda *args: [])
+    monkeypatch.setattr(machine_learning, 'upsert_station_regression_sample_sums',
+                        lambda session, sample_sums: stored.extend(sample_sums))
+    return stored
+
+
+@pytest.mark.usefixtures('mock_get_actuals_left_outer_join_with_predictions',
+                         'mock_station_regression_sample_sums')
 @scenario("test_machine_learning.feature", "Learn weather",
           example_converters=dict(coordinate=json.loads,
                                   points=json.loads,
@@ -66,3 +80,142 @@ def assert_rh(instance: machine_learning.StationMachineLearning,
     """ Assert that the ML algorithm predicts the relative humidity correctly """
     result = instance.predict_rh(model_rh, timestamp)
     assert result == bias_adjusted_rh
+
+
+def test_learn_from_stored_sample_sums(monkeypatch, mock_get_actuals_left_outer_join_with_predictions,
+                                       mock_station_regression_sample_sums):
+    """ The sums of samples for days that have settled are stored, and learning from the stored sums gives
+    the same result as learning from the samples. """
+    # pylint: disable=unused-argument, redefined-outer-name
+    coordinate = [-120.4816667, 50.6733333]
+    points = [[-120.525, 50.775], [-120.375, 50.775], [-120.375, 50.625], [-120.525, 50.625]]
+    max_learn_date = datetime(2020, 10, 20, tzinfo=timezone.utc)
+
+    def learn():
+        instance = machine_learning.StationMachineLearning(
+            session=None, model=PredictionModel(id=1), grid=PredictionModelGridSubset(id=1), points=points,
+            target_coordinate=coordinate, station_code=123, max_learn_date=max_learn_date)
+        instance.learn()
+        timestamp = datetime(2020, 10, 19, 20, tzinfo=timezone.utc)
+        return instance.predict_temperature(2.5, timestamp), instance.predict_rh(25, timestamp)
+
+    expected = learn()
+    assert None not in expected
+    # 2 days, with 3 hours a day (including the interpolated noon sample), for temperature and rh.
+    assert len(mock_station_regression_sample_sums) == 12
+    stored_sums = [StationRegressionSampleSums(**record) for record in mock_station_regression_sample_sums]
+    collected_from = []
+
+    def mock_get_actuals(*args):
+        # The start date is the 5th argument.
+        collected_from.append(args[4])
+        return []
+    monkeypatch.setattr(machine_learning, 'get_station_regression_sample_sums', lambda *args: stored_sums)
+    monkeypatch.setattr(machine_learning, 'get_actuals_left_outer_join_with_predictions', mock_get_actuals)
+
+    assert learn() == pytest.approx(expected)
+    # Only the first day of the window (which is never stored), and the days after the last stored day, are
+    # collected.
+    assert collected_from == [datetime(2020, 10, 1, tzinfo=timezone.utc),
+                              datetime(2020, 10, 12, tzinfo=timezone.utc)]
+
+
+def test_learning_window_starts_at_exact_time(monkeypatch, mock_station_regression_sample_sums):
+    """ Samples are collected from exactly max_days_to_learn before the max learn date (not from the start
+    of that day), and the sums of the partly collected first day aren't stored """
+    # pylint: disable=redefined-outer-name
+    max_learn_date = datetime(2020, 10, 20, 19, tzinfo=timezone.utc)
+    windows = []
+    collected = []
+
+    def mock_get_actuals(*args):
+        start_date, end_date = args[4], args[5]
+        windows.append((start_date, end_date))
+        result = [(actual, prediction) for actual, prediction in get_actuals_left_outer_join_with_predictions(
+            *args) if start_date <= actual.weather_date.replace(tzinfo=timezone.utc) <= end_date]
+        collected.extend(actual.weather_date for actual, _ in result)
+        return result
+    monkeypatch.setattr(machine_learning, 'get_actuals_left_outer_join_with_predictions', mock_get_actuals)
+    instance = machine_learning.StationMachineLearning(
+        session=None, model=PredictionModel(id=1), grid=PredictionModelGridSubset(id=1),
+        points=[[-120.525, 50.775], [-120.375, 50.775], [-120.375, 50.625], [-120.525, 50.625]],
+        target_coordinate=[-120.4816667, 50.6733333], station_code=123, max_learn_date=max_learn_date)
+    instance.max_days_to_learn = 10
+    instance.learn()
+    # The window starts at 2020-10-10 19:00, so the 18:00 sample of the 10th isn't learnt from.
+    assert windows == [(datetime(2020, 10, 10, 19, tzinfo=timezone.utc), max_learn_date)]
+    assert datetime(2020, 10, 10, 18) not in collected
+    assert datetime(2020, 10, 10, 21) in collected
+    assert {record['sample_date'] for record in mock_station_regression_sample_sums} == {date(2020, 10, 11)}
+
+
+def test_learn_from_time_series(monkeypatch, mock_get_actuals_left_outer_join_with_predictions,
+                                mock_station_regression_sample_sums):
+    """ Learning from predictions stored as time series gives the same result as learning from predictions
+    stored as a row per prediction timestamp. """
+    # pylint: disable=unused-argument, redefined-outer-name
+    coordinate = [-120.4816667, 50.6733333]
+    points = [[-120.525, 50.775], [-120.375, 50.775], [-120.375, 50.625], [-120.525, 50.625]]
+
+    def learn():
+        instance = machine_learning.StationMachineLearning(
+            session=None, model=PredictionModel(id=1), grid=PredictionModelGridSubset(id=1), points=points,
+            target_coordinate=coordinate, station_code=123, max_learn_date=datetime(2020, 10, 20))
+        instance.learn()
+        timestamp = datetime(2020, 10, 19, 20, tzinfo=timezone.utc)
+        return instance.predict_temperature(2.5, timestamp), instance.predict_rh(25, timestamp)
+
+    expected = learn()
+    assert None not in expected
+
+    # Store the predictions of each day in the time series of a model run for that day.
+    actuals_with_predictions = get_actuals_left_outer_join_with_predictions()
+    predictions = [prediction for _, prediction in actuals_with_predictions if prediction is not None]
+    model_runs = sorted({datetime.combine(prediction.prediction_timestamp.date(), time())
+                         for prediction in predictions}, reverse=True)
+    time_series = [(model_run, time_series_from_predictions(
+        model_run, [prediction for prediction in predictions
+                    if prediction.prediction_timestamp.date() == model_run.date()]))
+        for model_run in model_runs]
+
+    def mock_get_actuals_with_time_series_predictions(*args):
+        """ Same as the query: the slices of the most recent model run with values for each actual """
+        for actual, _ in actuals_with_predictions:
+            for model_run, model_run_time_series in time_series:
+                start = int((actual.weather_date - model_run).total_seconds() // 3600) * VERTEX_COUNT
+                slices = [(getattr(model_run_time_series, key) or [])[start:start + VERTEX_COUNT]
+                          for key in MODEL_VALUE_KEYS]
+                if 0 <= start and any(value is not None for values in slices for value in values):
+                    yield (actual, model_run, *slices)
+                    break
+            else:
+                yield (actual, None) + (None,) * len(MODEL_VALUE_KEYS)
+    monkeypatch.setenv('GRID_SUBSET_TIME_SERIES_STORAGE', 'True')
+    monkeypatch.setattr(machine_learning, 'get_actuals_left_outer_join_with_predictions', None)
+    monkeypatch.setattr(machine_learning, 'get_actuals_with_time_series_predictions',
+                        mock_get_actuals_with_time_series_predictions)
+
+    assert learn() == pytest.approx(expected)
+
+
+def test_hourly_linear_regression_matches_sklearn():
+    """ The regressions of all hours, calculated in one go from the sums of the samples, give the same
+    results as fitting a LinearRegression for each hour. """
+    random = np.random.default_rng(42)
+    samples = {hour: (random.uniform(-10, 30, 20), random.uniform(-10, 30, 20)) for hour in range(0, 24, 3)}
+    # The model values of an hour can be constant.
+    samples[21] = (np.full(5, 12.3), random.uniform(-10, 30, 5))
+    regression = machine_learning.HourlyLinearRegression()
+    regression.fit({hour: machine_learning.SampleSums.from_samples(x_values, y_values)
+                    for hour, (x_values, y_values) in samples.items()})
+
+    values = random.uniform(-10, 30, 48)
+    hours = np.arange(48) % 24
+    result = regression.predict(values, hours)
+    for value, hour, predicted in zip(values, hours, result):
+        if hour in samples:
+            x_values, y_values = samples[hour]
+            model = LinearRegression().fit(x_values.reshape((-1, 1)), y_values)
+            assert predicted == pytest.approx(model.predict([[value]])[0], rel=1e-9)
+        else:
+            assert np.isnan(predicted)
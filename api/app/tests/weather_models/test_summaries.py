@@ -0,0 +1,48 @@
+""" Unit tests for weather model prediction summaries """
+from datetime import datetime
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from app.schemas.stations import WeatherStation, Season
+from app.db.models import PredictionModel
+from app.db.crud.weather_models import get_station_model_prediction_summaries
+from app.weather_models import ModelEnum
+from app.weather_models.fetch import summaries
+
+
+def test_percentiles_of_each_variable():
+    """ The percentiles of each variable are aggregated separately, and rows with missing values aren't
+    filtered out, so that a variable with missing values (which percentile_cont ignores) doesn't affect
+    the percentiles of the others """
+    query = get_station_model_prediction_summaries(
+        Session(), [322], ModelEnum.GDPS, datetime(2020, 10, 10), datetime(2020, 10, 15))
+    sql = str(query.statement.compile(dialect=postgresql.dialect()))
+    for key in ('tmp_tgl_2', 'rh_tgl_2'):
+        for suffix in ('5th', 'median', '90th'):
+            assert (') WITHIN GROUP (ORDER BY weather_station_model_predictions.{key}) '
+                    'AS {key}_{suffix}').format(key=key, suffix=suffix) in sql
+    assert 'NULL' not in sql
+
+
+def test_summaries_with_missing_variables(monkeypatch):
+    """ The percentiles of a variable without values at a timestamp are None, while those of the other
+    variable are kept. Timestamps without any values are skipped. """
+    prediction_model = PredictionModel(name='Global Deterministic Prediction System', abbreviation='GDPS')
+    rows = [
+        (prediction_model, 322, datetime(2020, 10, 10, 18), 1.5, 2.0, 3.5, None, None, None),
+        (prediction_model, 322, datetime(2020, 10, 10, 21), None, None, None, None, None, None),
+        (prediction_model, 322, datetime(2020, 10, 11, 0), None, None, None, 20.0, 30.0, 40.0),
+        (prediction_model, 322, datetime(2020, 10, 11, 3), 0.0, 1.0, 2.0, 0.0, 50.0, 60.0)]
+    monkeypatch.setattr(summaries, '_build_query_to_get_summaries',
+                        lambda station_codes, model, time_of_interest: rows)
+    builder = summaries.ModelPredictionSummaryBuilder()
+    builder.stations = {322: WeatherStation(
+        code=322, name='AFTON', lat=50.6733333, long=-120.4816667,
+        core_season=Season(start_month=5, start_day=1, end_month=9, end_day=21))}
+
+    summary = builder.build_summaries(ModelEnum.GDPS, [322], datetime(2020, 10, 11, 3))[322]
+    assert [(value.datetime, value.tmp_tgl_2_5th, value.tmp_tgl_2_median, value.tmp_tgl_2_90th,
+             value.rh_tgl_2_5th, value.rh_tgl_2_median, value.rh_tgl_2_90th)
+            for value in summary.values] == [
+                (datetime(2020, 10, 10, 18), 1.5, 2.0, 3.5, None, None, None),
+                (datetime(2020, 10, 11, 0), None, None, None, 20.0, 30.0, 40.0),
+                (datetime(2020, 10, 11, 3), 0.0, 1.0, 2.0, 0.0, 50.0, 60.0)]
@@ -0,0 +1,123 @@
+""" Unit tests for storing grid subset predictions as a time series """
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import List
+import numpy
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from app.db.models import ModelRunGridSubsetPrediction, ModelRunGridSubsetTimeSeries
+from app.db.crud.weather_models import upsert_model_run_grid_subset_time_series
+from app.db.crud.observations import get_actuals_with_time_series_predictions
+from app.weather_models import (MODEL_VALUE_KEYS, VERTEX_COUNT, encode_time_series_values, decode_time_series,
+                                time_series_to_predictions)
+
+
+def set_time_series_values(time_series: List[float],
+                           prediction_hour: int,
+                           values: List[float]) -> List[float]:
+    """ Same as the set_time_series_values database function (see the model_run_grid_subset_time_series
+    migration) """
+    start = prediction_hour * VERTEX_COUNT
+    time_series = list(time_series or [])
+    time_series += [None] * (start + len(values) - len(time_series))
+    time_series[start:start + len(values)] = values
+    return time_series
+
+
+def time_series_from_predictions(prediction_run_timestamp: datetime,
+                                 predictions: List[ModelRunGridSubsetPrediction],
+                                 **kwargs) -> ModelRunGridSubsetTimeSeries:
+    """ Store the values of the predictions in a time series, one prediction at a time (as when they're
+    processed) """
+    time_series = ModelRunGridSubsetTimeSeries(**kwargs)
+    for prediction in predictions:
+        prediction_hour = int(
+            (prediction.prediction_timestamp - prediction_run_timestamp).total_seconds() // 3600)
+        for key in MODEL_VALUE_KEYS:
+            values = getattr(prediction, key)
+            if values is not None:
+                setattr(time_series, key, set_time_series_values(
+                    getattr(time_series, key), prediction_hour, values))
+    return time_series
+
+
+def test_decode_time_series():
+    """ The values of each prediction hour are decoded into a row, with nan for missing values """
+    values = set_time_series_values(encode_time_series_values(3, [1, 2, 3, 4]), 1, [5, 6, 7, 8])
+    decoded = decode_time_series(values, 6)
+    assert decoded.shape == (6, 4)
+    assert decoded[1].tolist() == [5, 6, 7, 8]
+    assert decoded[3].tolist() == [1, 2, 3, 4]
+    assert numpy.isnan(decoded[[0, 2, 4, 5]]).all()
+    assert decode_time_series(None).shape == (0, 4)
+
+
+def test_time_series_to_predictions():
+    """ Predictions stored as a time series, in any order, are decoded into the same predictions """
+    prediction_run_timestamp = datetime(2020, 10, 10, 12, tzinfo=timezone.utc)
+    predictions = [
+        ModelRunGridSubsetPrediction(
+            prediction_timestamp=prediction_run_timestamp + timedelta(hours=hour),
+            tmp_tgl_2=[hour, 2, 3, 4],
+            rh_tgl_2=[50, 60, hour, 80],
+            apcp_sfc_0=None if hour == 0 else [0, hour, 2, 3],
+            wind_tgl_10=[5, 6, 7, 8],
+            wdir_tgl_10=[10, 350, 180, hour])
+        for hour in range(0, 13, 3)]
+    time_series = time_series_from_predictions(
+        prediction_run_timestamp, reversed(predictions),
+        prediction_model_run_timestamp_id=1, prediction_model_grid_subset_id=2)
+
+    decoded = time_series_to_predictions(prediction_run_timestamp, time_series)
+    assert len(decoded) == len(predictions)
+    for prediction, decoded_prediction in zip(predictions, decoded):
+        assert decoded_prediction.prediction_timestamp == prediction.prediction_timestamp
+        assert decoded_prediction.prediction_model_run_timestamp_id == 1
+        assert decoded_prediction.prediction_model_grid_subset_id == 2
+        for key in MODEL_VALUE_KEYS:
+            if getattr(prediction, key) is None:
+                assert getattr(decoded_prediction, key) is None
+            else:
+                assert getattr(decoded_prediction, key).tolist() == getattr(prediction, key)
+
+    until = prediction_run_timestamp + timedelta(hours=6)
+    assert [prediction.prediction_timestamp for prediction in time_series_to_predictions(
+        prediction_run_timestamp, time_series, until)] == [
+            prediction.prediction_timestamp for prediction in predictions[:3]]
+    assert [prediction.prediction_timestamp for prediction in time_series_to_predictions(
+        prediction_run_timestamp, time_series, since=until)] == [
+            prediction.prediction_timestamp for prediction in predictions[2:]]
+
+
+def test_upsert_time_series_sets_slice():
+    """ Only the values of the prediction hour, and their position, are sent. Existing time series only have
+    the slice of the prediction hour assigned, and rows are written in order of grid subset id """
+    statements = []
+    session = SimpleNamespace(execute=statements.append)
+    upsert_model_run_grid_subset_time_series(
+        session, 1, 2, 'TMP_TGL_2', {11: [5, 6, 7, 8], 10: [1, 2, 3, 4]}, datetime(2020, 10, 10))
+    compiled = statements[0].compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+    assert 'set_time_series_values(CAST(NULL AS REAL[]), %(set_time_series_values_1)s, ' \
+        '%(param_1)s::REAL[])' in sql
+    assert 'set_time_series_values(model_run_grid_subset_time_series.tmp_tgl_2' in sql
+    assert 'excluded.tmp_tgl_2[%(tmp_tgl_2_1)s:%(tmp_tgl_2_2)s]' in sql
+    # Arrays are 1 based, the 3rd prediction hour is at positions 9 to 12.
+    assert [compiled.params['set_time_series_values_1'], compiled.params['tmp_tgl_2_1'],
+            compiled.params['tmp_tgl_2_2']] == [9, 9, 12]
+    assert compiled.params['prediction_model_grid_subset_id_m0'] == 10
+    assert compiled.params['param_1'] == [1, 2, 3, 4]
+    assert compiled.params['param_2'] == [5, 6, 7, 8]
+    assert all(len(value) == 4 for value in compiled.params.values() if isinstance(value, list))
+
+
+def test_actuals_with_time_series_predictions_reads_slices():
+    """ Only the slice of the time series for the weather date of each actual is read """
+    query = get_actuals_with_time_series_predictions(
+        Session(), 1, 322, datetime(2020, 10, 1), datetime(2020, 10, 20))
+    sql = str(query.statement.compile(dialect=postgresql.dialect()))
+    select_clause = sql[:sql.index('\nFROM ')]
+    for key in MODEL_VALUE_KEYS:
+        assert 'model_run_grid_subset_time_series.{}['.format(key) in select_clause
+        assert 'model_run_grid_subset_time_series.{},'.format(key) not in select_clause
+    assert 'DISTINCT ON (hourly_actuals.station_code, hourly_actuals.weather_date)' in sql
@@ -1,11 +1,13 @@
 """ Code common to app.weather_models.fetch """
 import math
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
-from typing import List
+from typing import List, Tuple
 import logging
-from scipy.interpolate import interp1d
-from app.db.models import ModelRunGridSubsetPrediction
+import numpy
+from scipy.spatial import Delaunay  # pylint: disable=no-name-in-module
+from app import config
+from app.db.models import ModelRunGridSubsetPrediction, ModelRunGridSubsetTimeSeries
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +16,18 @@ logger = logging.getLogger(__name__)
 # Wind direction (wdir_tgl_10_b) is handled slightly differently, so not included here.
 SCALAR_MODEL_VALUE_KEYS = ('tmp_tgl_2', 'rh_tgl_2', 'apcp_sfc_0', 'wind_tgl_10')
 
+# Key values on ModelRunGridSubsetPrediction that are linearly interpolated to the station coordinate.
+LINEAR_INTERPOLATION_KEYS = ('tmp_tgl_2', 'rh_tgl_2', 'apcp_sfc_0')
+
+# All the key values on ModelRunGridSubsetPrediction (and ModelRunGridSubsetTimeSeries).
+MODEL_VALUE_KEYS = SCALAR_MODEL_VALUE_KEYS + ('wdir_tgl_10',)
+
+# Number of vertices of a grid subset, i.e. number of values of each prediction.
+VERTEX_COUNT = 4
+
+# The furthest ahead a model run predicts (the GDPS predicts 240 hours ahead).
+MAX_PREDICTION_HOURS = 240
+
 
 class ModelEnum(str, Enum):
     """ Enumerator for different kinds of supported weather models """
@@ -31,31 +45,45 @@ class ProjectionEnum(str, Enum):
     REGIONAL_PS = 'ps10km'
 
 
-def interpolate_between_two_points(  # pylint: disable=invalid-name
-        x1: int, x2: int, y1: List[float], y2: List[float], xn: int):
-    """ Interpolate values between two points in time.
-    :param x1: X coordinate of the 1st value.
-    :param x2: X coordinate of the 2nd value.
-    :param y1: List of values at the 1st timestamp.
-    :param y2: List of values at the 2nd timestamp.
-    :param xn: The c coordinate we want values for.
+def interpolate_values(time_a: numpy.ndarray, time_b: numpy.ndarray,
+                       values_a: numpy.ndarray, values_b: numpy.ndarray,
+                       target_time: numpy.ndarray) -> numpy.ndarray:
+    """ Linearly interpolate arrays of values between two points in time.
+
+    :param time_a: Time (as a timestamp) of the 1st values, either a single value, or a column vector with a
+    time for each row of values.
+    :param time_b: Time of the 2nd values.
+    :param values_a: Values at time_a.
+    :param values_b: Values at time_b.
+    :param target_time: Time we want values for.
     :return: Interpolated values.
+    """
+    # Same calculation as scipy's interp1d (kind='linear'), but for many rows of values at once.
+    slope = (values_b - values_a) / (time_b - time_a)
+    return slope * (target_time - time_a) + values_a
 
+
+def interpolate_bearings(time_a: numpy.ndarray, time_b: numpy.ndarray,
+                         directions_a: numpy.ndarray, directions_b: numpy.ndarray,
+                         target_time: numpy.ndarray) -> numpy.ndarray:
+    """ Interpolate arrays of bearings (in degrees) between two points in time, along the acute angle
+    between each pair of bearings. (See interpolate_values for the parameters.)
     """
-    # Prepare x-axis (time).
-    x_axis = [x1, x2]
-    # Prepare y-axis (values).
-    y_axis = [
-        [y1[0], y2[0]],
-        [y1[1], y2[1]],
-        [y1[2], y2[2]],
-        [y1[3], y2[3]]
-    ]
-
-    # Create interpolation function.
-    function = interp1d(x_axis, y_axis, kind='linear')
-    # Use iterpolation function to derive values at the time of interest.
-    return function(xn)
+    directions_a = numpy.asarray(directions_a, dtype=float)
+    directions_b = numpy.asarray(directions_b, dtype=float)
+    # If the difference between two angles exceeds 180 degrees, it means we need to add
+    # 360 degrees to the smaller number in order to find the actute angle.
+    # After interpolating between the two angles, we need to subtract 360 degrees to ensure
+    # we have a value between between 0 and 360 again.
+    # e.g. a = 259 and b = 1 ; We don't actually want to interpolate between 259 and 1, we want
+    # to interpolat between 361 and 259.
+    obtuse = numpy.abs(directions_a - directions_b) > 180
+    a_is_smaller = directions_a < directions_b
+    directions_a = numpy.where(obtuse & a_is_smaller, directions_a + 360, directions_a)
+    directions_b = numpy.where(obtuse & ~a_is_smaller, directions_b + 360, directions_b)
+    interpolated = interpolate_values(time_a, time_b, directions_a, directions_b, target_time)
+    # If we had to adjust the angles, we need to re-adjust the resultant angle.
+    return numpy.where(interpolated >= 360, interpolated - 360, interpolated)
 
 
 def interpolate_bearing(time_a: datetime, time_b: datetime, target_time: datetime,
@@ -69,77 +97,151 @@ def interpolate_bearing(time_a: datetime, time_b: datetime, target_time: datetim
     :direction_a: Bearing (in degrees) at time_a.
     :direction_b: Bearing (in degrees) at time b.
     """
-    x_axis = (time_a.timestamp(), time_b.timestamp())
-    # If the difference between two angles exceeds 180 degrees, it means we need to add
-    # 360 degrees to the smaller number in order to find the actute angle.
-    # After interpolating between the two angles, we need to subtract 360 degrees to ensure
-    # we have a value between between 0 and 360 again.
-    # e.g. a = 259 and b = 1 ; We don't actually want to interpolate between 259 and 1, we want
-    # to interpolat between 361 and 259.
-    if abs(direction_a - direction_b) > 180:
-        # We want to interpolate along the acute angle between the two directions
-        if direction_a < direction_b:
-            y_axis = (direction_a+360, direction_b)
-        else:
-            y_axis = (direction_a, direction_b+360)
-    else:
-        y_axis = (direction_a, direction_b)
-
-    function = interp1d(x_axis, y_axis, kind='linear')
-    interpolated_value = function(target_time.timestamp()).item(0)
-    if interpolated_value >= 360:
-        # If we had to adjust the angles, we need to re-adjust the resultant angle.
-        return interpolated_value - 360
-    return interpolated_value
-
-
-def interpolate_wind_direction(prediction_a: ModelRunGridSubsetPrediction,
-                               prediction_b: ModelRunGridSubsetPrediction,
-                               target_timestamp: datetime):
-    """ Interpolate wind direction  """
-    if prediction_a.wdir_tgl_10 is None or prediction_b.wdir_tgl_10 is None:
-        # There's nothing to interpolate!
-        return None
-    result = []
-    for wdir_tgl_10_a, wdir_tgl_10_b in zip(prediction_a.wdir_tgl_10, prediction_b.wdir_tgl_10):
-
-        interpolated_wdir = interpolate_bearing(prediction_a.prediction_timestamp,
-                                                prediction_b.prediction_timestamp, target_timestamp,
-                                                wdir_tgl_10_a, wdir_tgl_10_b)
-
-        result.append(interpolated_wdir)
-
-    return result
+    return interpolate_bearings(time_a.timestamp(), time_b.timestamp(), direction_a, direction_b,
+                                target_time.timestamp()).item(0)
 
 
-def construct_interpolated_noon_prediction(prediction_a: ModelRunGridSubsetPrediction,
-                                           prediction_b: ModelRunGridSubsetPrediction):
-    """ Construct a noon prediction by interpolating.
+def construct_interpolated_noon_predictions(
+        prediction_pairs: List[Tuple[ModelRunGridSubsetPrediction, ModelRunGridSubsetPrediction]]
+) -> List[ModelRunGridSubsetPrediction]:
+    """ Construct noon predictions by interpolating between pairs of predictions (e.g. 18h and 21h). The
+    values of all the vertices of all the pairs are interpolated in one go, for each variable.
     """
-    # create a noon prediction. (using utc hour 20, as that is solar noon in B.C.)
-    noon_prediction = ModelRunGridSubsetPrediction()
-    noon_prediction.prediction_timestamp = prediction_a.prediction_timestamp.replace(
-        hour=20)
-    # throw timestamps into their own variables.
-    timestamp_a = prediction_a.prediction_timestamp.timestamp()
-    timestamp_b = prediction_b.prediction_timestamp.timestamp()
-    noon_timestamp = noon_prediction.prediction_timestamp.timestamp()
+    noon_predictions = []
+    for prediction_a, _ in prediction_pairs:
+        # create a noon prediction. (using utc hour 20, as that is solar noon in B.C.)
+        noon_prediction = ModelRunGridSubsetPrediction()
+        noon_prediction.prediction_timestamp = prediction_a.prediction_timestamp.replace(hour=20)
+        noon_predictions.append(noon_prediction)
+    # throw timestamps into their own column vectors.
+    timestamps = numpy.array([
+        (prediction_a.prediction_timestamp.timestamp(),
+         prediction_b.prediction_timestamp.timestamp(),
+         noon_prediction.prediction_timestamp.timestamp())
+        for (prediction_a, prediction_b), noon_prediction in zip(prediction_pairs, noon_predictions)])
     # calculate interpolated values.
-    for key in SCALAR_MODEL_VALUE_KEYS:
-        value_a = getattr(prediction_a, key)
-        value_b = getattr(prediction_b, key)
-        if value_a is None or value_b is None:
+    for key in MODEL_VALUE_KEYS:
+        indices = [index for index, (prediction_a, prediction_b) in enumerate(prediction_pairs)
+                   if getattr(prediction_a, key) is not None and getattr(prediction_b, key) is not None]
+        if len(indices) < len(prediction_pairs) and key != 'wdir_tgl_10':
             logger.warning('can\'t interpolate between None values for %s', key)
+        if not indices:
             continue
+        values_a = numpy.array([getattr(prediction_pairs[index][0], key) for index in indices], dtype=float)
+        values_b = numpy.array([getattr(prediction_pairs[index][1], key) for index in indices], dtype=float)
+        time_a, time_b, target_time = (timestamps[indices, column:column + 1] for column in range(3))
+        # Wind direction is a bearing, so needs to be interpolated along the acute angle.
+        interpolate = interpolate_bearings if key == 'wdir_tgl_10' else interpolate_values
+        for index, values in zip(indices, interpolate(time_a, time_b, values_a, values_b, target_time)):
+            setattr(noon_predictions[index], key, values)
+
+    for (prediction_a, _), noon_prediction in zip(prediction_pairs, noon_predictions):
+        if noon_prediction.apcp_sfc_0 is None or prediction_a.apcp_sfc_0 is None:
+            noon_prediction.delta_precip = None
+        else:
+            noon_prediction.delta_precip = noon_prediction.apcp_sfc_0 - numpy.array(prediction_a.apcp_sfc_0)
+
+    return noon_predictions
 
-        value = interpolate_between_two_points(timestamp_a, timestamp_b, value_a, value_b, noon_timestamp)
-        setattr(noon_prediction, key, value)
-    if noon_prediction.apcp_sfc_0 is None or prediction_a.apcp_sfc_0 is None:
-        noon_prediction.delta_precip = None
-    else:
-        noon_prediction.delta_precip = noon_prediction.apcp_sfc_0 - prediction_a.apcp_sfc_0
 
-    noon_prediction.wdir_tgl_10 = interpolate_wind_direction(
-        prediction_a, prediction_b, noon_prediction.prediction_timestamp)
+def get_linear_interpolation_weights(points: List, coordinate: List) -> numpy.ndarray:
+    """ Calculate the weight of each of the grid points, when linearly interpolating to the coordinate.
 
-    return noon_prediction
+    The weights are the barycentric coordinates of the coordinate, in the Delaunay triangle it falls in -
+    which is exactly what scipy.interpolate.griddata(method='linear') does, but without having to
+    triangulate the grid for every value that is interpolated. If the coordinate isn't inside the grid, the
+    weights are all nan (griddata gives nan in that case).
+
+    NOTE: We're interpolating using degrees, as such we're introducing a slight inaccuracy since degrees !=
+    distance. (i.e. This distance between two points at the bottom of a grid, isn't the same as the distance
+    at the top.) The accuracy we'd gain by interpolating in meters is very little, it's adding an error of
+    less than 100 meters on the global model. (Which typically results in the 3rd decimal value of the
+    interpolated value differing.)
+    """
+    triangulation = Delaunay(numpy.asarray(points, dtype=float))
+    coordinate = numpy.asarray(coordinate, dtype=float)
+    simplex = triangulation.find_simplex(coordinate)
+    weights = numpy.zeros(len(points))
+    if simplex < 0:
+        weights[:] = numpy.nan
+        return weights
+    transform = triangulation.transform[simplex]
+    barycentric = transform[:2].dot(coordinate - transform[2])
+    weights[triangulation.simplices[simplex]] = numpy.append(barycentric, 1 - barycentric.sum())
+    return weights
+
+
+def interpolate_predictions(predictions: List[ModelRunGridSubsetPrediction],
+                            weights: numpy.ndarray,
+                            keys=LINEAR_INTERPOLATION_KEYS) -> numpy.ndarray:
+    """ Linearly interpolate the values of all the predictions in one go, given the interpolation weights
+    of the grid points.
+
+    :return: Array with a row per prediction, and a column per key. Values that are None are nan.
+    """
+    values = numpy.full((len(predictions), len(keys), len(weights)), numpy.nan)
+    for prediction_index, prediction in enumerate(predictions):
+        for key_index, key in enumerate(keys):
+            value = getattr(prediction, key)
+            if value is not None:
+                values[prediction_index, key_index] = value
+    return values.dot(weights)
+
+
+def use_time_series_storage() -> bool:
+    """ Model run grid subset predictions are either stored as a row per prediction timestamp
+    (ModelRunGridSubsetPrediction), or as a row per model run with a time series of values
+    (ModelRunGridSubsetTimeSeries). """
+    return config.get('GRID_SUBSET_TIME_SERIES_STORAGE', 'False') == 'True'
+
+
+def encode_time_series_values(prediction_hour: int, values: List[float]) -> List[float]:
+    """ Pack the values at the vertices of a grid subset for a prediction hour into a time series, in which
+    the values of all other prediction hours are None. (See ModelRunGridSubsetTimeSeries.) """
+    return [None] * (prediction_hour * VERTEX_COUNT) + list(values)
+
+
+def decode_time_series(values: List[float], hours: int = 0) -> numpy.ndarray:
+    """ Decode a packed time series into an array with a row per prediction hour (at least hours rows), and a
+    column per vertex of the grid subset. Values that are missing are nan. """
+    values = numpy.array(values if values is not None else [], dtype=float)
+    rows = max(hours, math.ceil(len(values) / VERTEX_COUNT))
+    decoded = numpy.full(rows * VERTEX_COUNT, numpy.nan)
+    decoded[:len(values)] = values
+    return decoded.reshape(rows, VERTEX_COUNT)
+
+
+def decode_time_series_slice(values: List[float]) -> numpy.ndarray:
+    """ Decode the slice of a time series for a prediction hour, i.e. the values at the vertices of the grid
+    subset, with nan for missing values, or None if there are no values at all. """
+    if values is None or all(value is None for value in values):
+        return None
+    return numpy.array(values, dtype=float)
+
+
+def time_series_to_predictions(prediction_run_timestamp: datetime,
+                               time_series: ModelRunGridSubsetTimeSeries,
+                               until: datetime = None,
+                               since: datetime = None) -> List[ModelRunGridSubsetPrediction]:
+    """ Decode the time series of a model run grid subset into a (transient) prediction for every prediction
+    hour that has values, from and up to (and including) since and until if specified. Values that are
+    missing are None. """
+    hours = max(math.ceil(len(getattr(time_series, key) or []) / VERTEX_COUNT) for key in MODEL_VALUE_KEYS)
+    values = {key: decode_time_series(getattr(time_series, key), hours) for key in MODEL_VALUE_KEYS}
+    # A prediction hour has a value if any of its vertices has a value.
+    has_value = {key: ~numpy.isnan(decoded).all(axis=1) for key, decoded in values.items()}
+    predictions = []
+    for hour in numpy.flatnonzero(numpy.any(list(has_value.values()), axis=0)):
+        prediction_timestamp = prediction_run_timestamp + timedelta(hours=int(hour))
+        if until is not None and prediction_timestamp > until:
+            break
+        if since is not None and prediction_timestamp < since:
+            continue
+        prediction = ModelRunGridSubsetPrediction(
+            prediction_model_run_timestamp_id=time_series.prediction_model_run_timestamp_id,
+            prediction_model_grid_subset_id=time_series.prediction_model_grid_subset_id,
+            prediction_timestamp=prediction_timestamp)
+        for key in MODEL_VALUE_KEYS:
+            setattr(prediction, key, values[key][hour] if has_value[key][hour] else None)
+        predictions.append(prediction)
+    return predictions
@@ -2,35 +2,53 @@
 TODO: Move this file to app/models/ (not part of this PR as it makes comparing prev. version difficult -
       there are so many changes, it's picked up as a delete instead of a move.)
 """
+# pylint: disable=too-many-lines
 
 import os
+import re
 import sys
+import argparse
+import time
 import datetime
-from typing import Generator, List
+import itertools
+import functools
+import multiprocessing
+from collections import deque
+from email.utils import formatdate, parsedate_to_datetime
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Dict, Generator, List, Set, Tuple
 from urllib.parse import urlparse
 import logging
 import tempfile
 import requests
+from requests.adapters import HTTPAdapter
 import numpy
+import gdal
 from pyproj import Geod
-from scipy.interpolate import griddata
 from geoalchemy2.shape import to_shape
 from sqlalchemy.orm import Session
-from app.db.crud.weather_models import (get_processed_file_record,
-                                        get_processed_file_count,
+from app.db.crud.data_versions import bump_data_version
+from app.db.crud.weather_models import (get_processed_file_urls,
+                                        upsert_processed_file_urls,
                                         get_prediction_model_run_timestamp_records,
+                                        get_prediction_run_by_id,
                                         get_model_run_predictions_for_grid,
-                                        get_grid_for_coordinate,
-                                        get_weather_station_model_prediction)
+                                        get_model_run_time_series_for_grid,
+                                        get_grids_for_coordinates,
+                                        upsert_weather_station_model_predictions,
+                                        upsert_latest_station_model_predictions)
 from app.weather_models.machine_learning import StationMachineLearning
-from app.weather_models import ModelEnum, ProjectionEnum, construct_interpolated_noon_prediction
+from app.weather_models import (ModelEnum, ProjectionEnum, construct_interpolated_noon_predictions,
+                                get_linear_interpolation_weights, interpolate_predictions,
+                                use_time_series_storage, time_series_to_predictions)
 from app.schemas.stations import WeatherStation
-from app import configure_logging
+from app import configure_logging, config
 import app.time_utils as time_utils
 from app.stations import get_stations_synchronously
 from app.weather_models.process_grib import GribFileProcessor, ModelRunInfo
-from app.db.models import (ProcessedModelRunUrl, PredictionModelRunTimestamp,
-                           WeatherStationModelPrediction, ModelRunGridSubsetPrediction)
+from app.db.models.data_versions import DataSourceEnum
+from app.db.models import (PredictionModel, PredictionModelRunTimestamp, PredictionModelGridSubset,
+                           ModelRunGridSubsetPrediction)
 import app.db.database
 from app.rocketchat_notifications import send_rocketchat_notification
 
@@ -43,6 +61,22 @@ logger = logging.getLogger(__name__)
 
 GRIB_LAYERS = ('TMP_TGL_2', 'RH_TGL_2', 'APCP_SFC_0', 'WDIR_TGL_10', 'WIND_TGL_10')
 
+# Processed files are flagged in the database in batches of this size.
+PROCESSED_URL_BATCH_SIZE = 20
+
+# When interpolating as we go, model runs are interpolated after every batch of this many prediction
+# timestamps.
+INCREMENTAL_INTERPOLATION_BATCH_SIZE = 8
+
+# Interpolated weather station predictions are upserted in batches of (at least) this size.
+STATION_PREDICTION_BATCH_SIZE = 1000
+
+# Downloads are streamed in chunks of this size.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Path in GDAL's in memory file system, used when downloading to memory.
+VSIMEM_PATH = '/vsimem/env_canada'
+
 
 class UnhandledPredictionModelType(Exception):
     """ Exception raised when an unknown model type is encountered. """
@@ -241,40 +275,212 @@ def get_regional_model_run_download_urls(now: datetime.datetime, hour: int) -> G
             yield url
 
 
-def download(url: str, path: str) -> str:
+def get_http_session(pool_size: int) -> requests.Session:
+    """ Get a http session, with a connection pool large enough to be shared by all the downloaders. """
+    http_session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    http_session.mount('http://', adapter)
+    http_session.mount('https://', adapter)
+    return http_session
+
+
+def _write_file(target: str, chunks):
+    """ Write chunks to a file as they arrive. Targets in /vsimem/ are written to GDAL's in memory file
+    system. If writing fails part way, the partially written file is removed. """
+    if target.startswith(VSIMEM_PATH):
+        file_object = gdal.VSIFOpenL(target, 'wb')
+        try:
+            for chunk in chunks:
+                gdal.VSIFWriteL(chunk, 1, len(chunk), file_object)
+        except Exception:
+            # An in memory file would otherwise hold on to its memory for the life of the process.
+            gdal.VSIFCloseL(file_object)
+            gdal.Unlink(target)
+            raise
+        gdal.VSIFCloseL(file_object)
+    else:
+        try:
+            with open(target, 'wb') as file_object:
+                for chunk in chunks:
+                    file_object.write(chunk)
+        except Exception:
+            if os.path.exists(target):
+                os.remove(target)
+            raise
+
+
+def remove_downloaded_file(filename: str):
+    """ Remove a downloaded file, from disk or from GDAL's in memory file system. """
+    if filename.startswith(VSIMEM_PATH):
+        gdal.Unlink(filename)
+    else:
+        os.remove(filename)
+
+
+def download(url: str, path: str, http_session: requests.Session = None) -> str:
     """
     Download a file from a url.
     NOTE: was using wget library initially, but has the drawback of not being able to control where the
     temporary files are stored. This is problematic, as giving the application write access to /app
     is a security concern.
+    If a http session is supplied, it's used to get the file, so that connections are re-used.
+    The file is streamed to the target as it arrives, rather than being held in memory. If the path is in
+    /vsimem/, the file is written to GDAL's in memory file system instead of to disk.
     """
     # Infer filename from url.
     filename = os.path.split(url)[-1]
     # Construct target location for downloaded file.
-    target = os.path.join(os.getcwd(), path, filename)
+    if path.startswith(VSIMEM_PATH):
+        target = '/'.join([path, filename])
+    else:
+        target = os.path.join(os.getcwd(), path, filename)
     # Get the file.
     # It's important to have a timeout on the get, otherwise the call may get stuck for an indefinite
     # amount of time - there is no default value for timeout. During testing, it was observed that
     # downloads usually complete in less than a second.
     logger.info('downloading %s', url)
-    response = requests.get(url, timeout=60)
-    # If the response is 200/OK.
-    if response.status_code == 200:
-        # Store the response.
-        with open(target, 'wb') as file_object:
-            # Write the file.
-            file_object.write(response.content)
-    elif response.status_code == 404:
-        # We expect this to happen frequently - just log for info.
-        logger.info('404 error for %s', url)
-        target = None
-    else:
-        # Raise an exception
-        response.raise_for_status()
+    if http_session is None:
+        http_session = requests
+    with http_session.get(url, timeout=60, stream=True) as response:
+        # If the response is 200/OK.
+        if response.status_code == 200:
+            # Store the response.
+            _write_file(target, response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE))
+        elif response.status_code == 404:
+            # We expect this to happen frequently - just log for info.
+            logger.info('404 error for %s', url)
+            target = None
+        else:
+            # Raise an exception
+            response.raise_for_status()
     # Return file location.
     return target
 
 
+def _parse_content_range(content_range: str) -> Tuple[int, int]:
+    """ Parse a Content-Range header, e.g. "bytes 1000-1999/2000" or "bytes */2000" (in response to a range
+    that can't be satisfied).
+
+    :return: The start of the range (None if there isn't one), and the total length (None if unknown).
+    """
+    match = re.match(r'bytes (?:(\d+)-\d+|\*)/(\d+|\*)', content_range or '')
+    if match is None:
+        return None, None
+    start, total = match.groups()
+    return (None if start is None else int(start)), (None if total == '*' else int(total))
+
+
+def _read_validator(filename: str) -> str:
+    """ Read the validator (ETag or Last-Modified) stored alongside a partial download, or None. """
+    try:
+        with open(filename, 'r') as file_object:
+            return file_object.read() or None
+    except OSError:
+        return None
+
+
+def _write_partial_download(response: requests.Response, partial: str, offset: int) -> Tuple[bool, str]:
+    """ Write (or append, for a range request) the response to the partial download.
+
+    :param offset: The size of the partial download the remainder was requested for, or None.
+    :return: Whether the partial download has to be discarded and downloaded again, and the Last-Modified
+    header of the response.
+    """
+    if response.status_code == 416 and offset is not None:
+        # There's nothing left to download - either the partial download is complete, or it doesn't match
+        # the file on the server.
+        _, total = _parse_content_range(response.headers.get('Content-Range'))
+        return total != offset, None
+    response.raise_for_status()
+    mode = 'wb'
+    if response.status_code == 206:
+        # Only append to the partial download if we're getting the remainder of the file.
+        start, _ = _parse_content_range(response.headers.get('Content-Range'))
+        if start != offset:
+            return True, None
+        mode = 'ab'
+    else:
+        # Store the validator of the file on the server before downloading it, so that the download can be
+        # resumed (with If-Range) if it's interrupted, as long as the file on the server hasn't changed.
+        with open(partial + '.validator', 'w') as file_object:
+            file_object.write(response.headers.get('ETag') or response.headers.get('Last-Modified') or '')
+    with open(partial, mode) as file_object:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            file_object.write(chunk)
+    return False, response.headers.get('Last-Modified')
+
+
+def _remove_partial_download(partial: str):
+    """ Remove a partial download, and its validator. """
+    for filename in (partial, partial + '.validator'):
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def download_to_cache(url: str, cache_path: str, http_session: requests.Session = None) -> str:
+    """
+    Download a file from a url into a local cache, and return the location of the cached file.
+    - If the file is already in the cache, it's only downloaded again if it has been modified since (it
+      normally isn't), so re-runs of a model run don't download anything again.
+    - If an earlier download of the file was interrupted, only the remainder of the file is requested,
+      using a range request that is conditional on the validator (ETag or Last-Modified) of the interrupted
+      download. If the partial download turns out to be complete already (e.g. the process was stopped
+      before it was renamed), it's used as is. If it can't be resumed, the whole file is downloaded again.
+    NOTE: Each grib file on the datamart holds a single message (one variable, level and hour), so there's
+    no smaller byte range to fetch - the data section is packed, and can't be decoded in part.
+    """
+    filename = os.path.split(url)[-1]
+    target = os.path.join(cache_path, filename)
+    partial = target + '.part'
+    headers = {}
+    offset = None
+    if os.path.exists(target):
+        headers['If-Modified-Since'] = formatdate(os.path.getmtime(target), usegmt=True)
+    elif os.path.exists(partial):
+        validator = _read_validator(partial + '.validator')
+        if validator is None:
+            # Without a validator, there's no telling whether the partial download is of the current file.
+            _remove_partial_download(partial)
+        else:
+            offset = os.path.getsize(partial)
+            headers['Range'] = 'bytes={}-'.format(offset)
+            # If the file changed since we started downloading it, the server sends the whole file instead.
+            headers['If-Range'] = validator
+    logger.info('downloading %s', url)
+    if http_session is None:
+        http_session = requests
+    with http_session.get(url, timeout=60, stream=True, headers=headers) as response:
+        if response.status_code == 304:
+            logger.info('using cached %s', target)
+            return target
+        if response.status_code == 404:
+            # We expect this to happen frequently - just log for info.
+            logger.info('404 error for %s', url)
+            return None
+        restart, last_modified = _write_partial_download(response, partial, offset)
+    if restart:
+        logger.info('discarding partial download of %s', url)
+        _remove_partial_download(partial)
+        return download_to_cache(url, cache_path, http_session)
+    os.replace(partial, target)
+    _remove_partial_download(partial)
+    if last_modified:
+        # Use the modification time of the file on the server, for subsequent If-Modified-Since requests.
+        timestamp = parsedate_to_datetime(last_modified).timestamp()
+        os.utime(target, (timestamp, timestamp))
+    return target
+
+
+def prune_cache(cache_path: str, max_age: datetime.timedelta):
+    """ Remove files (and partial downloads) from the cache that haven't been modified within max_age. """
+    oldest = time.time() - max_age.total_seconds()
+    for filename in os.listdir(cache_path):
+        path = os.path.join(cache_path, filename)
+        if os.path.isfile(path) and os.path.getmtime(path) < oldest:
+            logger.info('removing %s from cache', path)
+            os.remove(path)
+
+
 def get_closest_index(coordinate: List, points: List):
     """ Get the index of the point closest to the coordinate """
     # https://pyproj4.github.io/pyproj/stable/api/geod.html
@@ -289,6 +495,19 @@ def get_closest_index(coordinate: List, points: List):
     return numpy.argmin(distances)
 
 
+def calculate_delta_precip(station_prediction: dict, prev_station_prediction: dict) -> float:
+    """ Calculate the station_prediction's delta_precip based on the previous precip
+    prediction for the station
+    """
+    # If there exists a previous prediction for the station from the same model run
+    if prev_station_prediction is not None:
+        return station_prediction['apcp_sfc_0'] - prev_station_prediction['apcp_sfc_0']
+    # If there is no prior prediction within the same model run, it means that station_prediction is
+    # the first prediction with apcp for the current model run (hour 001 or 003, depending on the
+    # model type). In this case, delta_precip will be equal to the apcp
+    return station_prediction['apcp_sfc_0']
+
+
 def mark_prediction_model_run_processed(session: Session,
                                         model: ModelEnum,
                                         projection: ProjectionEnum,
@@ -315,16 +534,50 @@ def mark_prediction_model_run_processed(session: Session,
         prediction_run_timestamp)
     logger.info('prediction run: %s', prediction_run)
     prediction_run.complete = True
+    bump_data_version(session, DataSourceEnum.WEATHER_MODELS, time_utils.get_utc_now())
     app.db.crud.weather_models.update_prediction_run(session, prediction_run)
 
 
+def get_ingested_until(session: Session, model_run: PredictionModelRunTimestamp,
+                       model_type: ModelEnum) -> datetime.datetime:
+    """ Get the prediction timestamp up to which (and including) all the layers of all the prediction
+    timestamps of the model run have been ingested. Predictions up to that timestamp can be interpolated,
+    even if the model run as a whole isn't complete yet.
+
+    :return: The last fully ingested prediction timestamp, or None if the first prediction timestamp of the
+    model run hasn't been fully ingested yet.
+    """
+    run_timestamp = model_run.prediction_run_timestamp
+    urls = get_model_run_urls(run_timestamp, model_type, run_timestamp.hour)
+    processed_urls = get_processed_file_urls(session, urls)
+    ingested_until = None
+    # The urls are ordered by prediction timestamp, with all the layers of a prediction timestamp together.
+    for prediction_timestamp, urls_for_timestamp in itertools.groupby(
+            urls, key=lambda url: parse_env_canada_filename(url).prediction_timestamp):
+        if not all(url in processed_urls for url in urls_for_timestamp):
+            break
+        ingested_until = prediction_timestamp
+    return ingested_until
+
+
+def batch_urls_by_prediction_timestamp(urls: List[str], size: int) -> List[List[str]]:
+    """ Split the urls of a model run into batches of (at most) size prediction timestamps, keeping all the
+    layers of a prediction timestamp in the same batch. """
+    # The urls are ordered by prediction timestamp, with all the layers of a prediction timestamp together.
+    urls_by_timestamp = [list(urls_for_timestamp) for _, urls_for_timestamp in itertools.groupby(
+        urls, key=lambda url: parse_env_canada_filename(url).prediction_timestamp)]
+    return [list(itertools.chain.from_iterable(urls_by_timestamp[index:index + size]))
+            for index in range(0, len(urls_by_timestamp), size)]
+
+
 class EnvCanada():
     """ Class that orchestrates downloading and processing of weather model grib files from environment
     Canada.
     """
 
     # pylint: disable=too-many-instance-attributes
-    def __init__(self, model_type: ModelEnum):
+    def __init__(self, model_type: ModelEnum, workers: int = 1,
+                 interpolate_ingested: Callable[[], None] = None):
         """ Prep variables """
         self.files_downloaded = 0
         self.files_processed = 0
@@ -333,6 +586,25 @@ class EnvCanada():
         self.now = time_utils.get_utc_now()
         self.session = app.db.database.get_write_session()
         self.grib_processor = GribFileProcessor()
+        # Files are downloaded concurrently, while they're being processed. To limit disk usage, we never
+        # have more than max_downloaded_files downloaded (or being downloaded) ahead of processing.
+        self.download_workers = int(config.get('ENV_CANADA_DOWNLOAD_WORKERS', 4))
+        self.max_downloaded_files = max(int(config.get('ENV_CANADA_MAX_DOWNLOADED_FILES', 8)), 1)
+        self.http_session = get_http_session(self.download_workers)
+        # Files can be downloaded to GDAL's in memory file system, instead of to a temporary folder on disk.
+        self.download_to_memory = config.get('ENV_CANADA_DOWNLOAD_TO_MEMORY', 'False') == 'True'
+        # If a cache folder is configured, files are downloaded to (and kept in) the cache. This takes
+        # precedence over downloading to memory.
+        self.cache_path = config.get('ENV_CANADA_GRIB_CACHE_PATH', '')
+        self.cache_max_age = datetime.timedelta(
+            hours=int(config.get('ENV_CANADA_GRIB_CACHE_MAX_AGE_HOURS', 24)))
+        # If there's more than one worker, the urls of a model run are processed by a pool of processes.
+        self.workers = workers
+        # Urls of files that have been processed, but not yet flagged as processed in the database.
+        self.urls_to_flag = []
+        # If specified, called after every batch of prediction timestamps that is processed, to interpolate
+        # model runs as far as they've been ingested.
+        self.interpolate_ingested = interpolate_ingested
         self.model_type = model_type
         # set projection based on model_type
         if self.model_type == ModelEnum.GDPS:
@@ -343,69 +615,139 @@ class EnvCanada():
             self.projection = ProjectionEnum.REGIONAL_PS
 
     def flag_file_as_processed(self, url):
-        """ Flag the file as processed in the database """
-        processed_file = get_processed_file_record(self.session, url)
-        if processed_file:
-            logger.info('re-procesed %s', url)
-        else:
-            logger.info('file processed %s', url)
-            processed_file = ProcessedModelRunUrl(
-                url=url,
-                create_date=time_utils.get_utc_now())
-        processed_file.update_date = time_utils.get_utc_now()
-        # pylint: disable=no-member
-        self.session.add(processed_file)
-        self.session.commit()
-
-    def check_if_model_run_complete(self, urls):
+        """ Flag the file as processed. Files are flagged in the database in batches. """
+        logger.info('file processed %s', url)
+        self.urls_to_flag.append(url)
+        if len(self.urls_to_flag) >= PROCESSED_URL_BATCH_SIZE:
+            self.flush_processed_files()
+
+    def flush_processed_files(self):
+        """ Flag all the files that have been processed since the last flush in the database """
+        if self.urls_to_flag:
+            upsert_processed_file_urls(self.session, self.urls_to_flag, time_utils.get_utc_now())
+            self.session.commit()
+            self.urls_to_flag = []
+
+    @staticmethod
+    def check_if_model_run_complete(urls, processed_urls: Set[str]):
         """ Check if a particular model run is complete """
-        # pylint: disable=no-member
-        actual_count = get_processed_file_count(self.session, urls)
+        actual_count = len(processed_urls.intersection(urls))
         expected_count = len(urls)
         logger.info('we have processed %s/%s files',
                     actual_count, expected_count)
         return actual_count == expected_count
 
-    def process_model_run_urls(self, urls):
-        """ Process the urls for a model run.
+    def download_urls(self, urls: List[str], path: str) -> Generator[Tuple[str, Future], None, None]:
+        """ Download urls concurrently, yielding the url and download future of each url, in order.
+        Downloads are only started while fewer than max_downloaded_files are waiting to be consumed, so the
+        downloads can never get too far ahead of processing.
         """
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+            for url in urls:
+                if self.cache_path:
+                    future = executor.submit(download_to_cache, url, self.cache_path, self.http_session)
+                else:
+                    future = executor.submit(download, url, path, self.http_session)
+                pending.append((url, future))
+                if len(pending) >= self.max_downloaded_files:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+
+    def get_urls_to_download(self, urls, processed_urls: Set[str]) -> List[Tuple[str, ModelRunInfo]]:
+        """ Get the urls (and model info) of the files that have not yet been processed. """
+        urls_to_download = []
         for url in urls:
+            if url in processed_urls:
+                # This file has already been processed - so we skip it.
+                logger.info('file already processed %s', url)
+                continue
             try:
-                # check the database for a record of this file:
-                processed_file_record = get_processed_file_record(
-                    self.session, url)
-                if processed_file_record:
-                    # This file has already been processed - so we skip it.
-                    logger.info('file already processed %s', url)
-                else:
-                    # extract model info from filename:
-                    filename = os.path.basename(urlparse(url).path)
-                    model_info = parse_env_canada_filename(filename)
-                    # download the file:
-                    with tempfile.TemporaryDirectory() as tmp_path:
-                        downloaded = download(url, tmp_path)
-                        if downloaded:
-                            self.files_downloaded += 1
-                            # If we've downloaded the file ok, we can now process it.
-                            try:
-                                self.grib_processor.process_grib_file(
-                                    downloaded, model_info)
-                                # Flag the file as processed
-                                self.flag_file_as_processed(url)
-                                self.files_processed += 1
-                            finally:
-                                # delete the file when done.
-                                os.remove(downloaded)
+                # extract model info from filename:
+                filename = os.path.basename(urlparse(url).path)
+                urls_to_download.append((url, parse_env_canada_filename(filename)))
             # pylint: disable=broad-except
             except Exception as exception:
                 self.exception_count += 1
-                # We catch and log exceptions, but keep trying to download.
-                # We intentionally catch a broad exception, as we want to try and download as much
-                # as we can.
                 logger.error('unexpected exception processing %s',
                              url, exc_info=exception)
+        return urls_to_download
+
+    def process_model_run_urls(self, urls, processed_urls: Set[str]):
+        """ Process the urls for a model run, skipping those that have already been processed. Urls that
+        are processed are added to processed_urls.
+        Files are downloaded in the background, while previously downloaded files are processed. All database
+        access, and grib processing, happens in this thread.
+        """
+        urls_to_download = self.get_urls_to_download(urls, processed_urls)
+        try:
+            if self.cache_path:
+                self.process_downloads(urls_to_download, processed_urls, self.cache_path)
+            elif self.download_to_memory:
+                self.process_downloads(urls_to_download, processed_urls, VSIMEM_PATH)
+            else:
+                with tempfile.TemporaryDirectory() as tmp_path:
+                    self.process_downloads(urls_to_download, processed_urls, tmp_path)
+        finally:
+            self.flush_processed_files()
+
+    def process_downloads(self, urls_to_download: List[Tuple[str, ModelRunInfo]], processed_urls: Set[str],
+                          path: str):
+        """ Download files to the path, processing them as they become available. """
+        model_info_by_url = dict(urls_to_download)
+        for url, download_future in self.download_urls([url for url, _ in urls_to_download], path):
+            self.process_downloaded_file(url, download_future, model_info_by_url[url], processed_urls)
+
+    def process_downloaded_file(self, url, download_future: Future, model_info: ModelRunInfo,
+                                processed_urls: Set[str]):
+        """ Process a downloaded file. """
+        try:
+            downloaded = download_future.result()
+            if downloaded:
+                self.files_downloaded += 1
+                # If we've downloaded the file ok, we can now process it.
+                try:
+                    self.grib_processor.process_grib_file(downloaded, model_info)
+                    # Flag the file as processed
+                    self.flag_file_as_processed(url)
+                    processed_urls.add(url)
+                    self.files_processed += 1
+                finally:
+                    # delete the file when done (unless we're keeping it in the cache).
+                    if not self.cache_path:
+                        remove_downloaded_file(downloaded)
+        # pylint: disable=broad-except
+        except Exception as exception:
+            self.exception_count += 1
+            # We catch and log exceptions, but keep trying to download.
+            # We intentionally catch a broad exception, as we want to try and download as much
+            # as we can.
+            logger.error('unexpected exception processing %s',
+                         url, exc_info=exception)
+
+    def process_model_run_urls_with_workers(self, urls, processed_urls: Set[str],
+                                            executor: ProcessPoolExecutor):
+        """ Shard the urls for a model run that have not yet been processed across the worker processes, and
+        wait for them to complete. Each worker flags the files it has processed in the database, and
+        returns them so that they can be added to processed_urls. """
+        urls = [url for url in urls if url not in processed_urls]
+        shards = [urls[index::self.workers] for index in range(self.workers)]
+        futures = [executor.submit(process_model_run_urls_in_worker, shard) for shard in shards if shard]
+        for future in futures:
+            try:
+                files_downloaded, files_processed, exception_count, worker_processed_urls = future.result()
+                self.files_downloaded += files_downloaded
+                self.files_processed += files_processed
+                self.exception_count += exception_count
+                processed_urls.update(worker_processed_urls)
+            # pylint: disable=broad-except
+            except Exception as exception:
+                # If a worker dies, we log it, and carry on with the remaining workers.
+                self.exception_count += 1
+                logger.error('unexpected exception in worker process', exc_info=exception)
 
-    def process_model_run(self, model_run_hour):
+    def process_model_run(self, model_run_hour, executor: ProcessPoolExecutor = None):
         """ Process a particular model run """
         logger.info('Processing {} model run {:02d}'.format(
             self.model_type, model_run_hour))
@@ -413,11 +755,25 @@ class EnvCanada():
         # Get the urls for the current model run.
         urls = get_model_run_urls(self.now, self.model_type, model_run_hour)
 
-        # Process all the urls.
-        self.process_model_run_urls(urls)
+        # Get the urls that have already been processed, in one go.
+        processed_urls = get_processed_file_urls(self.session, urls)
+
+        # Process all the urls, in batches of prediction timestamps if we interpolate as we go.
+        if self.interpolate_ingested is None:
+            batches = [urls]
+        else:
+            batches = batch_urls_by_prediction_timestamp(urls, INCREMENTAL_INTERPOLATION_BATCH_SIZE)
+        for batch in batches:
+            files_processed = self.files_processed
+            if executor is None:
+                self.process_model_run_urls(batch, processed_urls)
+            else:
+                self.process_model_run_urls_with_workers(batch, processed_urls, executor)
+            if self.interpolate_ingested is not None and self.files_processed > files_processed:
+                self.interpolate_ingested()
 
         # Having completed processing, check if we're all done.
-        if self.check_if_model_run_complete(urls):
+        if self.check_if_model_run_complete(urls, processed_urls):
             logger.info(
                 '{} model run {:02d}:00 completed with SUCCESS'.format(self.model_type, model_run_hour))
 
@@ -426,9 +782,24 @@ class EnvCanada():
 
     def process(self):
         """ Entry point for downloading and processing weather model grib files """
+        if self.cache_path:
+            os.makedirs(self.cache_path, exist_ok=True)
+            prune_cache(self.cache_path, self.cache_max_age)
+        if self.workers > 1:
+            # Spawn (rather than fork) the workers, so that they don't inherit database connections.
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=initialize_worker,
+                                     initargs=(self.model_type,)) as executor:
+                self.process_model_runs(executor)
+        else:
+            self.process_model_runs()
+
+    def process_model_runs(self, executor: ProcessPoolExecutor = None):
+        """ Process all the model runs for the model type """
         for hour in get_model_run_hours(self.model_type):
             try:
-                self.process_model_run(hour)
+                self.process_model_run(hour, executor)
             # pylint: disable=broad-except
             except Exception as exception:
                 # We catch and log exceptions, but keep trying to process.
@@ -439,89 +810,172 @@ class EnvCanada():
                     self.model_type, hour, exc_info=exception)
 
 
+# Each worker process has its own instance of EnvCanada (and so its own database session, grib processor
+# and http session), which it re-uses for all the urls it's given.
+_worker_env_canada: EnvCanada = None
+
+
+def initialize_worker(model_type: ModelEnum):
+    """ Initialize a worker process """
+    global _worker_env_canada  # pylint: disable=global-statement, invalid-name
+    configure_logging()
+    _worker_env_canada = EnvCanada(model_type)
+
+
+def process_model_run_urls_in_worker(urls: List[str]) -> Tuple[int, int, int, List[str]]:
+    """ Process urls in a worker process, returning the number of files downloaded and processed, the
+    number of exceptions encountered, and the urls that were processed. """
+    files_downloaded = _worker_env_canada.files_downloaded
+    files_processed = _worker_env_canada.files_processed
+    exception_count = _worker_env_canada.exception_count
+    processed_urls = set()
+    _worker_env_canada.process_model_run_urls(urls, processed_urls)
+    return (_worker_env_canada.files_downloaded - files_downloaded,
+            _worker_env_canada.files_processed - files_processed,
+            _worker_env_canada.exception_count - exception_count,
+            list(processed_urls))
+
+
 class ModelValueProcessor:
     """ Iterate through model runs that have completed, and calculate the interpolated weather predictions.
     """
 
-    def __init__(self):
+    def __init__(self, workers: int = 1, stations: List[WeatherStation] = None, incremental: bool = False):
         """ Prepare variables we're going to use throughout """
         self.session = app.db.database.get_write_session()
-        self.stations = get_stations_synchronously()
+        self.stations = get_stations_synchronously() if stations is None else stations
         self.station_count = len(self.stations)
-
-    def _process_model_run(self, model_run: PredictionModelRunTimestamp):
-        """ Interpolate predictions in the provided model run for all stations. """
-        logger.info('Interpolating values for model run: %s', model_run)
-        # Iterate through stations.
-        for index, station in enumerate(self.stations):
-            logger.info('Interpolating model run %s (%s/%s) for %s:%s',
-                        model_run.id,
-                        index, self.station_count,
-                        station.code, station.name)
-            # Process this model run for station.
-            self._process_model_run_for_station(model_run, station)
+        # If there's more than one worker, stations are interpolated by a pool of processes.
+        self.workers = workers
+        # If incremental, model runs that are still being downloaded are interpolated up to the last
+        # prediction timestamp that has been fully ingested.
+        self.incremental = incremental
+        # The predictions of each grid are either stored as a time series, or as a row per prediction.
+        self.time_series_storage = use_time_series_storage()
+        # The grids containing each station, keyed on prediction model id and then station code. The grid
+        # a station is in doesn't change between model runs.
+        self.grids = {}
+
+    def _process_model_run(self, model_run: PredictionModelRunTimestamp,
+                           executor: ProcessPoolExecutor = None,
+                           until: datetime.datetime = None):
+        """ Interpolate predictions in the provided model run for all stations, up to (and including) the
+        until prediction timestamp if specified. Predictions up to model_run.interpolated_until have already
+        been interpolated, so we carry on from there. """
+        logger.info('Interpolating values for model run: %s (from %s until %s)',
+                    model_run, model_run.interpolated_until, until)
+        if executor is None:
+            station_predictions_by_station = self._process_model_run_for_stations(
+                model_run, self.stations, until)
+        else:
+            station_predictions_by_station = self._process_model_run_with_workers(model_run, executor, until)
+        station_predictions = []
+        for predictions_for_station in station_predictions_by_station:
+            station_predictions.extend(predictions_for_station)
+            if len(station_predictions) >= STATION_PREDICTION_BATCH_SIZE:
+                upsert_weather_station_model_predictions(self.session, station_predictions)
+                station_predictions = []
+        upsert_weather_station_model_predictions(self.session, station_predictions)
         # Commit all the weather station model predictions (it's fast if we line them all up and commit
         # them in one go.)
         logger.info('commit to database...')
         self.session.commit()
         logger.info('done commit.')
 
-    def _process_prediction(self,  # pylint: disable=too-many-arguments
-                            prediction: ModelRunGridSubsetPrediction,
+    def _get_grids(self, prediction_model: PredictionModel,
+                   stations: List[WeatherStation]) -> Dict[int, PredictionModelGridSubset]:
+        """ Get the grids containing each of the stations, keyed on station code. Grids of stations that
+        haven't been looked up for the prediction model before are looked up in one go. """
+        grids = self.grids.setdefault(prediction_model.id, {})
+        coordinates = {station.code: (station.long, station.lat)
+                       for station in stations if station.code not in grids}
+        if coordinates:
+            logger.info('Getting grids for %s stations and model %s', len(coordinates), prediction_model)
+            new_grids = get_grids_for_coordinates(self.session, prediction_model, coordinates)
+            for station_code in coordinates:
+                grid = new_grids.get(station_code)
+                if grid is not None:
+                    # Detach the grid from the session, so that it isn't expired (and re-loaded) every time
+                    # the session is committed.
+                    self.session.expunge(grid)
+                grids[station_code] = grid
+        return grids
+
+    def _process_model_run_for_stations(self, model_run: PredictionModelRunTimestamp,
+                                        stations: List[WeatherStation],
+                                        until: datetime.datetime = None) -> Generator[List[dict], None, None]:
+        """ Interpolate predictions in the provided model run for the provided stations, yielding the
+        predictions of each station after model_run.interpolated_until (up to until). """
+        grids = self._get_grids(model_run.prediction_model, stations)
+        # Iterate through stations.
+        for index, station in enumerate(stations):
+            logger.info('Interpolating model run %s (%s/%s) for %s:%s',
+                        model_run.id,
+                        index, len(stations),
+                        station.code, station.name)
+            grid = grids[station.code]
+            if grid is None:
+                logger.warning('No %s grid for station %s', model_run.prediction_model, station.code)
+                continue
+            # Process this model run for station.
+            station_predictions = self._process_model_run_for_station(model_run, station, grid, until)
+            # The last prediction that was interpolated in a previous (incremental) pass is interpolated
+            # again, to calculate the delta precipitation and noon predictions, but isn't written again.
+            if model_run.interpolated_until is not None:
+                station_predictions = [
+                    station_prediction for station_prediction in station_predictions
+                    if station_prediction['prediction_timestamp'] > model_run.interpolated_until]
+            yield station_predictions
+
+    def _process_model_run_with_workers(self, model_run: PredictionModelRunTimestamp,
+                                        executor: ProcessPoolExecutor,
+                                        until: datetime.datetime = None) -> Generator[List[dict], None, None]:
+        """ Shard the stations across the worker processes, yielding the predictions of each shard as the
+        workers complete them. The workers don't write predictions to the database, that's left to us. """
+        shards = [self.stations[index::self.workers] for index in range(self.workers)]
+        futures = [executor.submit(process_model_run_for_stations_in_worker, model_run.id, shard, until)
+                   for shard in shards if shard]
+        for future in futures:
+            yield future.result()
+
+    @staticmethod
+    def _process_prediction(prediction: ModelRunGridSubsetPrediction,  # pylint: disable=too-many-arguments
+                            interpolated_values: numpy.ndarray,
                             station: WeatherStation,
                             model_run: PredictionModelRunTimestamp,
-                            points: List,
-                            coordinate: List,
-                            machine: StationMachineLearning):
-        """ NOTE: Re. using griddata to interpolate:
-
-        We're interpolating using degrees, as such we're introducing a slight
-        innacuracy since degrees != distance. (i.e. This distance between two
-        points at the bottom of a grid, isn't the same as the distance at the
-        top.)
-
-        It would be more accurate to interpolate towards the point of interest
-        based on the distance of that point from the grid points.
-
-        One could:
-        a) convert all points from degrees to meters in UTM,
-           and then interpolate - that should be slightly more accurate, e.g.:
-        ```
-        def transform(long, lat):
-            # Transform NAD83 long and lat into UTM meters.
-            zone = math.floor((long + 180) / 6) + 1
-            utmProjection = "+proj=utm +zone={zone} +ellps=GRS80 +datum=NAD83 +units=m +no_defs".format(
-                zone=zone)
-            proj = Proj(utmProjection)
-            return proj(long, lat)
-        ```
-        b) use something else fancy like inverse distance weighting.
-
-        HOWEVER, the accuracy we gain is very little, it's adding an error of less than
-        100 meters on the global model. (Which typically results in the 3rd decimal value
-        of the interpolated value differing.)
-
-        More accuracy can be gained by taking into account altitude differences between
-        points and adjusting accordingly.
+                            closest_index: int,
+                            bias_adjusted_values: numpy.ndarray,
+                            prev_station_prediction: dict) -> dict:
+        """ Construct the prediction for the station, given the values of tmp_tgl_2, rh_tgl_2 and apcp_sfc_0
+        interpolated to the station coordinate (see get_linear_interpolation_weights), the index of the
+        grid point closest to the station, and the bias adjusted temperature and rh (nan if there are none).
+
+        :param prev_station_prediction: The station's previous prediction in the same model run, used to
+        calculate the delta precipitation.
+        :return: Values of the weather station model prediction, keyed on column name.
         """
-        # If there's already a prediction, we want to update it
-        station_prediction = get_weather_station_model_prediction(
-            self.session, station.code, model_run.id, prediction.prediction_timestamp)
-        if station_prediction is None:
-            station_prediction = WeatherStationModelPrediction()
-        # Populate the weather station prediction object.
-        station_prediction.station_code = station.code
-        station_prediction.prediction_model_run_timestamp_id = model_run.id
-        station_prediction.prediction_timestamp = prediction.prediction_timestamp
-        # Calculate the interpolated values.
+        now = time_utils.get_utc_now()
+        # Populate the weather station prediction.
+        station_prediction = {
+            'station_code': station.code,
+            'prediction_model_run_timestamp_id': model_run.id,
+            'prediction_timestamp': prediction.prediction_timestamp,
+            'tmp_tgl_2': None,
+            'rh_tgl_2': None,
+            'wind_tgl_10': None,
+            'wdir_tgl_10': None,
+            'create_date': now,
+            # Update the update time (this might be an update)
+            'update_date': now
+        }
+        tmp_tgl_2, rh_tgl_2, apcp_sfc_0 = interpolated_values
         # 2020 Dec 15, Sybrand: Encountered situation where tmp_tgl_2 was None, add this workaround for it.
         # NOTE: Not sure why this value would ever be None. This could happen if for whatever reason, the
         # tmp_tgl_2 layer failed to download and process, while other layers did.
         if prediction.tmp_tgl_2 is None:
             logger.warning('tmp_tgl_2 is None for ModelRunGridSubsetPrediction.id == %s', prediction.id)
         else:
-            station_prediction.tmp_tgl_2 = griddata(
-                points, prediction.tmp_tgl_2, coordinate, method='linear')[0]
+            station_prediction['tmp_tgl_2'] = tmp_tgl_2
 
         # 2020 Dec 10, Sybrand: Encountered situation where rh_tgl_2 was None, add this workaround for it.
         # NOTE: Not sure why this value would ever be None. This could happen if for whatever reason, the
@@ -529,78 +983,89 @@ class ModelValueProcessor:
         if prediction.rh_tgl_2 is None:
             # This is unexpected, so we log it.
             logger.warning('rh_tgl_2 is None for ModelRunGridSubsetPrediction.id == %s', prediction.id)
-            station_prediction.rh_tgl_2 = None
         else:
-            station_prediction.rh_tgl_2 = griddata(
-                points, prediction.rh_tgl_2, coordinate, method='linear')[0]
+            station_prediction['rh_tgl_2'] = rh_tgl_2
         # Check that apcp_sfc_0 is None, since accumulated precipitation
         # does not exist for 00 hour.
         if prediction.apcp_sfc_0 is None:
-            station_prediction.apcp_sfc_0 = 0.0
+            station_prediction['apcp_sfc_0'] = 0.0
         else:
-            station_prediction.apcp_sfc_0 = griddata(
-                points, prediction.apcp_sfc_0, coordinate, method='linear')[0]
+            station_prediction['apcp_sfc_0'] = apcp_sfc_0
         # Calculate the delta_precipitation based on station's previous prediction_timestamp
         # for the same model run
-        # For some reason pylint doesn't think session has a flush!
-        self.session.flush()  # pylint: disable=no-member
-        station_prediction.delta_precip = self._calculate_delta_precip(
-            station, model_run, prediction, station_prediction)
+        station_prediction['delta_precip'] = calculate_delta_precip(
+            station_prediction, prev_station_prediction)
 
         # Get the closest wind speed
         if prediction.wind_tgl_10 is not None:
-            station_prediction.wind_tgl_10 = prediction.wind_tgl_10[get_closest_index(coordinate, points)]
+            station_prediction['wind_tgl_10'] = prediction.wind_tgl_10[closest_index]
         # Get the closest wind direcion
         if prediction.wdir_tgl_10 is not None:
-            station_prediction.wdir_tgl_10 = prediction.wdir_tgl_10[get_closest_index(coordinate, points)]
-
-        # Predict the temperature
-        station_prediction.bias_adjusted_temperature = machine.predict_temperature(
-            station_prediction.tmp_tgl_2,
-            station_prediction.prediction_timestamp)
-        # Predict the rh
-        station_prediction.bias_adjusted_rh = machine.predict_rh(
-            station_prediction.rh_tgl_2, station_prediction.prediction_timestamp)
-        # Update the update time (this might be an update)
-        station_prediction.update_date = time_utils.get_utc_now()
-        # Add this prediction to the session (we'll commit it later.)
-        self.session.add(station_prediction)
-
-    def _calculate_delta_precip(self, station, model_run, prediction, station_prediction):
-        """ Calculate the station_prediction's delta_precip based on the previous precip
-        prediction for the station
+            station_prediction['wdir_tgl_10'] = prediction.wdir_tgl_10[closest_index]
+
+        # The bias adjusted values are nan if there's no model value, or no regression model for the hour.
+        bias_adjusted_temperature, bias_adjusted_rh = bias_adjusted_values
+        station_prediction['bias_adjusted_temperature'] = None if numpy.isnan(
+            bias_adjusted_temperature) else bias_adjusted_temperature
+        station_prediction['bias_adjusted_rh'] = None if numpy.isnan(bias_adjusted_rh) else bias_adjusted_rh
+        return station_prediction
+
+    @staticmethod
+    def _predict_bias_adjusted_values(machine: StationMachineLearning,
+                                      predictions: List[ModelRunGridSubsetPrediction],
+                                      interpolated_values: numpy.ndarray) -> numpy.ndarray:
+        """ Predict the bias adjusted temperature and rh of all the predictions in one go.
+        :param interpolated_values: Interpolated tmp_tgl_2, rh_tgl_2 and apcp_sfc_0 of each prediction.
+        :return: Array with a row per prediction, with the bias adjusted temperature and rh.
         """
-        results = self.session.query(WeatherStationModelPrediction).\
-            filter(WeatherStationModelPrediction.station_code == station.code).\
-            filter(WeatherStationModelPrediction.prediction_model_run_timestamp_id == model_run.id).\
-            filter(WeatherStationModelPrediction.prediction_timestamp < prediction.prediction_timestamp).\
-            order_by(WeatherStationModelPrediction.prediction_timestamp.desc()).\
-            limit(1).first()
-        # If there exists a previous prediction for the station from the same model run
-        if results is not None:
-            return station_prediction.apcp_sfc_0 - results.apcp_sfc_0
-        # If there is no prior prediction within the same model run, it means that station_prediction is
-        # the first prediction with apcp for the current model run (hour 001 or 003, depending on the
-        # model type). In this case, delta_precip will be equal to the apcp
-        return station_prediction.apcp_sfc_0
+        hours = [prediction.prediction_timestamp.hour for prediction in predictions]
+        return numpy.column_stack((
+            machine.predict('temperature', interpolated_values[:, 0], hours),
+            machine.predict('relative_humidity', interpolated_values[:, 1], hours)))
+
+    def _get_predictions_for_grid(self, model_run: PredictionModelRunTimestamp,
+                                  grid: PredictionModelGridSubset,
+                                  until: datetime.datetime = None) -> List[ModelRunGridSubsetPrediction]:
+        """ Get the predictions associated to this particular model run, in the grid, ordered by prediction
+        timestamp, with interpolated noon predictions added. Predictions before model_run.interpolated_until
+        have already been interpolated, and are skipped.
+        """
+        # The prediction at interpolated_until is the previous prediction of the first new one, and the 18h
+        # prediction to interpolate a noon prediction from, if the next one is at 21h.
+        since = model_run.interpolated_until
+        if self.time_series_storage:
+            time_series = get_model_run_time_series_for_grid(self.session, model_run, grid)
+            predictions = [] if time_series is None else time_series_to_predictions(
+                model_run.prediction_run_timestamp, time_series, until, since)
+        else:
+            predictions = list(get_model_run_predictions_for_grid(
+                self.session, model_run, grid, until, since))
+        # Find the 18h and 21h predictions to interpolate noon predictions between.
+        noon_indices = [index for index in range(1, len(predictions))
+                        if predictions[index - 1].prediction_timestamp.hour == 18
+                        and predictions[index].prediction_timestamp.hour == 21]
+        noon_predictions = construct_interpolated_noon_predictions(
+            [(predictions[index - 1], predictions[index]) for index in noon_indices])
+        # Insert the noon predictions in order (starting at the back, so the indices stay valid).
+        for index, noon_prediction in reversed(list(zip(noon_indices, noon_predictions))):
+            predictions.insert(index, noon_prediction)
+        return predictions
 
     def _process_model_run_for_station(self,
                                        model_run: PredictionModelRunTimestamp,
-                                       station: WeatherStation):
-        """ Process the model run for the provided station.
+                                       station: WeatherStation,
+                                       grid: PredictionModelGridSubset,
+                                       until: datetime.datetime = None) -> List[dict]:
+        """ Process the model run for the provided station, in the provided grid.
+
+        :return: The weather station model predictions, keyed on column name.
         """
+        # pylint: disable=too-many-locals
         # Extract the coordinate.
         coordinate = [station.long, station.lat]
-        # Lookup the grid our weather station is in.
-        logger.info("Getting grid for coordinate %s and model %s",
-                    coordinate, model_run.prediction_model)
-        grid = get_grid_for_coordinate(
-            self.session, model_run.prediction_model, coordinate)
 
-        # Convert the grid database object to a polygon object.
-        poly = to_shape(grid.geom)
-        # Extract the vertices of the polygon.
-        points = list(poly.exterior.coords)[:-1]
+        # Convert the grid database object to a polygon object, and extract the vertices of the polygon.
+        points = list(to_shape(grid.geom).exterior.coords)[:-1]
 
         machine = StationMachineLearning(
             session=self.session,
@@ -612,22 +1077,22 @@ class ModelValueProcessor:
             max_learn_date=model_run.prediction_run_timestamp)
         machine.learn()
 
-        # Get all the predictions associated to this particular model run, in the grid.
-        query = get_model_run_predictions_for_grid(
-            self.session, model_run, grid)
-
-        # Iterate through all the predictions.
-        prev_prediction = None
-        for prediction in query:
-            if (prev_prediction is not None
-                    and prev_prediction.prediction_timestamp.hour == 18
-                    and prediction.prediction_timestamp.hour == 21):
-                noon_prediction = construct_interpolated_noon_prediction(prev_prediction, prediction)
-                self._process_prediction(
-                    noon_prediction, station, model_run, points, coordinate, machine)
-            self._process_prediction(
-                prediction, station, model_run, points, coordinate, machine)
-            prev_prediction = prediction
+        predictions = self._get_predictions_for_grid(model_run, grid, until)
+
+        # The grid is the same for all the predictions, so we only need to work out the interpolation
+        # weights, and the closest grid point, once - and can then interpolate all the predictions in one go.
+        interpolated_values = interpolate_predictions(
+            predictions, get_linear_interpolation_weights(points, coordinate))
+        closest_index = get_closest_index(coordinate, points)
+        bias_adjusted_values = self._predict_bias_adjusted_values(machine, predictions, interpolated_values)
+        # The predictions are in order, so the delta precipitation can be calculated from the previous
+        # station prediction, without having to go back to the database for it.
+        station_predictions = []
+        for prediction, values, bias_adjusted in zip(predictions, interpolated_values, bias_adjusted_values):
+            station_predictions.append(self._process_prediction(
+                prediction, values, station, model_run, closest_index, bias_adjusted,
+                station_predictions[-1] if station_predictions else None))
+        return station_predictions
 
     def _mark_model_run_interpolated(self, model_run: PredictionModelRunTimestamp):
         """ Having completely processed a model run, we can mark it has having been interpolated.
@@ -635,11 +1100,49 @@ class ModelValueProcessor:
         model_run.interpolated = True
         logger.info('marking %s as interpolated', model_run)
         self.session.add(model_run)
+        # The predictions of this model run are now the latest predictions (unless there's a more recent
+        # model run).
+        upsert_latest_station_model_predictions(self.session, model_run, time_utils.get_utc_now())
+        # Cached responses built from the previous predictions are now stale.
+        bump_data_version(self.session, DataSourceEnum.WEATHER_MODELS, time_utils.get_utc_now())
         self.session.commit()
 
+    def _mark_model_run_interpolated_until(self, model_run: PredictionModelRunTimestamp,
+                                           until: datetime.datetime):
+        """ Having processed an incomplete model run up to a prediction timestamp, we record how far we got,
+        so that the next pass can carry on from there.
+        """
+        model_run.interpolated_until = until
+        logger.info('marking %s as interpolated until %s', model_run, until)
+        self.session.add(model_run)
+        upsert_latest_station_model_predictions(self.session, model_run, time_utils.get_utc_now())
+        bump_data_version(self.session, DataSourceEnum.WEATHER_MODELS, time_utils.get_utc_now())
+        self.session.commit()
+
+    def _process_with_workers(self, process_model_runs: Callable[[str, ProcessPoolExecutor], None],
+                              model_type: str):
+        """ Process model runs, with a pool of worker processes if there's more than one worker """
+        if self.workers > 1:
+            # Spawn (rather than fork) the workers, so that they don't inherit database connections.
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=initialize_interpolation_worker) as executor:
+                process_model_runs(model_type, executor)
+        else:
+            process_model_runs(model_type)
+
     def process(self, model_type: str):
         """ Entry point to start processing model runs that have not yet had their predictions interpolated
         """
+        self._process_with_workers(self.process_model_runs, model_type)
+
+    def process_incomplete(self, model_type: str):
+        """ Entry point to interpolate model runs that are still being downloaded, as far as they've been
+        ingested """
+        self._process_with_workers(self.process_incomplete_model_runs, model_type)
+
+    def process_model_runs(self, model_type: str, executor: ProcessPoolExecutor = None):
+        """ Interpolate all the model runs that have not yet had their predictions interpolated """
         # Get model runs that are complete (fully downloaded), but not yet interpolated.
         query = get_prediction_model_run_timestamp_records(
             self.session, complete=True, interpolated=False, model_type=model_type)
@@ -647,26 +1150,88 @@ class ModelValueProcessor:
             logger.info('model %s', model)
             logger.info('model_run %s', model_run)
             # Process the model run.
-            self._process_model_run(model_run)
+            self._process_model_run(model_run, executor)
             # Mark the model run as interpolated.
             self._mark_model_run_interpolated(model_run)
+        if self.incremental:
+            self.process_incomplete_model_runs(model_type, executor)
+
+    def process_incomplete_model_runs(self, model_type: str, executor: ProcessPoolExecutor = None):
+        """ Interpolate model runs that are still being downloaded, up to the last prediction timestamp that
+        has been fully ingested. """
+        query = get_prediction_model_run_timestamp_records(
+            self.session, complete=False, interpolated=False, model_type=model_type)
+        for model_run, model in query:
+            until = get_ingested_until(self.session, model_run, model_type)
+            if until is None or (model_run.interpolated_until is not None and
+                                 until <= model_run.interpolated_until):
+                logger.info('nothing new to interpolate for %s model_run %s', model, model_run)
+                continue
+            self._process_model_run(model_run, executor, until)
+            self._mark_model_run_interpolated_until(model_run, until)
+
+
+# Each interpolation worker process has its own instance of ModelValueProcessor (and so its own database
+# session), which it re-uses for all the stations it's given.
+_worker_model_value_processor: ModelValueProcessor = None
+
+
+def initialize_interpolation_worker():
+    """ Initialize an interpolation worker process """
+    global _worker_model_value_processor  # pylint: disable=global-statement, invalid-name
+    configure_logging()
+    # Workers are given the stations to interpolate, so there's no need to load them.
+    _worker_model_value_processor = ModelValueProcessor(stations=[])
+
+
+def process_model_run_for_stations_in_worker(model_run_id: int, stations: List[WeatherStation],
+                                             until: datetime.datetime = None) -> List[dict]:
+    """ Interpolate predictions in the model run (up to until, if specified) for the stations in a worker
+    process, returning the weather station model predictions (keyed on column name) of all the stations. """
+    # pylint: disable=protected-access
+    model_run = get_prediction_run_by_id(_worker_model_value_processor.session, model_run_id)
+    station_predictions = []
+    for predictions_for_station in _worker_model_value_processor._process_model_run_for_stations(
+            model_run, stations, until):
+        station_predictions.extend(predictions_for_station)
+    # Commit the regression sample sums stored while learning.
+    _worker_model_value_processor.session.commit()
+    return station_predictions
+
+
+def parse_arguments(args: List[str]) -> argparse.Namespace:
+    """ Parse the command line arguments """
+    parser = argparse.ArgumentParser(description='Download and process weather models from Env Canada.')
+    parser.add_argument('model_type', type=ModelEnum, help='Model type, e.g. GDPS, RDPS or HRDPS.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes used to process grib files, and to interpolate '
+                        'predictions for stations.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Also interpolate model runs that are still being downloaded, up to the last '
+                        'prediction timestamp that has been fully ingested.')
+    return parser.parse_args(args)
 
 
 def process_models():
     """ downloading and processing models """
 
     # set the model type requested based on arg passed via command line
-    model_type = ModelEnum(sys.argv[1])
-    logger.info('model type %s', model_type)
+    arguments = parse_arguments(sys.argv[1:])
+    model_type = arguments.model_type
+    logger.info('model type %s, workers %s', model_type, arguments.workers)
 
     # grab the start time.
     start_time = datetime.datetime.now()
 
-    env_canada = EnvCanada(model_type)
+    model_value_processor = ModelValueProcessor(arguments.workers, incremental=arguments.incremental)
+
+    # If incremental, model runs are interpolated as far as they've been ingested after every batch of
+    # prediction timestamps that is downloaded.
+    env_canada = EnvCanada(model_type, arguments.workers, interpolate_ingested=functools.partial(
+        model_value_processor.process_incomplete, model_type) if arguments.incremental else None)
     env_canada.process()
 
     # interpolate and machine learn everything that needs interpolating.
-    model_value_processor = ModelValueProcessor()
     model_value_processor.process(model_type)
 
     # calculate the execution time.
@@ -2,30 +2,31 @@
 """
 import datetime
 import logging
-from typing import List, Union
-from numpy import percentile
+from typing import Dict, List, Tuple
 import app.stations
 from app.weather_models import ModelEnum
 from app.schemas.weather_models import (
     WeatherModelPredictionSummary,
     WeatherModelPredictionSummaryValues,
     WeatherPredictionModel)
-import app.time_utils as time_utils
 import app.db.database
-from app.db.crud.weather_models import get_station_model_predictions_order_by_prediction_timestamp
-from app.db.models import PredictionModel, WeatherStationModelPrediction
+from app.db.crud.weather_models import get_station_model_prediction_summaries
+from app.db.models import PredictionModel
+from app.db.models.data_versions import DataSourceEnum
+from app.response_cache import fetch_station_fragments
 
 
 logger = logging.getLogger(__name__)
 
 
-KEYS = ('tmp_tgl_2', 'rh_tgl_2')
+SUMMARY_KEYS = ('tmp_tgl_2_5th', 'tmp_tgl_2_median', 'tmp_tgl_2_90th',
+                'rh_tgl_2_5th', 'rh_tgl_2_median', 'rh_tgl_2_90th')
 
 
-def _build_query_to_get_predictions(
+def _build_query_to_get_summaries(
         station_codes: List[int],
-        model: ModelEnum, time_of_interest: datetime) -> List[Union[WeatherStationModelPrediction, PredictionModel]]:
-    """ Build a query to get the predictions for a given list of weather stations for a specified
+        model: ModelEnum, time_of_interest: datetime) -> List[Tuple[PredictionModel, int, datetime.datetime]]:
+    """ Build a query to get the prediction summaries for a given list of weather stations for a specified
     model.
     """
     # Build the query:
@@ -33,7 +34,7 @@ def _build_query_to_get_predictions(
 
     # We are only interested in the last 5 days.
     back_5_days = time_of_interest - datetime.timedelta(days=5)
-    return get_station_model_predictions_order_by_prediction_timestamp(
+    return get_station_model_prediction_summaries(
         session, station_codes, model, back_5_days, time_of_interest)
 
 
@@ -42,65 +43,51 @@ class ModelPredictionSummaryBuilder():
 
     def __init__(self):
         """ Prepare class. """
-        self.prev_time = None
         self.prev_station = None
-        self.values = None
-        self.prediction_summaries = []
+        self.prediction_summaries = {}
         self.prediction_summary = None
         self.stations: dict = None
 
-    def init_values(self):
-        """ Initialize values. """
-        self.values = {}
-        for key in KEYS:
-            self.values[key] = []
-
-    def calculate_and_append_percentiles(self,
-                                         timestamp: datetime.datetime,
-                                         values: dict) -> None:
-        """ Calculate percentiles and append.  """
-        data = {'datetime': timestamp}
-        for key in KEYS:
-            data['{}_5th'.format(key)] = percentile(values[key], 5)
-            data['{}_median'.format(key)] = percentile(values[key], 50)
-            data['{}_90th'.format(key)] = percentile(values[key], 90)
-        summary_value = WeatherModelPredictionSummaryValues(**data)
-        self.prediction_summary.values.append(summary_value)
-
-    def calculate_summaries(self, prev_time):
-        """ Calculate and append percentiles if present """
-        if self.values:
-            self.calculate_and_append_percentiles(self.prev_time, self.values)
-        self.prev_time = prev_time
-        self.values = None
-
     def handle_new_station(self,
-                           prediction: WeatherStationModelPrediction,
+                           station_code: int,
                            prediction_model: PredictionModel):
-        """ When a new station is detected, we need to:
-        -) calculate percentiles for accumulated values.
-        -) prepare a summary for the new station.
-        """
-        self.prev_station = prediction.station_code
+        """ When a new station is detected, we need to prepare a summary for the new station. """
+        self.prev_station = station_code
         self.prediction_summary = WeatherModelPredictionSummary(
-            station=self.stations[prediction.station_code],
+            station=self.stations[station_code],
             model=WeatherPredictionModel(name=prediction_model.name,
                                          abbrev=prediction_model.abbreviation),
             values=[])
-        self.prediction_summaries.append(self.prediction_summary)
-        # Set prev_time (so that we don't trigger calculate_summaries)
-        self.prev_time = prediction.prediction_timestamp
-
-    def accumulate_values(self, prediction: WeatherStationModelPrediction):
-        """ As we iterate through predictions, we accumulate the values so that we can calculate
-        the percentiles. """
-        for key in KEYS:
-            # Get the values.
-            key_value = getattr(prediction, key)
-            if key_value:
-                if not self.values:
-                    self.init_values()
-                self.values[key].append(key_value)
+        self.prediction_summaries[station_code] = self.prediction_summary
+
+    def append_percentiles(self,
+                           timestamp: datetime.datetime,
+                           percentiles: Tuple[float]) -> None:
+        """ Append the percentiles calculated by the database. The percentiles of a variable are None if there
+        were no values of it for this timestamp. """
+        if all(value is None for value in percentiles):
+            # There were no values for this timestamp.
+            return
+        data = dict(zip(SUMMARY_KEYS, percentiles))
+        data['datetime'] = timestamp
+        self.prediction_summary.values.append(WeatherModelPredictionSummaryValues(**data))
+
+    def build_summaries(
+            self,
+            model: ModelEnum,
+            station_codes: List[int],
+            time_of_interest: datetime) -> Dict[int, WeatherModelPredictionSummary]:
+        """ Query the database for the given station codes, and return summaries by station code. """
+        # Build database query
+        query = _build_query_to_get_summaries(station_codes, model, time_of_interest)
+
+        # Iterate through the result of our query, one row per station and prediction timestamp.
+        for prediction_model, station_code, prediction_timestamp, *percentiles in query:
+            if station_code != self.prev_station:
+                self.handle_new_station(station_code, prediction_model)
+            self.append_percentiles(prediction_timestamp, percentiles)
+
+        return self.prediction_summaries
 
     async def get_summaries(
             self,
@@ -113,28 +100,12 @@ class ModelPredictionSummaryBuilder():
             station.code: station for station in await
             app.stations.get_stations_by_codes(station_codes)}
 
-        # Build database query
-        new_query = _build_query_to_get_predictions(station_codes, model, time_of_interest)
-
-        # Iterate through the result of our query.
-        for prediction, prediction_model in new_query:
-            if prediction.station_code != self.prev_station:
-                # when the station changes, we need to process accumulated values and
-                # create new responses for the new station.
-                if self.prev_station is not None:
-                    # This isn't the 1st new station we've had, so before moving on,
-                    # we need to finish calculating the values for the previous station.
-                    self.calculate_summaries(prediction.prediction_timestamp)
-                self.handle_new_station(prediction, prediction_model)
-            elif self.prev_time != prediction.prediction_timestamp:
-                # The timestamp has changed, process the accumulated values:
-                self.calculate_summaries(prediction.prediction_timestamp)
-
-            # Accumulate the values (to be processed at next station change, time change, or when done):
-            self.accumulate_values(prediction)
-
-        self.calculate_summaries(None)
-        return self.prediction_summaries
+        # The summary of each station is cached separately, so that only the stations that haven't been
+        # requested before need to be queried.
+        summaries = fetch_station_fragments(
+            'model_prediction_summaries', (DataSourceEnum.WEATHER_MODELS,), (model, time_of_interest),
+            station_codes, lambda codes: self.build_summaries(model, codes, time_of_interest))
+        return [summaries[station_code] for station_code in sorted(summaries)]
 
 
 async def fetch_model_prediction_summaries(
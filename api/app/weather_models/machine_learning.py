@@ -1,19 +1,25 @@
 """ Module for calculating the bias for a weather station use basic Machine Learning through Linear
 Regression.
 """
-from datetime import datetime, timedelta
+from datetime import date, datetime, time, timedelta
 from collections import defaultdict
-from typing import List
+from itertools import product
+from typing import Dict, List, Tuple
 from logging import getLogger
-from sklearn.linear_model import LinearRegression
 from scipy.interpolate import griddata
 import numpy as np
 from sqlalchemy.orm import Session
-from app.weather_models import SCALAR_MODEL_VALUE_KEYS, construct_interpolated_noon_prediction
+from app.weather_models import (SCALAR_MODEL_VALUE_KEYS, MODEL_VALUE_KEYS,
+                                construct_interpolated_noon_predictions, use_time_series_storage,
+                                decode_time_series_slice)
 from app.db.models import (
     PredictionModel, PredictionModelGridSubset, ModelRunGridSubsetPrediction)
 from app.db.models.observations import HourlyActual
-from app.db.crud.observations import get_actuals_left_outer_join_with_predictions
+from app.db.crud.observations import (get_actuals_left_outer_join_with_predictions,
+                                      get_actuals_with_time_series_predictions)
+from app.db.crud.weather_models import (get_station_regression_sample_sums,
+                                        upsert_station_regression_sample_sums)
+import app.time_utils as time_utils
 
 
 logger = getLogger(__name__)
@@ -21,58 +27,112 @@ logger = getLogger(__name__)
 # Corresponding key values on HourlyActual and SampleCollection
 SAMPLE_VALUE_KEYS = ('temperature', 'relative_humidity')
 
+# Samples of the last couple of days may still change (observed values get corrected, and predictions from
+# later model runs come in), so the sums of those days aren't stored.
+DAYS_UNTIL_SAMPLES_SETTLED = 2
 
-class LinearRegressionWrapper:
-    """ Class wrapping LinearRegression.
-    This class just adds in a handy boolean to indicate if this linear regression model is good to use.
-    """
-
-    def __init__(self):
-        self.model = LinearRegression()
-        self.good_model = False  # Flag if regression model is "good" (usable).
+# If the variance of the model values is (relatively) this small, they're considered to be constant.
+VARIANCE_TOLERANCE = 1e-9
 
 
-class RegressionModels:
-    """ Class for storing regression models.
-    For each different reading, we have a seperate LinearRegression model.
+class SampleSums:
+    """ Class for storing the sums of samples, from which a linear regression can be calculated without
+    having to keep the samples themselves.
     """
 
-    keys = ('temperature_wrapper', 'relative_humidity_wrapper')
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 count: int = 0, sum_x: float = 0, sum_y: float = 0, sum_xx: float = 0, sum_xy: float = 0):
+        self.count = count
+        self.sum_x = sum_x
+        self.sum_y = sum_y
+        self.sum_xx = sum_xx
+        self.sum_xy = sum_xy
+
+    @staticmethod
+    def from_samples(x_values: List[float], y_values: List[float]):
+        """ Calculate the sums of the provided samples """
+        x_values = np.array(x_values, dtype=float)
+        y_values = np.array(y_values, dtype=float)
+        return SampleSums(len(x_values), x_values.sum(), y_values.sum(),
+                          (x_values * x_values).sum(), (x_values * y_values).sum())
+
+    def add(self, other: 'SampleSums'):
+        """ Add the sums of other samples to these sums """
+        self.count += other.count
+        self.sum_x += other.sum_x
+        self.sum_y += other.sum_y
+        self.sum_xx += other.sum_xx
+        self.sum_xy += other.sum_xy
+
+
+class HourlyLinearRegression:
+    """ Class for ordinary least squares linear regressions, with a single predictor, for each hour of the
+    day. The slopes and intercepts of all the hours are calculated in one go, and can be applied to many
+    values in one go.
+    """
 
     def __init__(self):
-        self.temperature_wrapper = LinearRegressionWrapper()
-        self.relative_humidity_wrapper = LinearRegressionWrapper()
+        self.slope = np.zeros(24)
+        self.intercept = np.zeros(24)
+        # Flag if regression model for the hour is "good" (usable).
+        self.good_model = np.zeros(24, dtype=bool)
+
+    def fit(self, sums_by_hour: Dict[int, SampleSums]):
+        """ Calculate the slopes and intercepts from the sums of the samples of each hour. As with sklearn's
+        LinearRegression, if the model values are all the same, the slope is 0 and the intercept is the
+        mean of the observed values. """
+        sums = np.zeros((5, 24))
+        for hour, hour_sums in sums_by_hour.items():
+            sums[:, hour] = (hour_sums.count, hour_sums.sum_x, hour_sums.sum_y,
+                             hour_sums.sum_xx, hour_sums.sum_xy)
+        count, sum_x, sum_y, sum_xx, sum_xy = sums
+        # NOTE: We could get fancy here, and evaluate how good the regression actually worked,
+        # how much sample data we actually had etc., and then not mark the model as being "good".
+        self.good_model = count > 0
+        # Hours without samples result in nan, but they're not "good", so it doesn't matter.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_x = sum_x / count
+            mean_y = sum_y / count
+            variance = sum_xx - sum_x * mean_x
+            covariance = sum_xy - sum_x * mean_y
+            self.slope = np.where(variance <= VARIANCE_TOLERANCE * sum_xx, 0.0, covariance / variance)
+        self.intercept = mean_y - self.slope * mean_x
+
+    def predict(self, values: np.ndarray, hours: np.ndarray) -> np.ndarray:
+        """ Predict the observed values, given model values and the hour of the day of each value.
+        : return: Predicted values, with nan where there's no value, or no good model for the hour.
+        """
+        hours = np.asarray(hours, dtype=int)
+        result = self.intercept[hours] + self.slope[hours] * np.asarray(values, dtype=float)
+        result[~self.good_model[hours]] = np.nan
+        return result
 
 
 class Samples:
-    """ Class for storing samples in buckets of hours.
+    """ Class for storing samples in buckets of days and hours.
     e.g. a temperature sample consists of an x axis (predicted values) and a y axis (observed values) put
-    together in hour buckets.
+    together in (date, hour) buckets.
     """
 
     def __init__(self):
         self._x = defaultdict(list)
         self._y = defaultdict(list)
 
-    def hours(self):
-        """ Return all the hours used to bucket samples together. """
+    def buckets(self):
+        """ Return all the (date, hour) buckets used to group samples together. """
         return self._x.keys()
 
     def append_x(self, value, timestamp: datetime):
         """ Append another predicted value. """
-        self._x[timestamp.hour].append(value)
+        self._x[(timestamp.date(), timestamp.hour)].append(value)
 
     def append_y(self, value, timestamp: datetime):
         """ Append another observered values. """
-        self._y[timestamp.hour].append(value)
-
-    def np_x(self, hour):
-        """ Return numpy array of the predicted values, reshaped appropriately. """
-        return np.array(self._x[hour]).reshape((-1, 1))
+        self._y[(timestamp.date(), timestamp.hour)].append(value)
 
-    def np_y(self, hour):
-        """ Return a numpy array of the observed values """
-        return np.array(self._y[hour])
+    def sums(self, bucket: Tuple[date, int]) -> SampleSums:
+        """ Return the sums of the samples in a (date, hour) bucket """
+        return SampleSums.from_samples(self._x[bucket], self._y[bucket])
 
     def add_sample(self,  # pylint: disable=too-many-arguments
                    points: List,
@@ -132,12 +192,14 @@ class StationMachineLearning:  # pylint: disable=too-many-instance-attributes
         self.points = points
         self.target_coordinate = target_coordinate
         self.station_code = station_code
-        self.regression_models = defaultdict(RegressionModels)
+        self.regressions = {sample_key: HourlyLinearRegression() for sample_key in SAMPLE_VALUE_KEYS}
         self.max_learn_date = max_learn_date
         # Maximum number of days to try to learn from. Experimentation has shown that
         # about two weeks worth of data starts giving fairly good results compared to human forecasters.
         # NOTE: This could be an environment variable.
         self.max_days_to_learn = 19
+        # The predictions of the grid are either stored as a time series, or as a row per prediction.
+        self.time_series_storage = use_time_series_storage()
 
     def _add_sample_to_collection(self,
                                   prediction: ModelRunGridSubsetPrediction,
@@ -157,59 +219,148 @@ class StationMachineLearning:  # pylint: disable=too-many-instance-attributes
                 # are None.
                 logger.warning('no model value for %s->%s', model_key, sample_key)
 
-    def _collect_data(self):
-        """ Collect data to use for machine learning.
+    def _get_actuals_with_time_series_predictions(self, start_date: datetime, end_date: datetime):
+        """ Yield hourly actuals for the station, each with the most recent prediction for the weather date
+        (or None, if there isn't a prediction), from start_date up to and including end_date.
+        Only the values of the weather date are read from the time series of the grid. """
+        for actual, prediction_run_timestamp, *slices in get_actuals_with_time_series_predictions(
+                self.session, self.grid.id, self.station_code, start_date, end_date):
+            if prediction_run_timestamp is None:
+                yield actual, None
+                continue
+            prediction = ModelRunGridSubsetPrediction(prediction_model_grid_subset_id=self.grid.id,
+                                                      prediction_timestamp=actual.weather_date)
+            for key, values in zip(MODEL_VALUE_KEYS, slices):
+                setattr(prediction, key, decode_time_series_slice(values))
+            yield actual, prediction
+
+    def _collect_data(self, start_date: datetime, end_date: datetime = None):
+        """ Collect data to use for machine learning, from the start date up to and including the end date
+        (by default, the max learn date).
         """
-        # Calculate the date to start learning from.
-        start_date = self.max_learn_date - \
-            timedelta(days=self.max_days_to_learn)
+        if end_date is None:
+            end_date = self.max_learn_date
         # Create a convenient structure to store samples in.
         sample_collection = SampleCollection()
 
-        # Query actuals, with prediction left outer joined (so if there isn't a prediction, you'll
-        # get an actual, but prediction will be None)
-        query = get_actuals_left_outer_join_with_predictions(
-            self.session, self.model.id, self.grid.id, self.station_code, start_date, self.max_learn_date)
+        # Query actuals, with the most recent prediction left outer joined (so if there isn't a prediction,
+        # you'll get an actual, but prediction will be None)
+        if self.time_series_storage:
+            query = self._get_actuals_with_time_series_predictions(start_date, end_date)
+        else:
+            query = get_actuals_left_outer_join_with_predictions(
+                self.session, self.model.id, self.grid.id, self.station_code, start_date, end_date)
         # We need to keep track of previous so that we can do interpolation for the global model.
         prev_actual = None
         prev_prediction = None
+        # The predictions to interpolate noon predictions between, and the corresponding noon actuals.
+        noon_prediction_pairs = []
+        noon_actuals = []
         for actual, prediction in query:
-            if prev_actual != actual and prediction is not None:
+            if prediction is not None:
                 if (prev_actual is not None
                         and prev_prediction is not None
                         and prev_actual.weather_date.hour == 20
                         and prediction.prediction_timestamp.hour == 21
                         and prev_prediction.prediction_timestamp.hour == 18):
-                    # If there's a gap in the data (like with the GLOBAL model) - then make up
-                    # a noon prediction using interpolation, and add it as a sample.
-                    noon_prediction = construct_interpolated_noon_prediction(prev_prediction, prediction)
-                    self._add_sample_to_collection(
-                        noon_prediction, prev_actual, sample_collection)
+                    noon_prediction_pairs.append((prev_prediction, prediction))
+                    noon_actuals.append(prev_actual)
 
                 self._add_sample_to_collection(
                     prediction, actual, sample_collection)
                 prev_prediction = prediction
             prev_actual = actual
+        # If there's a gap in the data (like with the GLOBAL model) - then make up
+        # noon predictions using interpolation (all in one go), and add them as samples.
+        for noon_prediction, actual in zip(construct_interpolated_noon_predictions(noon_prediction_pairs),
+                                           noon_actuals):
+            self._add_sample_to_collection(
+                noon_prediction, actual, sample_collection)
         return sample_collection
 
+    def _collect_unsummed_data(self, start_date: datetime, first_stored_date: date,
+                               collect_from: date) -> List[SampleCollection]:
+        """ Collect data for the (partial) first day of the learning window, and the days from collect_from
+        onwards. """
+        tzinfo = self.max_learn_date.tzinfo
+        if collect_from == first_stored_date:
+            return [self._collect_data(start_date)]
+        # The first day is collected on its own, as the days following it have been summed up.
+        first_day_end = datetime.combine(first_stored_date, time(), tzinfo=tzinfo) - timedelta(seconds=1)
+        return [self._collect_data(start_date, first_day_end),
+                self._collect_data(datetime.combine(collect_from, time(), tzinfo=tzinfo))]
+
+    def _get_sample_sums(self) -> Dict[Tuple[str, int], SampleSums]:
+        """ Get the sums of the samples to learn from, keyed on sample key and hour.
+        The sums of each day that has settled are stored, so samples only have to be collected for the days
+        that haven't been summed up before.
+        """
+        # Calculate the date to start learning from. The first day of the window is only learnt from as of
+        # that exact time, so its sums are never stored - only those of the days after it.
+        start_date = self.max_learn_date - timedelta(days=self.max_days_to_learn)
+        first_stored_date = start_date.date() + timedelta(days=1)
+        settled_date = (self.max_learn_date - timedelta(days=DAYS_UNTIL_SAMPLES_SETTLED)).date()
+        sample_sums = defaultdict(SampleSums)
+        collect_from = first_stored_date
+        for record in get_station_regression_sample_sums(
+                self.session, self.model.id, self.station_code, first_stored_date, settled_date):
+            sample_sums[(record.sample_key, record.hour)].add(SampleSums(
+                record.count, record.sum_x, record.sum_y, record.sum_xx, record.sum_xy))
+            collect_from = max(collect_from, record.sample_date + timedelta(days=1))
+
+        now = time_utils.get_utc_now()
+        settled_sample_sums = []
+        # collect data for the days that haven't been summed up yet.
+        for data, sample_key in product(
+                self._collect_unsummed_data(start_date, first_stored_date, collect_from), SAMPLE_VALUE_KEYS):
+            sample = getattr(data, sample_key)
+            for sample_date, hour in sample.buckets():
+                sums = sample.sums((sample_date, hour))
+                sample_sums[(sample_key, hour)].add(sums)
+                if first_stored_date <= sample_date < settled_date:
+                    settled_sample_sums.append({
+                        'prediction_model_id': self.model.id,
+                        'station_code': self.station_code,
+                        'sample_date': sample_date,
+                        'hour': hour,
+                        'sample_key': sample_key,
+                        'count': sums.count,
+                        'sum_x': sums.sum_x,
+                        'sum_y': sums.sum_y,
+                        'sum_xx': sums.sum_xx,
+                        'sum_xy': sums.sum_xy,
+                        'update_date': now
+                    })
+        # NOTE: The sums are committed along with the rest of the session.
+        upsert_station_regression_sample_sums(self.session, settled_sample_sums)
+        return sample_sums
+
     def learn(self):
         """ Collect data and perform linear regression.
         """
         # collect data
-        data = self._collect_data()
+        sample_sums = self._get_sample_sums()
+
+        # create a regression model for each variable, for all the hours in one go.
+        for sample_key, regression in self.regressions.items():
+            regression.fit({hour: sums for (key, hour), sums in sample_sums.items() if key == sample_key})
+
+    def predict(self, sample_key: str, model_values: np.ndarray, hours: np.ndarray) -> np.ndarray:
+        """ Predict the bias adjusted values of a variable for many points in time in one go.
+        : param sample_key: The variable, e.g. temperature.
+        : param model_values: Values as provided by the model.
+        : param hours: The hour of the day of each value.
+        : return: The bias adjusted values as predicted by the linear regression model, nan where there
+        isn't one.
+        """
+        return self.regressions[sample_key].predict(model_values, hours)
 
-        # iterate through the data, creating a regression model for each variable
-        # and each hour.
-        for sample_key, wrapper_key in zip(SAMPLE_VALUE_KEYS, RegressionModels.keys):
-            sample = getattr(data, sample_key)
-            for hour in sample.hours():
-                regression_model = getattr(
-                    self.regression_models[hour], wrapper_key)
-                regression_model.model.fit(
-                    sample.np_x(hour), sample.np_y(hour))
-                # NOTE: We could get fancy here, and evaluate how good the regression actually worked,
-                # how much sample data we actually had etc., and then not mark the model as being "good".
-                regression_model.good_model = True
+    def _predict_value(self, sample_key: str, model_value: float, timestamp: datetime):
+        """ Predict a single bias adjusted value, returning None if there isn't one. """
+        value = self.predict(sample_key, [model_value], [timestamp.hour])[0]
+        if np.isnan(value):
+            return None
+        return value
 
     def predict_temperature(self, model_temperature, timestamp):
         """ Predict the bias adjusted temperature for a given point in time, given a corresponding model
@@ -221,10 +372,7 @@ class StationMachineLearning:  # pylint: disable=too-many-instance-attributes
         if model_temperature is None:
             logger.warning('model temperature for %s was None', timestamp)
             return None
-        hour = timestamp.hour
-        if self.regression_models[hour].temperature_wrapper.good_model:
-            return self.regression_models[hour].temperature_wrapper.model.predict([[model_temperature]])[0]
-        return None
+        return self._predict_value('temperature', model_temperature, timestamp)
 
     def predict_rh(self, model_rh: float, timestamp: datetime):
         """ Predict the bias adjusted rh for a given point in time, given a corresponding model rh.
@@ -232,7 +380,6 @@ class StationMachineLearning:  # pylint: disable=too-many-instance-attributes
         : param timestamp: Datetime value for the predicted value.
         : return: The bias adjusted RH as predicted by the linear regression model.
         """
-        hour = timestamp.hour
-        if self.regression_models[hour].relative_humidity_wrapper.good_model and model_rh is not None:
-            return self.regression_models[hour].relative_humidity_wrapper.model.predict([[model_rh]])[0]
-        return None
+        if model_rh is None:
+            return None
+        return self._predict_value('relative_humidity', model_rh, timestamp)
@@ -1,21 +1,30 @@
 """ Read a grib file, and store values relevant to weather stations in database.
 """
 
+import os
 import math
+import json
 import struct
+import hashlib
 import logging
 import logging.config
-from typing import List
-from sqlalchemy.dialects.postgresql import array
+import tempfile
+from typing import Dict, List, Tuple
+import numpy
 import sqlalchemy.exc
 import gdal
 from pyproj import CRS, Transformer
+from geoalchemy2.shape import to_shape
 import app.db.database
+from app import config
+import app.time_utils as time_utils
 from app.stations import get_stations_synchronously
-from app.db.models import (
-    PredictionModel, PredictionModelRunTimestamp, ModelRunGridSubsetPrediction)
+from app.schemas.stations import WeatherStation
+from app.db.models import PredictionModel, PredictionModelRunTimestamp
 from app.db.crud.weather_models import (
-    get_prediction_model, get_or_create_prediction_run, get_or_create_grid_subset)
+    get_prediction_model, get_or_create_prediction_run, get_grid_subset_geom, get_grid_subsets,
+    create_grid_subsets, upsert_model_run_grid_subset_predictions, upsert_model_run_grid_subset_time_series)
+from app.weather_models import use_time_series_storage
 
 
 logger = logging.getLogger(__name__)
@@ -28,6 +37,10 @@ class PredictionModelNotFound(Exception):
     """ Exception raised when specified model cannot be found in database. """
 
 
+class GridSubsetNotFound(Exception):
+    """ Exception raised when a grid subset can neither be found, nor created, in the database. """
+
+
 class DatabaseException(Exception):
     """ Exception raised to to database related issue. """
 
@@ -68,6 +81,55 @@ def get_surrounding_grid(
     return points, values
 
 
+def get_surrounding_grids(
+        band: gdal.Dataset,
+        raster_coordinates: List[Tuple[int, int]]) -> List[Tuple[List[List[int]], List[float]]]:
+    """ Get the grids and values surrounding each of the given raster coordinates.
+    Instead of issuing two small reads per coordinate (see get_surrounding_grid), the window bounding all
+    the coordinates is read in one go, and the 2x2 neighbourhoods are extracted with a single
+    fancy-indexing operation - so the cost of reading the band is independent of the number of stations.
+    NOTE: Order of the points is super important! Vertices are ordered clockwise, values are also
+    ordered clockwise - exactly as per get_surrounding_grid.
+    """
+    if not raster_coordinates:
+        return []
+    indices = numpy.array(raster_coordinates, dtype=int).reshape((-1, 2))
+    offset = indices.min(axis=0)
+    size = indices.max(axis=0) - offset + 2
+    # Read the window covering all the coordinates (and the row/column beyond the furthest one).
+    # Values are converted to 32 bit floats, as is done when reading scanlines in get_surrounding_grid.
+    window = band.ReadAsArray(xoff=int(offset[0]), yoff=int(offset[1]),
+                              win_xsize=int(size[0]), win_ysize=int(size[1])).astype(numpy.float32)
+    # Row and column of the clockwise vertices: top left, top right, bottom right, bottom left.
+    values = window[indices[:, 1:2] - offset[1] + numpy.array([0, 0, 1, 1]),
+                    indices[:, 0:1] - offset[0] + numpy.array([0, 1, 1, 0])]
+
+    result = []
+    for (x_index, y_index), grid_values in zip(indices.tolist(), values.tolist()):
+        points = [[x_index, y_index], [x_index+1, y_index],
+                  [x_index+1, y_index+1], [x_index, y_index+1]]
+        result.append((points, grid_values))
+    return result
+
+
+def _calculate_raster_index(raster_long, raster_lat, padf_transform: List[float]):
+    """ Calculate the (unfloored) i, j index in the grib file for coordinates in the raster's projection.
+    Works on scalars as well as numpy arrays.
+    """
+    # Calculate the j index for point i,j in the grib file
+    x_numerator = (raster_long - padf_transform[0] - raster_lat/padf_transform[5] *
+                   padf_transform[2] + padf_transform[3] / padf_transform[5] *
+                   padf_transform[2]) / padf_transform[1]
+
+    y_numerator = (raster_lat - padf_transform[3] - raster_long/padf_transform[1] *
+                   padf_transform[4] + padf_transform[0] / padf_transform[1] *
+                   padf_transform[4]) / padf_transform[5]
+
+    denominator = 1 - padf_transform[4]/padf_transform[5]*padf_transform[2]/padf_transform[1]
+
+    return x_numerator/denominator, y_numerator/denominator
+
+
 def calculate_raster_coordinate(
         longitude: float,
         latitude: float,
@@ -80,21 +142,23 @@ def calculate_raster_coordinate(
     # to whichever projection and coordinate system the grib file is using
     raster_long, raster_lat = transformer.transform(longitude, latitude)
 
-    # Calculate the j index for point i,j in the grib file
-    x_numerator = (raster_long - padf_transform[0] - raster_lat/padf_transform[5] *
-                   padf_transform[2] + padf_transform[3] / padf_transform[5] *
-                   padf_transform[2]) / padf_transform[1]
+    i_index, j_index = _calculate_raster_index(raster_long, raster_lat, padf_transform)
 
-    y_numerator = (raster_lat - padf_transform[3] - raster_long/padf_transform[1] *
-                   padf_transform[4] + padf_transform[0] / padf_transform[1] *
-                   padf_transform[4]) / padf_transform[5]
+    return (math.floor(i_index), math.floor(j_index))
 
-    denominator = 1 - padf_transform[4]/padf_transform[5]*padf_transform[2]/padf_transform[1]
 
-    i_index = math.floor(x_numerator/denominator)
-    j_index = math.floor(y_numerator/denominator)
+def calculate_raster_coordinates(
+        longitudes: List[float],
+        latitudes: List[float],
+        padf_transform: List[float],
+        transformer: Transformer) -> List[List[int]]:
+    """ Vectorized version of calculate_raster_coordinate - transforming all the coordinates at once. """
+    raster_longs, raster_lats = transformer.transform(
+        numpy.array(longitudes, dtype=float), numpy.array(latitudes, dtype=float))
+
+    i_indices, j_indices = _calculate_raster_index(raster_longs, raster_lats, padf_transform)
 
-    return (i_index, j_index)
+    return numpy.stack((numpy.floor(i_indices), numpy.floor(j_indices)), axis=-1).astype(int).tolist()
 
 
 def calculate_geographic_coordinate(
@@ -128,6 +192,188 @@ def get_transformer(crs_from, crs_to):
     return Transformer.from_crs(crs_from, crs_to, always_xy=True)
 
 
+class StationRasterIndex():
+    """ For each station, the raster coordinate of the top left point of the surrounding grid, and the
+    geographic coordinates of the four (clockwise) vertices of that grid.
+    The index only depends on the stations, and the projection and geotransform of the grib file - so it
+    only needs to be calculated once per model projection.
+    """
+
+    def __init__(self, key: str, raster_coordinates: List[List[int]], geographic_points: List[List]):
+        self.key = key
+        self.raster_coordinates = raster_coordinates
+        self.geographic_points = geographic_points
+
+    def to_dict(self) -> dict:
+        """ Serializable representation of the index. """
+        return {'key': self.key,
+                'raster_coordinates': self.raster_coordinates,
+                'geographic_points': self.geographic_points}
+
+    @staticmethod
+    def from_dict(data: dict):
+        """ Construct an index from its serializable representation. """
+        return StationRasterIndex(data['key'], data['raster_coordinates'], data['geographic_points'])
+
+
+def get_station_raster_index_key(grib_info: ModelRunInfo,
+                                 wkt: str,
+                                 padf_transform: List[float],
+                                 stations: List[WeatherStation]) -> str:
+    """ Key uniquely identifying a station raster index. If the projection, the geotransform or the list
+    of stations changes, so does the key - invalidating any previously calculated index. """
+    fingerprint = json.dumps({
+        'model': grib_info.model_abbreviation,
+        'projection': grib_info.projection,
+        'wkt': wkt,
+        'padf_transform': list(padf_transform),
+        'stations': [(station.code, station.long, station.lat) for station in stations]})
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+def build_station_raster_index(key: str,
+                               stations: List[WeatherStation],
+                               wkt: str,
+                               padf_transform: List[float]) -> StationRasterIndex:
+    """ Calculate the raster coordinates and grid vertices for all the stations in one go. """
+    crs = CRS.from_string(wkt)
+    raster_coordinates = calculate_raster_coordinates(
+        [station.long for station in stations], [station.lat for station in stations],
+        padf_transform, get_transformer(GEO_CRS, crs))
+
+    # Convert all the (clockwise) vertices of all the grids to geographic coordinates.
+    raster_to_geo_transformer = get_transformer(crs, GEO_CRS)
+    x_indices, y_indices = numpy.array(raster_coordinates, dtype=float).reshape((-1, 2)).T
+    vertices = []
+    for x_offset, y_offset in ((0, 0), (1, 0), (1, 1), (0, 1)):
+        longitudes, latitudes = calculate_geographic_coordinate(
+            (x_indices + x_offset, y_indices + y_offset), padf_transform, raster_to_geo_transformer)
+        vertices.append(numpy.stack((longitudes, latitudes), axis=-1))
+    # Re-arrange from (vertex, station, coordinate) to (station, vertex, coordinate).
+    geographic_points = numpy.stack(vertices, axis=1).tolist()
+
+    return StationRasterIndex(key, raster_coordinates, geographic_points)
+
+
+def _get_station_raster_index_filename(grib_info: ModelRunInfo) -> str:
+    """ Location of the persisted station raster index for a model projection. """
+    # An empty value (as in .env.example) means the default location too.
+    path = config.get('STATION_RASTER_INDEX_PATH') or tempfile.gettempdir()
+    return os.path.join(path, 'station_raster_index_{}_{}.json'.format(
+        grib_info.model_abbreviation, grib_info.projection))
+
+
+def load_station_raster_index(grib_info: ModelRunInfo, key: str) -> StationRasterIndex:
+    """ Load the persisted station raster index for a model projection, returning None if there isn't one,
+    or if it's stale (i.e. it was calculated for another geotransform or list of stations.) """
+    filename = _get_station_raster_index_filename(grib_info)
+    try:
+        with open(filename, 'r') as file_pointer:
+            index = StationRasterIndex.from_dict(json.load(file_pointer))
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError):
+        # A missing or corrupt index is a cache miss - it's calculated (and saved) again.
+        return None
+    if index.key != key:
+        logger.info('station raster index %s is stale', filename)
+        return None
+    return index
+
+
+def save_station_raster_index(grib_info: ModelRunInfo, index: StationRasterIndex):
+    """ Persist the station raster index for a model projection, so that it can be re-used by subsequent
+    runs.
+    The index is written to a temporary file that is then renamed, so that concurrent runs never read a
+    partially written index. """
+    filename = _get_station_raster_index_filename(grib_info)
+    try:
+        with tempfile.NamedTemporaryFile(
+                'w', dir=os.path.dirname(filename), suffix='.part', delete=False) as file_pointer:
+            json.dump(index.to_dict(), file_pointer)
+        os.replace(file_pointer.name, filename)
+    except OSError as exception:
+        # Not being able to persist the index isn't fatal, it just means we'll have to calculate it again.
+        logger.warning('unable to save station raster index to %s', filename, exc_info=exception)
+
+
+def _get_vertices_key(geographic_points) -> tuple:
+    """ Key on the (clockwise) vertices of a grid subset. Coordinates are rounded, so that floating point
+    noise in the geotransform doesn't result in duplicate grid subsets. """
+    return tuple((round(longitude, 6), round(latitude, 6)) for longitude, latitude in geographic_points[:4])
+
+
+class GridSubsetRegistry():
+    """ In memory registry of the grid subsets of a prediction model.
+    The grid subsets of a model hardly ever change, so they are all loaded once, and then looked up by
+    raster coordinate - so that no spatial queries are needed when processing grib files.
+    """
+
+    def __init__(self, prediction_model_id: int):
+        self.prediction_model_id = prediction_model_id
+        # Grid subset ids, keyed on the vertices of the grid subset.
+        self.ids_by_vertices: Dict[tuple, int] = None
+        # Grid subset ids, keyed on the raster coordinate (i, j) of the top left vertex. The raster
+        # coordinates are only valid for the station raster index they were resolved for.
+        self.station_raster_index_key = None
+        self.ids_by_raster_coordinate: Dict[tuple, int] = {}
+
+    def _add(self, grid_subset_id: int, geom):
+        polygon = to_shape(geom)
+        # pylint: disable=no-member
+        self.ids_by_vertices[_get_vertices_key(polygon.exterior.coords)] = grid_subset_id
+
+    def load(self, session):
+        """ Load all the grid subsets of the model. """
+        self.ids_by_vertices = {}
+        for grid_subset in get_grid_subsets(session, self.prediction_model_id):
+            self._add(grid_subset.id, grid_subset.geom)
+        logger.info('loaded %s grid subsets for prediction model %s',
+                    len(self.ids_by_vertices), self.prediction_model_id)
+
+    def _create_missing(self, session, missing: List[List]):
+        """ Create the missing grid subsets, in one batch. Grid subsets created by another process in the
+        meantime are returned with their existing id, rather than duplicated. """
+        for grid_subset_id, geom in create_grid_subsets(
+                session, self.prediction_model_id, [get_grid_subset_geom(points) for points in missing]):
+            self._add(grid_subset_id, geom)
+        # Commit right away, since the ids are kept for the lifetime of the process.
+        session.commit()
+
+    def get_grid_subset_ids(self, session, station_raster_index: StationRasterIndex) -> List[int]:
+        """ Get the grid subset id for each station in the station raster index, creating grid subsets
+        that don't exist yet. """
+        if self.station_raster_index_key != station_raster_index.key:
+            if self.ids_by_vertices is None:
+                self.load(session)
+            missing = {}
+            for points in station_raster_index.geographic_points:
+                if _get_vertices_key(points) not in self.ids_by_vertices:
+                    missing[_get_vertices_key(points)] = points
+            if missing:
+                self._create_missing(session, list(missing.values()))
+            ids_by_raster_coordinate = {}
+            for raster_coordinate, points in zip(station_raster_index.raster_coordinates,
+                                                 station_raster_index.geographic_points):
+                grid_subset_id = self.ids_by_vertices.get(_get_vertices_key(points))
+                if grid_subset_id is None:
+                    raise GridSubsetNotFound('Could not find or create grid subset', points)
+                ids_by_raster_coordinate[tuple(raster_coordinate)] = grid_subset_id
+            self.ids_by_raster_coordinate = ids_by_raster_coordinate
+            self.station_raster_index_key = station_raster_index.key
+        return [self.ids_by_raster_coordinate[tuple(raster_coordinate)]
+                for raster_coordinate in station_raster_index.raster_coordinates]
+
+
+# Grid subset registries for the lifetime of the process, keyed on prediction model id.
+_grid_subset_registries: Dict[int, GridSubsetRegistry] = {}
+
+
+def get_grid_subset_registry(prediction_model: PredictionModel) -> GridSubsetRegistry:
+    """ Get the process wide grid subset registry of a prediction model. """
+    if prediction_model.id not in _grid_subset_registries:
+        _grid_subset_registries[prediction_model.id] = GridSubsetRegistry(prediction_model.id)
+    return _grid_subset_registries[prediction_model.id]
+
+
 class GribFileProcessor():
     """ Instances of this object can be used to process and ingest a grib file.
     """
@@ -137,9 +383,10 @@ class GribFileProcessor():
         self.stations = get_stations_synchronously()
         self.session = app.db.database.get_write_session()
         self.padf_transform = None
-        self.raster_to_geo_transformer = None
-        self.geo_to_raster_transformer = None
+        self.station_raster_index: StationRasterIndex = None
         self.prediction_model = None
+        # Store the values as a time series per model run and grid subset, instead of a row per prediction.
+        self.time_series_storage = use_time_series_storage()
 
     def get_prediction_model(self, grib_info: ModelRunInfo) -> PredictionModel:
         """ Get the prediction model, raising an exception if not found """
@@ -151,51 +398,53 @@ class GribFileProcessor():
                 grib_info.model_abbreviation, grib_info.projection)
         return prediction_model
 
+    def get_station_raster_index(self, grib_info: ModelRunInfo, wkt: str) -> StationRasterIndex:
+        """ Get the station raster index for this grib file. The index is only calculated if neither the
+        index we already have in memory, nor the persisted index, match the projection, geotransform and
+        list of stations. """
+        key = get_station_raster_index_key(grib_info, wkt, self.padf_transform, self.stations)
+        if self.station_raster_index is not None and self.station_raster_index.key == key:
+            return self.station_raster_index
+        index = load_station_raster_index(grib_info, key)
+        if index is None:
+            logger.info('calculating station raster index for %s %s',
+                        grib_info.model_abbreviation, grib_info.projection)
+            index = build_station_raster_index(key, self.stations, wkt, self.padf_transform)
+            save_station_raster_index(grib_info, index)
+        return index
+
     def yield_data_for_stations(self, raster_band: gdal.Dataset):
         """ Given a list of stations, and a gdal dataset, yield relevant data
         """
-        for station in self.stations:
-            longitude = station.long
-            latitude = station.lat
-
-            x_coordinate, y_coordinate = calculate_raster_coordinate(
-                longitude, latitude, self.padf_transform, self.geo_to_raster_transformer)
-
-            points, values = get_surrounding_grid(
-                raster_band, x_coordinate, y_coordinate)
+        # Read the band once for all the stations, rather than once per station.
+        grids = get_surrounding_grids(raster_band, self.station_raster_index.raster_coordinates)
+        for (points, values), geographic_points in zip(grids, self.station_raster_index.geographic_points):
+            yield (points, values, geographic_points)
 
-            yield (points, values)
-
-    def store_bounding_values(self, points, values, preduction_model_run: PredictionModelRunTimestamp,
+    def store_bounding_values(self, data_for_stations,
+                              preduction_model_run: PredictionModelRunTimestamp,
                               grib_info: ModelRunInfo):
-        """ Store the values around the area of interest.
+        """ Store the values around the areas of interest, for all the stations in one go.
         """
-        # Convert points to geographic coordinates:
-        geographic_points = []
-        for point in points:
-            geographic_points.append(
-                calculate_geographic_coordinate(point, self.padf_transform, self.raster_to_geo_transformer))
-        # Get the grid subset, i.e. the relevant bounding area for this particular model.
-        grid_subset = get_or_create_grid_subset(
-            self.session, self.prediction_model, geographic_points)
-
-        # Load the record if it exists.
-        # pylint: disable=no-member
-        prediction = self.session.query(ModelRunGridSubsetPrediction).\
-            filter(
-                ModelRunGridSubsetPrediction.prediction_model_run_timestamp_id == preduction_model_run.id).\
-            filter(ModelRunGridSubsetPrediction.prediction_timestamp == grib_info.prediction_timestamp).\
-            filter(ModelRunGridSubsetPrediction.prediction_model_grid_subset_id ==
-                   grid_subset.id).first()
-        if not prediction:
-            # Record doesn't exist, so we create it.
-            prediction = ModelRunGridSubsetPrediction()
-            prediction.prediction_model_run_timestamp_id = preduction_model_run.id
-            prediction.prediction_timestamp = grib_info.prediction_timestamp
-            prediction.prediction_model_grid_subset_id = grid_subset.id
-
-        setattr(prediction, grib_info.variable_name.lower(), array(values))
-        self.session.add(prediction)
+        # Get the grid subsets, i.e. the relevant bounding areas for this particular model.
+        grid_subset_ids = get_grid_subset_registry(self.prediction_model).get_grid_subset_ids(
+            self.session, self.station_raster_index)
+        values_by_grid_subset = {}
+        for grid_subset_id, (_, values, _) in zip(grid_subset_ids, data_for_stations):
+            # Stations that share a grid subset have the same values, so we only store them once.
+            values_by_grid_subset[grid_subset_id] = values
+
+        if self.time_series_storage:
+            prediction_hour = int((grib_info.prediction_timestamp -
+                                   grib_info.model_run_timestamp).total_seconds() // 3600)
+            upsert_model_run_grid_subset_time_series(
+                self.session, preduction_model_run.id, prediction_hour, grib_info.variable_name,
+                values_by_grid_subset, time_utils.get_utc_now())
+        else:
+            upsert_model_run_grid_subset_predictions(
+                self.session, preduction_model_run.id, grib_info.prediction_timestamp,
+                grib_info.variable_name, values_by_grid_subset)
+        # Commit once per file.
         self.session.commit()
 
     def process_grib_file(self, filename, grib_info: ModelRunInfo):
@@ -207,11 +456,10 @@ class GribFileProcessor():
             # Ensure that grib file uses EPSG:4269 (NAD83) coordinate system
             # (this step is included because HRDPS grib files are in another coordinate system)
             wkt = dataset.GetProjection()
-            crs = CRS.from_string(wkt)
-            self.raster_to_geo_transformer = get_transformer(crs, GEO_CRS)
-            self.geo_to_raster_transformer = get_transformer(GEO_CRS, crs)
 
             self.padf_transform = get_dataset_geometry(dataset)
+            # get the raster coordinates and surrounding grids of all the stations:
+            self.station_raster_index = self.get_station_raster_index(grib_info, wkt)
             # get the model (.e.g. GPDS/RDPS latlon24x.24):
             self.prediction_model = self.get_prediction_model(grib_info)
 
@@ -221,10 +469,9 @@ class GribFileProcessor():
 
             raster_band = dataset.GetRasterBand(1)
 
-            # Iterate through stations:
-            for (points, values) in self.yield_data_for_stations(raster_band):
-                self.store_bounding_values(
-                    points, values, prediction_run, grib_info)
+            # Store the values for all the stations:
+            self.store_bounding_values(
+                self.yield_data_for_stations(raster_band), prediction_run, grib_info)
         except sqlalchemy.exc.OperationalError as exception:
             # Sometimes this exception is thrown with a "server closed the connection unexpectedly" error.
             # This could happen due to the connection being closed.
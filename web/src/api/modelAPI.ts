@@ -3,12 +3,12 @@ import { Station } from 'api/stationAPI'
 
 export interface ModelSummary {
   datetime: string
-  tmp_tgl_2_5th: number
-  tmp_tgl_2_median: number
-  tmp_tgl_2_90th: number
-  rh_tgl_2_5th: number
-  rh_tgl_2_median: number
-  rh_tgl_2_90th: number
+  tmp_tgl_2_5th: number | null
+  tmp_tgl_2_median: number | null
+  tmp_tgl_2_90th: number | null
+  rh_tgl_2_5th: number | null
+  rh_tgl_2_median: number | null
+  rh_tgl_2_90th: number | null
 }
 
 interface ModelInfo {
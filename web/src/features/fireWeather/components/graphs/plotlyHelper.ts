@@ -71,10 +71,10 @@ interface TempRHValue {
   datetime: string
   temperature?: number | null
   relative_humidity?: number | null
-  tmp_tgl_2_5th?: number
-  tmp_tgl_2_90th?: number
-  rh_tgl_2_5th?: number
-  rh_tgl_2_90th?: number
+  tmp_tgl_2_5th?: number | null
+  tmp_tgl_2_90th?: number | null
+  rh_tgl_2_5th?: number | null
+  rh_tgl_2_90th?: number | null
   tmp_max?: number
   tmp_min?: number
   rh_max?: number